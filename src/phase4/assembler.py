@@ -3,7 +3,7 @@
 # ./assembler.py asm_compiler.asm asm_compiler.bin
 
 import sys
-from opcode import Opcode
+from opcodes import Opcode
 
 class Assembler:
     MAX_REG = 32
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+# ./batch.py prog.bin < jobs.txt
+# jobs.txt has one job per line: the program's arguments, separated by spaces
+
+# Batch executor: runs one binary many times with different argv/stdin across a pool of worker processes
+# The binary is loaded once into a multiprocessing.shared_memory segment laid out like guest memory.
+# Each worker maps that segment copy-on-write as its ISA's memory (see memory.py): the image is shared by
+# every worker and only the pages a run writes get private copies. A worker snapshots its ISA once and
+# restores it before every job, which drops the written pages back to the image and keeps the decoded
+# instructions and translated blocks of code no job rewrote.
+#
+# run(jobs) takes (argv, stdin bytes) pairs and returns one dict per job, in order:
+# stdout (bytes), reg (final registers), instructions (retired), status (see result.py), error (str or None), elapsed
+
+import io
+import os
+import sys
+import time
+import multiprocessing
+from multiprocessing import shared_memory
+from isa import ISA
+from memory import Memory
+
+class Batch:
+    worker = None # (ISA, snapshot, engine, max_instructions, max_seconds) in each worker process
+
+    def __init__(self, input_fn, processes=None, engine="block", max_instructions=None, max_seconds=None):
+        if engine not in ("cache", "block"):
+            raise ValueError(f"Engine ({engine}) does not count instructions, expected one of ['cache', 'block']")
+        self.engine = engine
+        self.max_instructions = max_instructions
+        self.max_seconds = max_seconds
+
+        isa = ISA()
+        with open(input_fn, "rb") as b:
+            DATA_OFFSET, DATA_LENGTH, CODE_OFFSET, CODE_LENGTH, ENTRY_POINT = isa.read_header(b)
+            TOTAL_LENGTH = DATA_LENGTH + CODE_LENGTH
+            if TOTAL_LENGTH > isa.MEM_SIZE:
+                raise OverflowError(f"Binary instructions exceed memory size: {TOTAL_LENGTH} bytes >= {isa.MEM_SIZE} bytes")
+            b.seek(DATA_OFFSET)
+            image = b.read(TOTAL_LENGTH)
+        self.entry = ENTRY_POINT - isa.HEADER_LENGTH
+
+        # Sized like guest memory so workers can map all of it, the pages past the image are never touched
+        self.shm = shared_memory.SharedMemory(create=True, size=isa.MEM_SIZE)
+        self.shm.buf[0 : len(image)] = image
+        self.pool = multiprocessing.Pool(processes, initializer=Batch.init_worker,
+                                         initargs=(self.shm.name, len(image), self.entry, engine, max_instructions, max_seconds))
+
+    def run(self, jobs, chunksize=1):
+        return self.pool.map(Batch.run_job, jobs, chunksize)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @classmethod
+    def init_worker(cls, name, length, entry, engine, max_instructions, max_seconds):
+        path = f"/dev/shm/{name}"
+        if os.path.exists(path):
+            # POSIX shared memory is a tmpfs file on Linux, mapped privately it is copy-on-write
+            fd = os.open(path, os.O_RDONLY)
+            memory = Memory(ISA.MEM_SIZE, fd)
+            os.close(fd)
+            isa = ISA(memory)
+        else:
+            # No file to map, each worker copies the image once instead
+            shm = shared_memory.SharedMemory(name)
+            isa = ISA()
+            isa.memory.write(0, shm.buf[0 : length])
+            shm.close()
+        isa.pc = entry
+        cls.worker = (isa, isa.snapshot(), engine, max_instructions, max_seconds)
+
+    @classmethod
+    def run_job(cls, job):
+        isa, snapshot, engine, max_instructions, max_seconds = cls.worker
+        argv, stdin = job
+        isa.restore(snapshot)
+        isa.load_argv_into_mem(len(argv) if argv else 0, argv)
+        stdout = io.BytesIO()
+        isa.console.stdin = io.BytesIO(stdin or b"")
+        isa.console.stdout = stdout
+        if max_instructions is None:
+            max_instructions = float("inf") # Still counts instructions
+        result = isa.resume(engine, max_instructions, max_seconds)
+        return {
+            "stdout": stdout.getvalue(),
+            "reg": list(isa.reg),
+            "instructions": result.instructions,
+            "status": result.status,
+            "error": repr(result.error) if result.error is not None else None,
+            "elapsed": result.elapsed
+        }
+
+if __name__ == '__main__':
+    if (len(sys.argv) > 1):
+        jobs = [(line.split(), b"") for line in sys.stdin.read().splitlines()]
+        start = time.perf_counter()
+        with Batch(sys.argv[1]) as batch:
+            results = batch.run(jobs)
+        for job, result in zip(jobs, results):
+            print(f"== {' '.join(job[0])}: {result['status']}, {result['instructions']} instructions")
+            sys.stdout.write(result["stdout"].decode("latin-1"))
+        print(f"{len(jobs)} jobs in {time.perf_counter() - start:.3f}s", file=sys.stderr)
@@ -0,0 +1,11 @@
+#!/usr/bin/env python3
+
+# Raised by a SYS port handler that cannot finish without waiting, e.g. the scheduler's stand-in for STDIN/FILE ports
+# The instruction has not run: pc still points at the SYS and registers, sp and memory are as they were before it,
+# so whoever completes the call sets rx and moves pc past the SYS before resuming (see scheduler.py).
+
+class Blocked(Exception):
+    def __init__(self, port, rx):
+        super().__init__(f"Blocked on port (0x{port:04X}) into R{rx}")
+        self.port = port
+        self.rx = rx
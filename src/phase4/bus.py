@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+# Device bus for the phase4 ISA
+# Devices plug in through attach() and claim SYS port numbers and memory-mapped I/O windows from it.
+# A claimed port is bound once: decode puts the device's handler straight into the cached entry,
+# so a SYS costs one call instead of a chain of port name comparisons.
+#
+# Port handlers are called as handler(rx, *args) with the arguments given to claim_port.
+# MMIO windows are write-triggered: stores land in guest memory like any other store, then a store that
+# overlaps [mmio_lo, mmio_hi) is passed to store(), which calls device.store(addr, value, width) on the
+# window's device. Reads need no hook, a device refreshes its window bytes when it is written to
+# (e.g. the timer latches the clock into memory on a store to its control register).
+# Store handlers run in the middle of translated blocks, they must not read or write registers.
+
+class Bus:
+    def __init__(self, isa):
+        self.isa = isa
+        self.devices = []
+        self.ports = {}   # Port number -> (handler, args)
+        self.names = {}   # Port number -> call name, e.g. 0x0003 -> "STDOUT_CHAR"
+        self.rebound = {} # Port number -> (handler, args) set by rebind_port, ISA.fork carries them to the child
+        self.windows = [] # (start, end, device) sorted by start
+        self.mmio_lo = isa.MEM_SIZE # Lowest address covered by a window, stores below it skip the bus
+        self.mmio_hi = 0            # Highest address (exclusive) covered by a window
+
+    def attach(self, device):
+        self.devices.append(device)
+        device.attach(self.isa)
+
+    def claim_port(self, port, name, handler, *args):
+        if port in self.ports:
+            raise ValueError(f"Port (0x{port:04X}) already claimed by {self.names[port]}")
+        self.ports[port] = (handler, args)
+        self.names[port] = name
+
+    def rebind_port(self, port, handler, *args):
+        # Replaces the handler of a claimed port, e.g. to intercept calls (ISA.attach/decode caches must be empty)
+        if port not in self.ports:
+            raise ValueError(f"Port (0x{port:04X}) is not claimed")
+        self.ports[port] = (handler, args)
+        self.rebound[port] = (handler, args)
+
+    def claim_window(self, start, length, device):
+        end = start + length
+        if start < 0 or end > self.isa.MEM_SIZE:
+            raise ValueError(f"Invalid MMIO window at address ({start}) of {length} bytes")
+        for lo, hi, other in self.windows:
+            if start < hi and lo < end:
+                raise ValueError(f"MMIO window at address ({start}) overlaps {type(other).__name__} at ({lo})")
+        self.windows.append((start, end, device))
+        self.windows.sort(key=lambda window: window[0])
+        self.mmio_lo = min(self.mmio_lo, start)
+        self.mmio_hi = max(self.mmio_hi, end)
+
+    def store(self, addr, value, width):
+        for start, end, device in self.windows:
+            if addr < end and start < addr + width:
+                device.store(addr - start, value, width)
+
+    def reset(self):
+        for device in self.devices:
+            device.reset()
+
+    def snapshot(self):
+        return [device.snapshot() for device in self.devices]
+
+    def restore(self, states):
+        for device, state in zip(self.devices, states):
+            device.restore(state)
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 """
-Script to clear all .bin, .hex, .dbg, .symbols files and debug_log.txt in the current directory and subdirectories.
+Script to clear all .bin, .hex, .dbg, .symbols, .folded files and test_file.txt in the current directory and subdirectories.
 """
 
 import os
@@ -14,7 +14,7 @@ def clear_bin_files():
     os.chdir(script_dir)
     
     # File patterns to delete
-    patterns = ["**/*.bin", "**/*.hex", "**/*.dbg", "**/*.symbols", "**/debug_log.txt", "**/test_file.txt"]
+    patterns = ["**/*.bin", "**/*.hex", "**/*.dbg", "**/*.symbols", "**/*.folded", "**/test_file.txt"] # *.bin covers debug_trace.bin
     all_files = []
     counts = {}
 
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+# ./client.py prog.bin [args]    - runs prog.bin on a running ./daemon.py, stdin (unless a terminal) is sent along
+# ./client.py                    - prints the daemon's counters
+
+# Client for daemon.py, kept to the standard library so a run costs little more than Python startup
+# (importing the ISA alone takes longer than most test programs run). See daemon.py for the protocol.
+
+import os
+import sys
+import json
+import socket
+
+class Client:
+    SOCKET_PATH = os.environ.get("PHASE4_SOCKET", "/tmp/phase4.sock")
+
+    def __init__(self, path=SOCKET_PATH):
+        self.path = path
+
+    def request(self, request, stdout=None):
+        # Sends one request and writes the streamed output to stdout (a binary file), returns the final response
+        if stdout is None:
+            stdout = sys.stdout.buffer
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(self.path)
+            client.sendall(json.dumps(request).encode() + b"\n")
+            for line in client.makefile("rb"):
+                response = json.loads(line)
+                if "stdout" not in response:
+                    return response
+                stdout.write(response["stdout"].encode("latin-1"))
+                stdout.flush()
+        raise ConnectionError(f"Daemon at {self.path} closed the connection before the run finished")
+
+    def run(self, input_fn, argv=None, stdin=b"", stdout=None, **options):
+        # options: engine, max_instructions, max_seconds
+        request = {"path": os.path.abspath(input_fn), "argv": argv or [], "stdin": stdin.decode("latin-1")}
+        request.update(options)
+        return self.request(request, stdout)
+
+    def stats(self):
+        return self.request({"stats": True})
+
+if __name__ == '__main__':
+    client = Client()
+    if (len(sys.argv) > 1):
+        stdin = sys.stdin.buffer.read() if not sys.stdin.isatty() else b""
+        response = client.run(sys.argv[1], sys.argv[2:], stdin)
+        print(f"{response['status']}, {response['instructions']} instructions in {response['elapsed']:.3f}s"
+              f"{' (warm)' if response['warm'] else ''}", file=sys.stderr)
+        if response["error"] is not None:
+            print(response["error"], file=sys.stderr)
+            sys.exit(1)
+        if response["status"] != "halted":
+            sys.exit(2)
+    else:
+        print(json.dumps(client.stats(), indent=2))
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+# Console device for the phase4 ISA
+# SYS STDOUT ports append raw bytes here instead of calling print() once per character.
+# The buffer is written to sys.stdout when it holds line_threshold newlines or buffer_size bytes,
+# and it is flushed before STDIN reads, FILE operations and at HALT.
+# Bytes are written as latin-1 text, the same characters print(chr(byte)) produced.
+# STDIN ports read from the buffered sys.stdin.buffer, bulk reads go straight into guest memory.
+# stdin and stdout can be pointed at binary files instead (e.g. per ISA when many run in one process),
+# output then reaches stdout as the raw bytes.
+#
+# MMIO window at MMIO_START + WINDOW (see bus.py):
+# +0 OUT - a store writes its low byte to the console, same as STDOUT_CHAR_NR
+
+import sys
+
+class Console:
+    BUFFER_SIZE = 64 * 1024
+
+    WINDOW = 0x00
+    WINDOW_LENGTH = 8
+
+    def __init__(self, buffer_size=BUFFER_SIZE, line_threshold=None):
+        self.buf = bytearray()
+        self.buffer_size = buffer_size
+        if line_threshold is None:
+            line_threshold = 1 if sys.stdout.isatty() else 64 # Line buffered on a terminal
+        self.line_threshold = line_threshold
+        self.lines = 0
+        self.stdin = None  # Binary file for the STDIN ports, None reads sys.stdin.buffer
+        self.stdout = None # Binary file for the buffered output, None writes sys.stdout
+
+    def attach(self, isa):
+        self.isa = isa
+        bus = isa.bus
+        bus.claim_port(0x0000, "STDIN_INT", self.STDIN_INT)
+        bus.claim_port(0x0001, "STDIN_CHAR", self.STDIN_CHAR)
+
+        bus.claim_port(0x0002, "STDOUT_INT", self.STDOUT_INT)
+        bus.claim_port(0x0003, "STDOUT_CHAR", self.STDOUT_CHAR)
+        bus.claim_port(0x0004, "STDOUT_INT_NR", self.STDOUT_INT_NR)
+        bus.claim_port(0x0005, "STDOUT_CHAR_NR", self.STDOUT_CHAR_NR)
+        bus.claim_port(0x0006, "STDOUT_STR", self.STDOUT_STR)       # INPUT - Rx: MEMORY ADDRESS TO FIRST CHAR IN STRING
+        bus.claim_port(0x0007, "STDOUT_STR_NR", self.STDOUT_STR_NR) # INPUT - Rx: MEMORY ADDRESS TO FIRST CHAR IN STRING
+
+        # Bulk input, bytes go straight into memory
+        bus.claim_port(0x0008, "STDIN_LINE", self.STDIN_LINE) # INPUT - R0: BUFFER MEMORY ADDRESS, R1: MAX NUMBER OF BYTES (longer lines continue on the next call) # OUTPUT - Rx: LENGTH WITHOUT THE NEWLINE, FOLLOWED BY A NUL, -1 (0xFFFFFFFFFFFFFFFF) at EOF
+        bus.claim_port(0x0009, "STDIN_READ", self.STDIN_READ) # INPUT - R0: BUFFER MEMORY ADDRESS, R1: NUMBER OF BYTES TO READ                                        # OUTPUT - Rx: NUMBER OF BYTES READ, 0 at EOF
+
+        bus.claim_window(isa.MMIO_START + self.WINDOW, self.WINDOW_LENGTH, self)
+
+    def write(self, data):
+        self.buf += data
+        self.lines += data.count(b"\n")
+        if self.lines >= self.line_threshold or len(self.buf) >= self.buffer_size:
+            self.flush()
+
+    def write_line(self, data):
+        self.buf += data
+        self.buf += b"\n"
+        self.lines += data.count(b"\n") + 1
+        if self.lines >= self.line_threshold or len(self.buf) >= self.buffer_size:
+            self.flush()
+
+    def write_char(self, val, end):
+        if val <= 0xFF:
+            self.write(bytes((val,)) + end)
+        else:
+            # Not a byte, printed as the Unicode character like before
+            self.flush()
+            if self.stdout is not None:
+                self.stdout.write(chr(val).encode() + end)
+            else:
+                print(chr(val), end=end.decode())
+
+    def flush(self):
+        stdout = self.stdout
+        if self.buf:
+            if stdout is not None:
+                stdout.write(self.buf)
+            else:
+                sys.stdout.write(self.buf.decode("latin-1"))
+            self.buf.clear()
+            self.lines = 0
+        if stdout is not None:
+            stdout.flush()
+        else:
+            sys.stdout.flush()
+
+    def input(self):
+        return self.stdin if self.stdin is not None else sys.stdin.buffer
+
+    def read_line(self):
+        # One line for STDIN_INT/STDIN_CHAR, through the same buffer as the bulk ports so they can be mixed
+        line = self.input().readline()
+        if not line:
+            raise EOFError("EOF when reading a line")
+        return line
+
+    def STDIN_INT(self, rx):
+        self.flush()
+        self.isa.reg[rx] = int(self.read_line().strip()) & self.isa.DW_MASK
+
+    def STDIN_CHAR(self, rx):
+        self.flush()
+        self.isa.reg[rx] = self.read_line().strip()[0]
+
+    def STDOUT_INT(self, rx):
+        self.write_line(str(self.isa.reg[rx]).encode())
+
+    def STDOUT_CHAR(self, rx):
+        self.write_char(self.isa.reg[rx], b"\n")
+
+    def STDOUT_INT_NR(self, rx):
+        self.write(str(self.isa.reg[rx]).encode())
+
+    def STDOUT_CHAR_NR(self, rx):
+        self.write_char(self.isa.reg[rx], b"")
+
+    def STDOUT_STR(self, rx):
+        self.write_line(self.isa.read_str(self.isa.reg[rx]))
+
+    def STDOUT_STR_NR(self, rx):
+        self.write(self.isa.read_str(self.isa.reg[rx]))
+
+    def STDIN_LINE(self, rx):
+        isa = self.isa
+        addr = isa.reg[0]
+        n = isa.reg[1]
+        self.flush()
+        if addr + n + 1 > isa.MEM_SIZE:
+            raise IndexError(f"STDIN_LINE of {n} bytes at address ({addr}) exceeds memory size ({isa.MEM_SIZE})")
+        line = self.input().readline(n)
+        if not line and n:
+            isa.reg[rx] = isa.DW_MASK
+            return
+        if line.endswith(b"\n"):
+            line = line[:-1]
+        isa.memory.write(addr, line + b"\0")
+        if isa.code_lo < addr + len(line) + 1 and addr < isa.code_hi:
+            isa.invalidate(addr, len(line) + 1)
+        isa.reg[rx] = len(line)
+
+    def STDIN_READ(self, rx):
+        isa = self.isa
+        addr = isa.reg[0]
+        n = isa.reg[1]
+        self.flush()
+        if addr + n > isa.MEM_SIZE:
+            raise IndexError(f"STDIN_READ of {n} bytes at address ({addr}) exceeds memory size ({isa.MEM_SIZE})")
+        count = self.input().readinto(isa.memory.view[addr : addr + n]) or 0
+        if count:
+            isa.memory.mark(addr, count)
+            if isa.code_lo < addr + count and addr < isa.code_hi:
+                isa.invalidate(addr, count)
+        isa.reg[rx] = count
+
+    def store(self, offset, value, width):
+        if offset == 0:
+            self.write(bytes((value & 0xFF,)))
+
+    def reset(self):
+        pass
+
+    def snapshot(self):
+        return None
+
+    def restore(self, state):
+        pass
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+# ./daemon.py    - serves on Client.SOCKET_PATH (PHASE4_SOCKET or /tmp/phase4.sock) until interrupted
+# ./client.py prog.bin [args] runs a program on it
+
+# Emulator daemon: keeps a pool of ISAs alive behind a local Unix socket so a run costs no Python startup,
+# Enum construction or 4 MB allocation. Each ISA remembers the last binary it loaded as a snapshot
+# (see isa.py): a request for that binary goes to that ISA and restores it, which keeps its decoded
+# instructions and translated blocks warm. Other binaries take the least recently used idle ISA and are
+# loaded from scratch (reset only clears the dirty pages).
+#
+# Programs run on a thread pool, one thread per ISA, so a run never stalls the event loop and the
+# other connections keep streaming. Console output goes out as it is flushed, line by line.
+#
+# Protocol: one JSON object per line each way, any number of requests per connection.
+# Request:  path (binary on the daemon's filesystem) or binary (base64), argv (list of str),
+#           stdin (latin-1 str), engine ("cache" or "block"), max_instructions, max_seconds - all but path/binary optional
+#           {"stats": true} instead returns the daemon's counters
+# Response: {"stdout": latin-1 str} for every chunk of output, then one line with
+#           status (see result.py), instructions (retired), elapsed (seconds), pc, budget, error (str or None),
+#           reg (final registers) and warm (True if the binary's snapshot was reused)
+
+import io
+import os
+import sys
+import json
+import base64
+import asyncio
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from isa import ISA
+from result import RunResult
+from client import Client
+
+class Stream:
+    # Binary file for an ISA's console, hands every write to the event loop for the connection to send
+    def __init__(self, loop, queue):
+        self.loop = loop
+        self.queue = queue
+
+    def write(self, data):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, bytes(data)) # The console reuses its buffer
+
+    def flush(self):
+        pass
+
+class Daemon:
+    POOL_SIZE = 4
+    LINE_LIMIT = 8 * ISA.MEM_SIZE # Longest request line, room for a base64 binary as big as memory
+
+    def __init__(self, path=Client.SOCKET_PATH, pool_size=POOL_SIZE, engine="block"):
+        self.path = path
+        self.engine = engine
+        self.idle = [] # VMs not running anything, least recently used first
+        for _ in range(pool_size):
+            isa = ISA()
+            isa.console.line_threshold = 1 # Streams each line as soon as it is written
+            self.idle.append({"isa": isa, "key": None, "snapshot": None})
+        self.available = None # asyncio.Semaphore counting idle VMs, created on the serving loop
+        self.executor = ThreadPoolExecutor(pool_size)
+        self.stats = {"requests": 0, "warm": 0, "faulted": 0, "instructions": 0, "elapsed": 0.0}
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path) # Left behind by a daemon that did not shut down cleanly
+        self.available = asyncio.Semaphore(len(self.idle))
+        return await asyncio.start_unix_server(self.handle, self.path, limit=self.LINE_LIMIT)
+
+    async def serve(self):
+        server = await self.start()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        self.executor.shutdown()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError(f"Expected a JSON object, got {type(request).__name__}")
+                except ValueError as e:
+                    await self.send(writer, self.response(RunResult(RunResult.FAULTED, 0, error=e)))
+                    continue
+                if request.get("stats"):
+                    await self.send(writer, dict(self.stats))
+                else:
+                    await self.execute(request, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass # Client went away, a run in progress still finishes and returns its ISA
+        finally:
+            writer.close()
+
+    async def send(self, writer, message):
+        writer.write(json.dumps(message).encode() + b"\n")
+        await writer.drain()
+
+    def key(self, request):
+        # Identifies the binary a request runs, a rebuilt file gets a new key
+        if "binary" in request:
+            return hashlib.sha256(request["binary"].encode()).hexdigest()
+        info = os.stat(request["path"])
+        return (os.path.realpath(request["path"]), info.st_mtime_ns, info.st_size)
+
+    async def acquire(self, key):
+        # An idle VM that already holds the binary, otherwise the least recently used one
+        await self.available.acquire()
+        for i, vm in enumerate(self.idle):
+            if vm["key"] == key:
+                return self.idle.pop(i)
+        return self.idle.pop(0)
+
+    def release(self, vm):
+        self.idle.append(vm)
+        self.available.release()
+
+    async def execute(self, request, writer):
+        try:
+            key = self.key(request)
+        except (OSError, KeyError, TypeError, AttributeError) as e:
+            response = self.response(RunResult(RunResult.FAULTED, 0, error=e))
+        else:
+            loop = asyncio.get_running_loop()
+            queue = asyncio.Queue()
+            vm = await self.acquire(key)
+
+            def finished(run):
+                # The VM only goes back to the pool once its run is over, even if the client left halfway
+                queue.put_nowait(None) # After every chunk, the thread queued them before it returned
+                self.release(vm)
+
+            run = loop.run_in_executor(self.executor, self.run_vm, vm, key, request, Stream(loop, queue))
+            run.add_done_callback(finished)
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                await self.send(writer, {"stdout": chunk.decode("latin-1")})
+            response = await run
+
+        self.stats["requests"] += 1
+        self.stats["warm"] += response["warm"]
+        self.stats["faulted"] += response["status"] == RunResult.FAULTED
+        self.stats["instructions"] += response["instructions"] or 0
+        self.stats["elapsed"] += response["elapsed"]
+        await self.send(writer, response)
+
+    def run_vm(self, vm, key, request, stdout):
+        # Runs one request on vm in an executor thread, returns the final response line
+        isa = vm["isa"]
+        warm = False
+        try:
+            engine = request.get("engine", self.engine)
+            if engine not in isa.budgeted_engines:
+                raise ValueError(f"Engine ({engine}) does not count instructions, expected one of {list(isa.budgeted_engines)}")
+            if vm["key"] == key:
+                isa.restore(vm["snapshot"])
+                warm = True
+            else:
+                vm["key"] = None
+                if "binary" in request:
+                    with tempfile.NamedTemporaryFile(suffix=".bin") as b:
+                        b.write(base64.b64decode(request["binary"]))
+                        b.flush()
+                        isa.load_bin_into_mem(b.name)
+                else:
+                    isa.load_bin_into_mem(request["path"])
+                vm["snapshot"] = isa.snapshot()
+                vm["key"] = key
+
+            argv = request.get("argv") or None
+            isa.load_argv_into_mem(len(argv) if argv else 0, argv)
+            isa.console.stdin = io.BytesIO(request.get("stdin", "").encode("latin-1"))
+            isa.console.stdout = stdout
+            max_instructions = request.get("max_instructions")
+            if max_instructions is None:
+                max_instructions = float("inf") # Still counts instructions
+            result = isa.resume(engine, max_instructions, request.get("max_seconds"))
+        except Exception as e:
+            # Bad request or binary, nothing ran
+            vm["key"] = None
+            result = RunResult(RunResult.FAULTED, 0, error=e)
+        finally:
+            isa.console.stdout = None
+        return self.response(result, isa.reg, warm)
+
+    def response(self, result, reg=None, warm=False):
+        return {
+            "status": result.status,
+            "instructions": result.instructions,
+            "elapsed": result.elapsed,
+            "pc": result.pc,
+            "budget": result.budget,
+            "error": repr(result.error) if result.error is not None else None,
+            "reg": list(reg) if reg is not None else None,
+            "warm": warm
+        }
+
+if __name__ == '__main__':
+    RUNNER_SOCKET_PATH = Client.SOCKET_PATH
+    RUNNER_POOL_SIZE = Daemon.POOL_SIZE # ISAs kept ready, also the number of programs running at once
+    RUNNER_ENGINE = "block" # "cache" or "block", requests can pick their own
+
+    daemon = Daemon(RUNNER_SOCKET_PATH, RUNNER_POOL_SIZE, RUNNER_ENGINE)
+    print(f"Serving {RUNNER_POOL_SIZE} ISAs on {RUNNER_SOCKET_PATH}", file=sys.stderr)
+    try:
+        asyncio.run(daemon.serve())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+# File device for the phase4 ISA
+# Owns the host files opened through SYS FILE_OPEN, guest file descriptors start at 3
+# (0, 1, 2 are reserved for STDIN, STDOUT, and STDERR). Reads and writes go through memoryview
+# slices of guest memory, no intermediate bytes objects. The console is flushed before every call
+# so output to stdout and to files keeps program order.
+#
+# Snapshots capture open files as (name, mode, position) and reopen them on restore,
+# their contents are not rolled back.
+
+import os
+import mmap
+
+class Files:
+    def __init__(self):
+        self.reset()
+
+    def attach(self, isa):
+        self.isa = isa
+        bus = isa.bus
+        bus.claim_port(0x0100, "FILE_OPEN", self.FILE_OPEN)   # INPUT - R0: MEMORY ADDRESS TO FILE NAME, R1: 0 in READ mode, 1 in WRITE mode, 2 in APPEND mode                     # OUTPUT - R0: FILE DESCRIPTOR
+        bus.claim_port(0x0101, "FILE_READ", self.FILE_READ)   # INPUT - R0: FILE DESCRIPTOR, R1: BUFFER MEMORY ADDRESS (WHERE TO WRITE TO IN MEM), R2: NUMBER OF BYTES TO READ     # OUTPUT - R0: NUMBER OF BYTES READ
+        bus.claim_port(0x0102, "FILE_WRITE", self.FILE_WRITE) # INPUT - R0: FILE DESCRIPTOR, R1: BUFFER MEMORY ADDRESS (WHERE TO READ FROM IN MEM), R2: NUMBER OF BYTES TO WRITE   # OUTPUT - R0: NUMBER OF BYTES WRITTEN
+        bus.claim_port(0x0103, "FILE_CLOSE", self.FILE_CLOSE) # INPUT - R0: FILE DESCRIPTOR                                                                                        # OUTPUT - R0: 0 if SUCCESS, 1 if ERROR
+        bus.claim_port(0x0104, "FILE_MMAP", self.FILE_MMAP)   # INPUT - R0: MEMORY ADDRESS TO FILE NAME, R1: MEMORY ADDRESS TO MAP AT, R2: MAX NUMBER OF BYTES (0 for the whole file) # OUTPUT - Rx: NUMBER OF BYTES MAPPED
+
+    def FILE_OPEN(self, rx):
+        isa = self.isa
+        isa.console.flush()
+        fd = self.next_fd
+        self.next_fd += 1
+        fn = isa.read_str(isa.reg[0]).decode("latin-1")
+        mode = isa.reg[1]
+        if mode == 0:
+            f = open(fn, "rb")
+        elif mode == 1:
+            f = open(fn, "wb")
+        elif mode == 2:
+            f = open(fn, "ab")
+        self.files[fd] = f
+        isa.reg[0] = fd & isa.DW_MASK
+
+    def FILE_READ(self, rx):
+        isa = self.isa
+        isa.console.flush()
+        fd = isa.reg[0]
+        i = isa.reg[1]
+        num_bytes = isa.reg[2]
+        if i + num_bytes > isa.MEM_SIZE:
+            raise IndexError(f"Read of {num_bytes} bytes at address ({i}) exceeds memory size ({isa.MEM_SIZE})")
+        # Straight from the host file into guest memory, no intermediate bytes object
+        n = self.files[fd].readinto(isa.memory.view[i : i + num_bytes])
+        if n:
+            isa.memory.mark(i, n)
+            if isa.code_lo < i + n and i < isa.code_hi:
+                isa.invalidate(i, n)
+        isa.reg[rx] = n & isa.DW_MASK
+
+    def FILE_WRITE(self, rx):
+        isa = self.isa
+        isa.console.flush()
+        fd = isa.reg[0]
+        i = isa.reg[1]
+        num_bytes = isa.reg[2]
+        if i + num_bytes > isa.MEM_SIZE:
+            raise IndexError(f"Write of {num_bytes} bytes from address ({i}) exceeds memory size ({isa.MEM_SIZE})")
+        self.files[fd].write(isa.memory.view[i : i + num_bytes])
+        isa.reg[rx] = num_bytes & isa.DW_MASK
+
+    def FILE_MMAP(self, rx):
+        # Maps the file through the host page cache and copies it into guest memory in one slice,
+        # the file is opened read-only so guest stores never reach it
+        isa = self.isa
+        isa.console.flush()
+        fn = isa.read_str(isa.reg[0]).decode("latin-1")
+        i = isa.reg[1]
+        max_bytes = isa.reg[2]
+        with open(fn, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if max_bytes:
+                size = min(size, max_bytes)
+            if size:
+                with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as m:
+                    isa.memory.write(i, m)
+                if isa.code_lo < i + size and i < isa.code_hi:
+                    isa.invalidate(i, size)
+        isa.reg[rx] = size & isa.DW_MASK
+
+    def FILE_CLOSE(self, rx):
+        isa = self.isa
+        isa.console.flush()
+        fd = isa.reg[0]
+        try:
+            self.files[fd].close()
+            del self.files[fd]
+            isa.reg[rx] = 0
+        except:
+            isa.reg[rx] = 1
+
+    def store(self, offset, value, width):
+        pass
+
+    def reset(self):
+        self.files = {}
+        self.next_fd = 3
+
+    def snapshot(self):
+        return ({fd: (f.name, f.mode, f.tell()) for fd, f in self.files.items()}, self.next_fd)
+
+    def restore(self, state):
+        files, next_fd = state
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+        for fd, (name, mode, pos) in files.items():
+            f = open(name, "r+b" if mode == "wb" else mode) # "wb" would truncate what was written before the snapshot
+            f.seek(pos)
+            self.files[fd] = f
+        self.next_fd = next_fd
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+# Guest heap allocator for the phase4 ISA (SYS MALLOC/FREE/REALLOC)
+# Only the bookkeeping lives here, on the host: blocks are handed out from [start, end) of guest memory
+# and the guest's bytes are never touched, so a program cannot corrupt the allocator by overrunning a block.
+#
+# Free blocks sit in size-class bins (class k holds sizes in (2^(k-1), 2^k]), malloc takes the first block
+# that fits from the request's class or any larger one and splits off the rest, and falls back to bumping top.
+# free merges a block with free neighbours on both sides and gives it back to top when it ends there.
+
+import sys
+
+class Heap:
+    ALIGN = 16
+
+    def __init__(self, start, end):
+        self.end = end
+        self.reset(start)
+
+    def reset(self, start):
+        self.start = (start + self.ALIGN - 1) & ~(self.ALIGN - 1)
+        self.top = self.start       # Everything from top to end has never been handed out
+        self.allocated = {}         # Address -> size
+        self.free_blocks = {}       # Address -> size
+        self.free_ends = {}         # End address -> address, finds the free block right before another one
+        self.bins = {}              # Size class -> set of free addresses
+        self.stats = {"malloc": 0, "free": 0, "realloc": 0, "failed": 0, "in_use": 0, "peak": 0}
+
+    def size_class(self, size):
+        return (size - 1).bit_length()
+
+    def add_free(self, addr, size):
+        self.free_blocks[addr] = size
+        self.free_ends[addr + size] = addr
+        self.bins.setdefault(self.size_class(size), set()).add(addr)
+
+    def remove_free(self, addr):
+        size = self.free_blocks.pop(addr)
+        del self.free_ends[addr + size]
+        self.bins[self.size_class(size)].discard(addr)
+        return size
+
+    def take(self, size):
+        # First fit from the request's class, any block of a larger class always fits
+        cls = self.size_class(size)
+        bin = self.bins.get(cls)
+        if bin:
+            for addr in bin:
+                if self.free_blocks[addr] >= size:
+                    return addr
+        for larger in sorted(c for c in self.bins if c > cls and self.bins[c]):
+            return next(iter(self.bins[larger]))
+        return None
+
+    def malloc(self, n):
+        # Returns the block address, 0 when the heap is exhausted
+        size = (max(n, 1) + self.ALIGN - 1) & ~(self.ALIGN - 1)
+        self.stats["malloc"] += 1
+        addr = self.take(size)
+        if addr is not None:
+            block = self.remove_free(addr)
+            if block > size:
+                self.add_free(addr + size, block - size)
+        elif self.top + size <= self.end:
+            addr = self.top
+            self.top += size
+        else:
+            self.stats["failed"] += 1
+            return 0
+        self.allocated[addr] = size
+        self.stats["in_use"] += size
+        self.stats["peak"] = max(self.stats["peak"], self.stats["in_use"])
+        return addr
+
+    def free(self, addr):
+        if addr == 0:
+            return
+        if addr not in self.allocated:
+            raise ValueError(f"Invalid free of address ({addr}), not an allocated block")
+        self.stats["free"] += 1
+        self.release(addr, self.allocated.pop(addr))
+
+    def release(self, addr, size):
+        self.stats["in_use"] -= size
+        # Coalesce with the free blocks right after and right before
+        if addr + size in self.free_blocks:
+            size += self.remove_free(addr + size)
+        if addr in self.free_ends:
+            prev = self.free_ends[addr]
+            size += self.remove_free(prev)
+            addr = prev
+        if addr + size == self.top:
+            self.top = addr
+        else:
+            self.add_free(addr, size)
+
+    def realloc(self, addr, n):
+        # Returns the new address (equal to addr when resized in place), 0 when it cannot grow
+        if addr == 0:
+            return self.malloc(n)
+        if addr not in self.allocated:
+            raise ValueError(f"Invalid realloc of address ({addr}), not an allocated block")
+        self.stats["realloc"] += 1
+        if n == 0:
+            self.free(addr)
+            return 0
+        size = (n + self.ALIGN - 1) & ~(self.ALIGN - 1)
+        old = self.allocated[addr]
+        if size <= old:
+            if size < old:
+                self.allocated[addr] = size
+                self.release(addr + size, old - size)
+            return addr
+        # Grow in place into top or a free neighbour
+        grow = size - old
+        if addr + old == self.top and self.top + grow <= self.end:
+            self.top += grow
+        elif self.free_blocks.get(addr + old, 0) >= grow:
+            rest = self.remove_free(addr + old) - grow
+            if rest:
+                self.add_free(addr + size, rest)
+        else:
+            # Moves, the caller copies the old contents before anything else is allocated
+            new = self.malloc(n)
+            self.stats["malloc"] -= 1 # Counted as a realloc
+            if new:
+                self.free(addr)
+                self.stats["free"] -= 1
+            return new
+        self.allocated[addr] = size
+        self.stats["in_use"] += grow
+        self.stats["peak"] = max(self.stats["peak"], self.stats["in_use"])
+        return addr
+
+    def size_of(self, addr):
+        return self.allocated.get(addr, 0)
+
+    def snapshot(self):
+        return (self.start, self.top, dict(self.allocated), dict(self.free_blocks), dict(self.stats))
+
+    def restore(self, state):
+        start, top, allocated, free_blocks, stats = state
+        self.reset(start)
+        self.top = top
+        self.allocated = dict(allocated)
+        for addr, size in free_blocks.items():
+            self.add_free(addr, size)
+        self.stats = dict(stats)
+
+    def dump(self, file=None):
+        if file is None:
+            file = sys.stderr # Looked up per call, so a redirected sys.stderr (e.g. by test.py) receives it
+        stats = self.stats
+        print(f"Heap 0x{self.start:06X}-0x{self.end:06X}, top 0x{self.top:06X}", file=file)
+        print(f"  malloc {stats['malloc']}, free {stats['free']}, realloc {stats['realloc']}, failed {stats['failed']}", file=file)
+        print(f"  in use {stats['in_use']} bytes in {len(self.allocated)} blocks, peak {stats['peak']} bytes", file=file)
+        print(f"  free {sum(self.free_blocks.values())} bytes in {len(self.free_blocks)} blocks, {self.end - self.top} bytes above top", file=file)
+        for cls in sorted(self.bins):
+            if self.bins[cls]:
+                print(f"  class <= {1 << cls:>8}: {len(self.bins[cls])} free", file=file)
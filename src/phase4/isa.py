@@ -2,8 +2,21 @@
 
 # ./isa.py asm_compiler.bin [argv]
 
+import os
 import sys
-from opcode import Opcode
+import time
+from functools import partial
+from opcodes import Opcode
+from jit import JIT
+from memory import Memory, Image
+from bus import Bus
+from console import Console
+from files import Files
+from timer import Timer
+from heap import Heap
+from tracer import Tracer
+from result import RunResult
+from blocked import Blocked
 
 # Instruction Set Architecture
 class ISA:
@@ -18,47 +31,110 @@ class ISA:
     MEM_SIZE = 4 * 1024 * 1024 # 4 MB
 
     HEADER_LENGTH = 64
+    MAX_INSTR_LENGTH = 11 # LD/SD with an absolute address or immediate
     MAGIC_NUM = (0x41, 0x42, 0x44, 0x55, 0x4C, 0x4C, 0x41, 0x48)
 
     # Memory Map Guidelines (4 MB)
     # 0x000000 - 0x0FFFFF : Code + global/static data (1 MB)
-    # 0x100000 - 0x2FFFFF : Heap / dynamic memory (2 MB)
+    # 0x100000 - 0x2FEFFF : Heap / dynamic memory (2 MB - 4 KB)
+    # 0x2FF000 - 0x2FFFFF : Memory-mapped device windows (4 KB, see bus.py)
     # 0x300000 - 0x3FFFFF : Stack (1 MB, grows downward)
     HEAP_START = 0x100000
+    HEAP_END   = 0x2FF000
+    MMIO_START = 0x2FF000
     STACK_END  = 0x3FFFFF
     
+    TIME_CHECK_INTERVAL = 256 # Block boundaries between clock reads when running with a time budget
+
+    # Superinstructions built by fuse() at decode time
+    FUSED = ("LD_CMP_JZ", "LD_CMP_JNZ", "LD_CMP_JCC", "LD_CMP", "CMP_JZ", "CMP_JNZ", "CMP_JCC", "PUSH_N", "POP_N")
+
     # Flags
     Z = 1 << 5 # Zero
     S = 1 << 6 # Negative
     C = 1 << 7 # Carry
     O = 1 << 8 # Overflow
 
-    def __init__(self):
+    def __init__(self, memory=None):
         # CPU
         self.running = False
         self.reg = [0] * self.MAX_REG # 32 registers, 64 bits per register
-        self.mem = bytearray(self.MEM_SIZE) # 4 MB memory, 8 bits per address
+        self.memory = memory if memory is not None else Memory(self.MEM_SIZE) # 4 MB memory, pages are allocated on first touch
+        self.mem = self.memory.data # Raw bytes, used for byte accesses and decoding
         self.sp = self.STACK_END
         self.pc = 0 # ID of instruction to run
         self.flags = 0b00000000 
-        self.ports = {
-            0x0000: "STDIN_INT",
-            0x0001: "STDIN_CHAR",
-
-            0x0002: "STDOUT_INT",
-            0x0003: "STDOUT_CHAR",
-            0x0004: "STDOUT_INT_NR",
-            0x0005: "STDOUT_CHAR_NR",
-            0x0006: "STDOUT_STR",     # INPUT - Rx: MEMORY ADDRESS TO FIRST CHAR IN STRING
-            0x0007: "STDOUT_STR_NR",  # INPUT - Rx: MEMORY ADDRESS TO FIRST CHAR IN STRING
-
-            0x0100: "FILE_OPEN",  # INPUT - R0: MEMORY ADDRESS TO FILE NAME, R1: 0 in READ mode, 1 in WRITE mode, 2 in APPEND mode                     # OUTPUT - R0: FILE DESCRIPTOR
-            0x0101: "FILE_READ",  # INPUT - R0: FILE DESCRIPTOR, R1: BUFFER MEMORY ADDRESS (WHERE TO WRITE TO IN MEM), R2: NUMBER OF BYTES TO READ     # OUTPUT - R0: NUMBER OF BYTES READ 
-            0x0102: "FILE_WRITE", # INPUT - R0: FILE DESCRIPTOR, R1: BUFFER MEMORY ADDRESS (WHERE TO READ FROM IN MEM), R2: NUMBER OF BYTES TO WRITE   # OUTPUT - R0: NUMBER OF BYTES WRITTEN
-            0x0103: "FILE_CLOSE"  # INPUT - R0: FILE DESCRIPTOR                                                                                        # OUTPUT - R0: 0 if SUCCESS, 1 if ERROR
+
+        # Devices claim SYS ports and MMIO windows on the bus, decode binds their handlers into the cached entries
+        self.bus = Bus(self)
+        self.console = Console() # STDIN/STDOUT ports, buffered output, see console.py
+        self.files = Files()     # FILE ports, see files.py
+        self.timer = Timer()     # Clock ports and latch, see timer.py
+        for device in (self.console, self.files, self.timer):
+            self.bus.attach(device)
+
+        # Ports served by the ISA itself
+        # NUL-terminated strings, run on the host in one call. Inputs are read from R0/R1 and the result goes to Rx,
+        # every other register is left untouched
+        self.bus.claim_port(0x0200, "STRLEN", self.SYS_STR, "STRLEN") # INPUT - R0: MEMORY ADDRESS TO STRING                                      # OUTPUT - Rx: LENGTH WITHOUT THE NUL
+        self.bus.claim_port(0x0201, "STRCMP", self.SYS_STR, "STRCMP") # INPUT - R0: MEMORY ADDRESS TO FIRST STRING, R1: TO SECOND STRING         # OUTPUT - Rx: 0 if EQUAL, 1 if FIRST > SECOND, -1 (0xFFFFFFFFFFFFFFFF) if FIRST < SECOND
+        self.bus.claim_port(0x0202, "STRCHR", self.SYS_STR, "STRCHR") # INPUT - R0: MEMORY ADDRESS TO STRING, R1: BYTE TO FIND (0 finds the NUL) # OUTPUT - Rx: ADDRESS OF FIRST MATCH, -1 (0xFFFFFFFFFFFFFFFF) if NOT FOUND
+        self.bus.claim_port(0x0203, "STRCPY", self.SYS_STR, "STRCPY") # INPUT - R0: DESTINATION MEMORY ADDRESS, R1: SOURCE MEMORY ADDRESS        # OUTPUT - Rx: LENGTH COPIED WITHOUT THE NUL
+
+        # Memory ranges, one slice operation each. Same convention as the string ports
+        self.bus.claim_port(0x0210, "MEMCPY", self.SYS_MEM, "MEMCPY")   # INPUT - R0: DESTINATION MEMORY ADDRESS, R1: SOURCE MEMORY ADDRESS, R2: NUMBER OF BYTES # OUTPUT - Rx: NUMBER OF BYTES COPIED
+        self.bus.claim_port(0x0211, "MEMMOVE", self.SYS_MEM, "MEMMOVE") # INPUT - R0: DESTINATION MEMORY ADDRESS, R1: SOURCE MEMORY ADDRESS, R2: NUMBER OF BYTES # OUTPUT - Rx: NUMBER OF BYTES MOVED, RANGES MAY OVERLAP
+        self.bus.claim_port(0x0212, "MEMSET", self.SYS_MEM, "MEMSET")   # INPUT - R0: DESTINATION MEMORY ADDRESS, R1: BYTE VALUE, R2: NUMBER OF BYTES          # OUTPUT - Rx: NUMBER OF BYTES SET
+
+        # ASCII numbers, radix 2-36. ATOI with radix 0 reads "0x..." as hex and anything else as decimal
+        self.bus.claim_port(0x0220, "ATOI", self.SYS_NUM, "ATOI") # INPUT - R0: MEMORY ADDRESS TO DIGITS (optional '-'), R1: RADIX (0 = detect 0x) # OUTPUT - Rx: VALUE, R1: NUMBER OF BYTES CONSUMED (0 if NO DIGITS)
+        self.bus.claim_port(0x0221, "ITOA", self.SYS_NUM, "ITOA") # INPUT - R0: BUFFER MEMORY ADDRESS, R1: VALUE (unsigned), R2: RADIX (0 = 10)    # OUTPUT - Rx: NUMBER OF DIGITS WRITTEN, FOLLOWED BY A NUL
+
+        # Heap between HEAP_START (after the argv strings) and HEAP_END, blocks are 16-byte aligned and not zeroed
+        self.bus.claim_port(0x0230, "MALLOC", self.SYS_HEAP, "MALLOC")         # INPUT - R0: NUMBER OF BYTES                                  # OUTPUT - Rx: BLOCK MEMORY ADDRESS, 0 if OUT OF MEMORY
+        self.bus.claim_port(0x0231, "FREE", self.SYS_HEAP, "FREE")             # INPUT - R0: BLOCK MEMORY ADDRESS (0 is ignored)              # OUTPUT - Rx: 0
+        self.bus.claim_port(0x0232, "REALLOC", self.SYS_HEAP, "REALLOC")       # INPUT - R0: BLOCK MEMORY ADDRESS (0 = MALLOC), R1: NEW SIZE  # OUTPUT - Rx: NEW BLOCK MEMORY ADDRESS (contents kept), 0 if OUT OF MEMORY (old block kept)
+        self.bus.claim_port(0x0233, "HEAP_STATS", self.SYS_HEAP, "HEAP_STATS") # Prints allocator statistics to stderr                       # OUTPUT - Rx: BYTES IN USE
+        self.ports = self.bus.names # Port number -> call name
+        self.heap = Heap(self.HEAP_START, self.HEAP_END) # Bookkeeping for SYS MALLOC/FREE/REALLOC, see heap.py
+
+        # Decoded instruction cache
+        self.icache = {} # PC -> (handler, args, next PC or None if the handler sets PC)
+        self.ucache = {} # Same without fusion, one instruction per entry, for budgeted cache runs (see execute_cached_budgeted)
+        self.code_lo = self.MEM_SIZE # Lowest address covered by a cached instruction
+        self.code_hi = 0             # Highest address (exclusive) covered by a cached instruction
+        self.icache_span = self.MAX_INSTR_LENGTH # Longest cached entry in bytes, fused entries cover several instructions
+        self.fusion = True
+        self.fusion_counts = {name: 0 for name in self.FUSED}
+        self.dispatch = self.build_dispatch_table()
+
+        # Translated basic blocks
+        self.blocks = {} # Entry PC -> (compiled block, end address, number of instructions)
+        self.jit = JIT(self)
+
+        # Execution engines selectable through run(engine=...)
+        self.engines = {
+            "match": self.execute_match, # Enum decode + match statement every instruction
+            "table": self.execute_table, # Opcode byte table dispatch, decodes every instruction
+            "cache": self.execute_cached, # Opcode byte table dispatch, decodes each PC once
+            "block": self.execute_blocks, # Basic blocks translated to Python code objects, see jit.py
+            "counted": self.execute_counted, # Like cache without fusion, counts opcodes/branches/calls and reports them at HALT
+            "profile": self.execute_profiled, # Like cache without fusion, samples the CALL/RET stack into a folded-stack file
+            "trace": self.execute_traced # Like cache without fusion, records every instruction into trace_fn, see tracer.py
         }
-        self.files = {}
-        self.next_fd = 3 # 0, 1, 2 are reserved for STDIN, STDOUT, and STDERR
+        # Variants that count instructions and stop between two instructions when a budget runs out, see resume()
+        self.budgeted_engines = {
+            "cache": self.execute_cached_budgeted,
+            "block": self.execute_blocks_budgeted
+        }
+        self.halted = False    # Set by HALT, tells a finished program apart from a stopped one
+        self.preempted = False # Set by preempt()
+        self.retired = None    # Instructions retired by the last budgeted resume()
+        self.counters = None
+        self.profile = None # Folded stack ("main;lexer;fullstrcmp") -> samples
+        self.profile_fn = None
+        self.profile_interval = 100 # Instructions per sample, counted, the clock is never read
+        self.trace_fn = "debug_trace.bin"
 
         # Debugger
         self.debugger = False
@@ -66,6 +142,7 @@ class ISA:
         self.is_step = True
         self.is_breakpoint = False
         self.breakpoints = []
+        self.debug_symbols = {}
 
     def load_debug_symbols(self, input_fn):
         with open(f"{input_fn}.symbols", "r") as f:
@@ -74,6 +151,66 @@ class ISA:
             line_list = line.split()
             self.debug_symbols[int(line_list[2])] = line_list[0]
     
+    # Flags are evaluated lazily: ALU ops only record their unmasked result in zsc_res (Z/S/C)
+    # and their operands in o_src (O), the bits are computed when a Jcc, __str__ or the debugger reads them.
+    # flag_bits holds the materialized bits for any flag whose lazy source is None.
+    @property
+    def flags(self):
+        flags = self.flag_bits
+        if self.zsc_res is not None:
+            flags &= ~(self.Z | self.S | self.C)
+            if self.flag_z():
+                flags |= self.Z
+            if self.flag_s():
+                flags |= self.S
+            if self.flag_c():
+                flags |= self.C
+        if self.o_src is not None:
+            flags &= ~self.O
+            if self.flag_o():
+                flags |= self.O
+        return flags
+
+    @flags.setter
+    def flags(self, value):
+        self.flag_bits = value
+        self.zsc_res = None
+        self.o_src = None
+
+    def flag_z(self):
+        # Checks if result was 0
+        if self.zsc_res is None:
+            return self.flag_bits & self.Z != 0
+        return self.zsc_res == 0
+
+    def flag_s(self):
+        # Checks if result was negative
+        if self.zsc_res is None:
+            return self.flag_bits & self.S != 0
+        return self.zsc_res & self.SIGN_BIT != 0
+
+    def flag_c(self):
+        # Checks if result is longer than 64 bits (unsigned overflow)
+        if self.zsc_res is None:
+            return self.flag_bits & self.C != 0
+        return self.zsc_res > self.DW_MASK
+
+    def flag_o(self):
+        # Signed overflow of the last INC/DEC/ADD/SUB/CMP
+        if self.o_src is None:
+            return self.flag_bits & self.O != 0
+        kind, a, b, res = self.o_src
+        if kind == "INC":
+            return a == self.OVERFLOW_BIT
+        if kind == "DEC":
+            return a == self.SIGN_BIT
+        a_sign = a & self.SIGN_BIT
+        b_sign = b & self.SIGN_BIT
+        res_sign = res & self.SIGN_BIT
+        if kind == "ADD":
+            return a_sign == b_sign and a_sign != res_sign
+        return a_sign != b_sign and a_sign != res_sign # SUB, CMP
+
     def set_flag(self, flag):
         self.flags |= flag
 
@@ -86,23 +223,8 @@ class ISA:
         return False
 
     def update_flags(self, res):
-        # Checks if result was 0
-        if res == 0:
-            self.set_flag(self.Z)
-        else:
-            self.clear_flag(self.Z)
-        
-        # Checks if result was negative
-        if res & self.SIGN_BIT:
-            self.set_flag(self.S)
-        else:
-            self.clear_flag(self.S)
-
-        # Checks if result is longer than 64 bits (unsigned overflow)
-        if res > self.DW_MASK:
-            self.set_flag(self.C)
-        else:
-            self.clear_flag(self.C)
+        # Z/S/C are derived from res on demand, handlers on the hot path assign zsc_res directly
+        self.zsc_res = res
 
     # Opcode Functions
     def NOP(self, opcode):
@@ -110,8 +232,7 @@ class ISA:
 
     def LB(self, rx, ry):
         addr = self.reg[ry]
-        self.reg[rx] = self.mem[addr] & self.B_MASK
-        self.update_flags(self.reg[rx])
+        self.reg[rx] = self.zsc_res = self.mem[addr] & self.B_MASK
 
     def LH(self, rx, operand, mode):
         # Mode = Operand                    - Opcode         - Variable Length Encoding
@@ -124,11 +245,9 @@ class ISA:
         elif mode == 1:
             self.reg[rx] = operand & self.HW_MASK
         elif mode == 2:
-            self.reg[rx] = self.mem[operand] | self.mem[operand + 1] << 8
+            self.reg[rx] = self.memory.read_hword(operand)
         elif mode == 3:
-            addr = self.reg[operand]
-            self.reg[rx] = self.mem[addr] | self.mem[addr + 1] << 8
-    
+            self.reg[rx] = self.memory.read_hword(self.reg[operand])
 
     def LW(self, rx, operand, mode):
         # Mode = Operand                    - Opcode         - Variable Length Encoding
@@ -141,20 +260,9 @@ class ISA:
         elif mode == 1:
             self.reg[rx] = operand & self.W_MASK
         elif mode == 2:
-            self.reg[rx] = (
-                self.mem[operand] |
-                self.mem[operand + 1] << 8 |
-                self.mem[operand + 2] << 16 |
-                self.mem[operand + 3] << 24
-            )
+            self.reg[rx] = self.memory.read_word(operand)
         elif mode == 3:
-            addr = self.reg[operand]
-            self.reg[rx] = (
-                self.mem[addr] |
-                self.mem[addr + 1] << 8 |
-                self.mem[addr + 2] << 16 |
-                self.mem[addr + 3] << 24
-            )
+            self.reg[rx] = self.memory.read_word(self.reg[operand])
 
     def LD(self, rx, operand, mode):
         # Mode = Operand                    - Opcode         - Variable Length Encoding
@@ -167,228 +275,163 @@ class ISA:
         elif mode == 1:
             self.reg[rx] = operand & self.DW_MASK
         elif mode == 2:
-            self.reg[rx] = (
-                self.mem[operand] |
-                self.mem[operand + 1] << 8 |
-                self.mem[operand + 2] << 16 |
-                self.mem[operand + 3] << 24 |
-                self.mem[operand + 4] << 32 |
-                self.mem[operand + 5] << 40 |
-                self.mem[operand + 6] << 48 |
-                self.mem[operand + 7] << 56
-            )
+            self.reg[rx] = self.memory.read_dword(operand)
         elif mode == 3:
-            addr = self.reg[operand]
-            self.reg[rx] = (
-                self.mem[addr] |
-                self.mem[addr + 1] << 8 |
-                self.mem[addr + 2] << 16 |
-                self.mem[addr + 3] << 24 |
-                self.mem[addr + 4] << 32 |
-                self.mem[addr + 5] << 40 |
-                self.mem[addr + 6] << 48 |
-                self.mem[addr + 7] << 56
-            )
+            self.reg[rx] = self.memory.read_dword(self.reg[operand])
 
     def SB(self, rx, ry):
         addr = self.reg[ry]
         self.mem[addr] = self.reg[rx] & self.B_MASK
+        self.memory.dirty.add(addr >> Memory.PAGE_SHIFT)
+        if self.code_lo <= addr < self.code_hi:
+            self.invalidate(addr, 1)
+        if self.bus.mmio_lo <= addr < self.bus.mmio_hi:
+            self.bus.store(addr, self.reg[rx] & self.B_MASK, 1)
 
     def SH(self, rx, operand, mode):
         # Mode = Operand                    - Opcode         - Variable Length Encoding
         # 3    = absolute mem addr, symbol  - SH Rx, Addr    - 1 + 1 (Addr Byte) + 1 + 2 = 5 bytes
         # 4    = indirect through register  - SH Rx, [Ry]    - 1 + 1 (Addr Byte) + 1 + 1 = 4 bytes
         if mode == 2:
-            self.mem[operand + 1] = (self.reg[rx] >> 8) & self.B_MASK
-            self.mem[operand] = self.reg[rx] & self.B_MASK
+            addr = operand
         elif mode == 3:
             addr = self.reg[operand]
-            self.mem[addr + 1] = (self.reg[rx] >> 8) & self.B_MASK
-            self.mem[addr] = self.reg[rx] & self.B_MASK
-    
+        else:
+            return
+        self.memory.write_hword(addr, self.reg[rx] & self.HW_MASK)
+        if self.code_lo < addr + 2 and addr < self.code_hi:
+            self.invalidate(addr, 2)
+        if self.bus.mmio_lo < addr + 2 and addr < self.bus.mmio_hi:
+            self.bus.store(addr, self.reg[rx] & self.HW_MASK, 2)
+
     def SW(self, rx, operand, mode):
         # Mode = Operand                    - Opcode         - Variable Length Encoding
         # 3    = absolute mem addr, symbol  - SW Rx, Addr    - 1 + 1 (Addr Byte) + 1 + 4 = 7 bytes
         # 4    = indirect through register  - SW Rx, [Ry]    - 1 + 1 (Addr Byte) + 1 + 1 = 4 bytes
         if mode == 2:
-            self.mem[operand + 3] = (self.reg[rx] >> 24) & self.B_MASK
-            self.mem[operand + 2] = (self.reg[rx] >> 16) & self.B_MASK
-            self.mem[operand + 1] = (self.reg[rx] >> 8) & self.B_MASK
-            self.mem[operand] = self.reg[rx] & self.B_MASK
+            addr = operand
         elif mode == 3:
             addr = self.reg[operand]
-            self.mem[addr + 3] = (self.reg[rx] >> 24) & self.B_MASK
-            self.mem[addr + 2] = (self.reg[rx] >> 16) & self.B_MASK
-            self.mem[addr + 1] = (self.reg[rx] >> 8) & self.B_MASK
-            self.mem[addr] = self.reg[rx] & self.B_MASK
+        else:
+            return
+        self.memory.write_word(addr, self.reg[rx] & self.W_MASK)
+        if self.code_lo < addr + 4 and addr < self.code_hi:
+            self.invalidate(addr, 4)
+        if self.bus.mmio_lo < addr + 4 and addr < self.bus.mmio_hi:
+            self.bus.store(addr, self.reg[rx] & self.W_MASK, 4)
 
     def SD(self, rx, operand, mode):
         # Mode = Operand                    - Opcode         - Variable Length Encoding
         # 3    = absolute mem addr, symbol  - SD Rx, Addr    - 1 + 1 (Addr Byte) + 1 + 8 = 11 bytes
         # 4    = indirect through register  - SD Rx, [Ry]    - 1 + 1 (Addr Byte) + 1 + 1 = 4 bytes
         if mode == 2:
-            self.mem[operand + 7] = (self.reg[rx] >> 56) & self.B_MASK
-            self.mem[operand + 6] = (self.reg[rx] >> 48) & self.B_MASK
-            self.mem[operand + 5] = (self.reg[rx] >> 40) & self.B_MASK
-            self.mem[operand + 4] = (self.reg[rx] >> 32) & self.B_MASK
-            self.mem[operand + 3] = (self.reg[rx] >> 24) & self.B_MASK
-            self.mem[operand + 2] = (self.reg[rx] >> 16) & self.B_MASK
-            self.mem[operand + 1] = (self.reg[rx] >> 8) & self.B_MASK
-            self.mem[operand] = self.reg[rx] & self.B_MASK
+            addr = operand
         elif mode == 3:
             addr = self.reg[operand]
-            self.mem[addr + 7] = (self.reg[rx] >> 56) & self.B_MASK
-            self.mem[addr + 6] = (self.reg[rx] >> 48) & self.B_MASK
-            self.mem[addr + 5] = (self.reg[rx] >> 40) & self.B_MASK
-            self.mem[addr + 4] = (self.reg[rx] >> 32) & self.B_MASK
-            self.mem[addr + 3] = (self.reg[rx] >> 24) & self.B_MASK
-            self.mem[addr + 2] = (self.reg[rx] >> 16) & self.B_MASK
-            self.mem[addr + 1] = (self.reg[rx] >> 8) & self.B_MASK
-            self.mem[addr] = self.reg[rx] & self.B_MASK
+        else:
+            return
+        self.memory.write_dword(addr, self.reg[rx] & self.DW_MASK)
+        if self.code_lo < addr + 8 and addr < self.code_hi:
+            self.invalidate(addr, 8)
+        if self.bus.mmio_lo < addr + 8 and addr < self.bus.mmio_hi:
+            self.bus.store(addr, self.reg[rx] & self.DW_MASK, 8)
 
     def MOV(self, rx, ry):
         self.reg[rx] = self.reg[ry] & self.DW_MASK
     
     def INC(self, rx):
+        # Overflow occurs if adding 1 to 0x7FFF..., carry if res is greater than 64 bits
         res = self.reg[rx] + 1
-        self.update_flags(res)
-        
-        # Overflow occurs if adding 1 to 0x7FFF...
-        if self.reg[rx] == self.OVERFLOW_BIT:
-            self.set_flag(self.O)
-        else:
-            self.clear_flag(self.O)
-        
-        # Carry occurs if res is greater than 64 bits
-        if res > self.DW_MASK:
-            self.set_flag(self.C)
-        else:
-            self.clear_flag(self.C)
-        
+        self.zsc_res = res
+        self.o_src = ("INC", self.reg[rx], 1, res)
         self.reg[rx] = res & self.DW_MASK
 
     def DEC(self, rx):
-        res = self.reg[rx] - 1
-        self.update_flags(res)
-        
         # Overflow occurs if subtracting 1 from self.SIGN_BIT
-        if self.reg[rx] == self.SIGN_BIT:
-            self.set_flag(self.O)
-        else:
-            self.clear_flag(self.O)
-        
+        res = self.reg[rx] - 1
+        self.zsc_res = res
+        self.o_src = ("DEC", self.reg[rx], 1, res)
         self.reg[rx] = res & self.DW_MASK
 
     def ADD(self, rx, ry):
         res = (self.reg[rx] + self.reg[ry])
-
-        self.update_flags(res)
-        rx_sign = self.reg[rx] & self.SIGN_BIT
-        ry_sign = self.reg[ry] & self.SIGN_BIT 
-        res_sign = res & self.SIGN_BIT
-        if rx_sign == ry_sign and rx_sign != res_sign:
-            self.set_flag(self.O)
-        else:
-            self.clear_flag(self.O) 
-
+        self.zsc_res = res
+        self.o_src = ("ADD", self.reg[rx], self.reg[ry], res)
         self.reg[rx] = res & self.DW_MASK
 
     def SUB(self, rx, ry):
         res = (self.reg[rx] - self.reg[ry])
-        
-        self.update_flags(res)
-        rx_sign = self.reg[rx] & self.SIGN_BIT
-        ry_sign = self.reg[ry] & self.SIGN_BIT 
-        res_sign = res & self.SIGN_BIT
-        if rx_sign != ry_sign and rx_sign != res_sign:
-            self.set_flag(self.O)
-        else:
-            self.clear_flag(self.O) 
-
+        self.zsc_res = res
+        self.o_src = ("SUB", self.reg[rx], self.reg[ry], res)
         self.reg[rx] = res & self.DW_MASK
 
     def MUL(self, rx, ry):
-        self.reg[rx] = (self.reg[rx] * self.reg[ry]) & self.DW_MASK
-        self.update_flags(self.reg[rx])
+        self.reg[rx] = self.zsc_res = (self.reg[rx] * self.reg[ry]) & self.DW_MASK
      
     def DIV(self, rx, ry):
         if self.reg[ry] != 0:
-            self.reg[rx] = (self.reg[rx] // self.reg[ry]) & self.DW_MASK
-            self.update_flags(self.reg[rx])
+            self.reg[rx] = self.zsc_res = (self.reg[rx] // self.reg[ry]) & self.DW_MASK
         else:
             raise ZeroDivisionError(f"Division by zero error: R{ry} = 0")
 
     def AND(self, rx, ry):
-        self.reg[rx] = (self.reg[rx] & self.reg[ry]) & self.DW_MASK
-        self.update_flags(self.reg[rx])
+        self.reg[rx] = self.zsc_res = (self.reg[rx] & self.reg[ry]) & self.DW_MASK
 
     def OR(self, rx, ry):
-        self.reg[rx] = (self.reg[rx] | self.reg[ry]) & self.DW_MASK
-        self.update_flags(self.reg[rx])
+        self.reg[rx] = self.zsc_res = (self.reg[rx] | self.reg[ry]) & self.DW_MASK
 
     def XOR(self, rx, ry):
-        self.reg[rx] = (self.reg[rx] ^ self.reg[ry]) & self.DW_MASK
-        self.update_flags(self.reg[rx])
+        self.reg[rx] = self.zsc_res = (self.reg[rx] ^ self.reg[ry]) & self.DW_MASK
 
     def NOT(self, rx):
-        self.reg[rx] = ~self.reg[rx] & self.DW_MASK
-        self.update_flags(self.reg[rx])
+        self.reg[rx] = self.zsc_res = ~self.reg[rx] & self.DW_MASK
 
     def CMP(self, rx, ry):
         res = (self.reg[rx] - self.reg[ry])
-        
-        self.update_flags(res)
-        rx_sign = self.reg[rx] & self.SIGN_BIT
-        ry_sign = self.reg[ry] & self.SIGN_BIT 
-        res_sign = res & self.SIGN_BIT
-        if rx_sign != ry_sign and rx_sign != res_sign:
-            self.set_flag(self.O)
-        else:
-            self.clear_flag(self.O)
+        self.zsc_res = res
+        self.o_src = ("SUB", self.reg[rx], self.reg[ry], res)
     
     def SHL(self, rx):
-        self.reg[rx] = self.reg[rx] << 1 & self.DW_MASK
-        self.update_flags(self.reg[rx])
+        self.reg[rx] = self.zsc_res = self.reg[rx] << 1 & self.DW_MASK
     
     def SHR(self, rx):
-        self.reg[rx] = self.reg[rx] >> 1 & self.DW_MASK
-        self.update_flags(self.reg[rx])
+        self.reg[rx] = self.zsc_res = self.reg[rx] >> 1 & self.DW_MASK
 
     def JMP(self, addr):
         self.pc = addr
         self.print_debug_symbol(addr)
     
     def JZ(self, addr, opcode):
-        if self.is_flag_set(self.Z):
+        if self.flag_z():
             self.pc = addr
             self.print_debug_symbol(addr)
         else:
             self.pc += opcode.length
 
     def JNZ(self, addr, opcode):
-        if not self.is_flag_set(self.Z):
+        if not self.flag_z():
             self.pc = addr
             self.print_debug_symbol(addr)
         else:
             self.pc += opcode.length
     
     def JC(self, addr, opcode):
-        if self.is_flag_set(self.C):
+        if self.flag_c():
             self.pc = addr
             self.print_debug_symbol(addr)
         else:
             self.pc += opcode.length
 
     def JNC(self, addr, opcode):
-        if not self.is_flag_set(self.C):
+        if not self.flag_c():
             self.pc = addr  
             self.print_debug_symbol(addr)
         else:
             self.pc += opcode.length
 
     def JL(self, addr, opcode):
-        S = self.is_flag_set(self.S)
-        O = self.is_flag_set(self.O)
+        S = self.flag_s()
+        O = self.flag_o()
         if S != O:
             self.pc = addr  
             self.print_debug_symbol(addr)
@@ -396,9 +439,9 @@ class ISA:
             self.pc += opcode.length
 
     def JLE(self, addr, opcode):
-        S = self.is_flag_set(self.S)
-        O = self.is_flag_set(self.O)
-        Z = self.is_flag_set(self.Z)
+        S = self.flag_s()
+        O = self.flag_o()
+        Z = self.flag_z()
         if Z or S != O:
             self.pc = addr  
             self.print_debug_symbol(addr)
@@ -406,9 +449,9 @@ class ISA:
             self.pc += opcode.length
 
     def JG(self, addr, opcode):
-        S = self.is_flag_set(self.S)
-        O = self.is_flag_set(self.O)
-        Z = self.is_flag_set(self.Z)
+        S = self.flag_s()
+        O = self.flag_o()
+        Z = self.flag_z()
         if not Z and S == O:
             self.pc = addr  
             self.print_debug_symbol(addr)
@@ -416,8 +459,8 @@ class ISA:
             self.pc += opcode.length
 
     def JGE(self, addr, opcode):
-        S = self.is_flag_set(self.S)
-        O = self.is_flag_set(self.O)
+        S = self.flag_s()
+        O = self.flag_o()
         if S == O:
             self.pc = addr  
             self.print_debug_symbol(addr)
@@ -427,121 +470,163 @@ class ISA:
     def PUSH(self, rx):
         if self.sp - 8 >= 0:
             self.sp -= 8
-            self.mem[self.sp + 7] = self.reg[rx] >> 56 & self.B_MASK
-            self.mem[self.sp + 6] = self.reg[rx] >> 48 & self.B_MASK
-            self.mem[self.sp + 5] = self.reg[rx] >> 40 & self.B_MASK
-            self.mem[self.sp + 4] = self.reg[rx] >> 32 & self.B_MASK
-            self.mem[self.sp + 3] = self.reg[rx] >> 24 & self.B_MASK
-            self.mem[self.sp + 2] = self.reg[rx] >> 16 & self.B_MASK
-            self.mem[self.sp + 1] = self.reg[rx] >> 8 & self.B_MASK
-            self.mem[self.sp]     = self.reg[rx] & self.B_MASK
+            self.memory.write_dword(self.sp, self.reg[rx] & self.DW_MASK)
+            if self.sp < self.code_hi:
+                self.invalidate(self.sp, 8)
 
     def POP(self, rx):
         if self.sp + 8 <= self.MEM_SIZE:
-            self.reg[rx] = (
-                self.mem[self.sp] |
-                self.mem[self.sp + 1] << 8 |
-                self.mem[self.sp + 2] << 16 |
-                self.mem[self.sp + 3] << 24 |
-                self.mem[self.sp + 4] << 32 |
-                self.mem[self.sp + 5] << 40 |
-                self.mem[self.sp + 6] << 48 |
-                self.mem[self.sp + 7] << 56
-            ) & self.DW_MASK
-            self.mem[self.sp + 7] = 0
-            self.mem[self.sp + 6] = 0
-            self.mem[self.sp + 5] = 0
-            self.mem[self.sp + 4] = 0
-            self.mem[self.sp + 3] = 0
-            self.mem[self.sp + 2] = 0
-            self.mem[self.sp + 1] = 0
-            self.mem[self.sp] = 0
+            self.reg[rx] = self.memory.read_dword(self.sp)
+            self.memory.write_dword(self.sp, 0)
+            if self.sp < self.code_hi:
+                self.invalidate(self.sp, 8)
             self.sp += 8
 
     def SYS(self, rx, port):
-        call = self.ports[port]
-        if call == "STDIN_INT":
-            self.reg[rx] = int(input().strip()) & self.DW_MASK
-        elif call == "STDIN_CHAR":
-            self.reg[rx] = ord(input().strip()[0]) & self.DW_MASK
-        elif call == "STDOUT_INT":
-            print(self.reg[rx])
-        elif call == "STDOUT_CHAR":
-            print(chr(self.reg[rx]))
-        elif call == "STDOUT_INT_NR":
-            print(self.reg[rx], end='')
-        elif call == "STDOUT_CHAR_NR":
-            print(chr(self.reg[rx]), end='')
-        elif call == "STDOUT_STR":
-            i = self.reg[rx]
-            buf = ""
-            while (self.mem[i] != 0):
-                buf += chr(self.mem[i])
-                i += 1
-            print(buf)
-        elif call == "STDOUT_STR_NR":
-            i = self.reg[rx]
-            buf = ""
-            while (self.mem[i] != 0):
-                buf += chr(self.mem[i])
+        handler, args = self.bus.ports[port]
+        handler(rx, *args)
+
+    def attach(self, device):
+        # Plugs another device into the bus, entries decoded before may have skipped the ports it claims
+        self.bus.attach(device)
+        self.icache.clear()
+        self.ucache.clear()
+        self.blocks.clear()
+
+    def SYS_HEAP(self, rx, call):
+        if call == "MALLOC":
+            self.reg[rx] = self.heap.malloc(self.reg[0])
+        elif call == "FREE":
+            self.heap.free(self.reg[0])
+            self.reg[rx] = 0
+        elif call == "REALLOC":
+            addr = self.reg[0]
+            n = self.reg[1]
+            old = self.heap.size_of(addr)
+            new = self.heap.realloc(addr, n)
+            if new and addr and new != addr:
+                # Moved, the old block is free on the host side but its bytes are still intact
+                length = min(old, n)
+                self.memory.view[new : new + length] = self.memory.view[addr : addr + length]
+                self.memory.mark(new, length)
+                if self.code_lo < new + length and new < self.code_hi:
+                    self.invalidate(new, length)
+            self.reg[rx] = new
+        elif call == "HEAP_STATS":
+            self.console.flush()
+            self.heap.dump()
+            self.reg[rx] = self.heap.stats["in_use"]
+
+    def SYS_NUM(self, rx, call):
+        digits = b"0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+        if call == "ATOI":
+            start = self.reg[0]
+            radix = self.reg[1]
+            i = start
+            negative = self.mem[i] == ord("-")
+            if negative:
                 i += 1
-            print(buf, end='')
-        elif call == "FILE_OPEN":
-            fd = self.next_fd
-            self.next_fd += 1
-            i = self.reg[0]
-            fn = ""
-            while self.mem[i] != 0:
-                fn += chr(self.mem[i])
-                i += 1
-            mode = self.reg[1]
-            if mode == 0:
-                f = open(fn, "rb")
-            elif mode == 1:
-                f = open(fn, "wb")
-            elif mode == 2:
-                f = open(fn, "ab")
-            self.files[fd] = f
-            self.reg[0] = fd & self.DW_MASK
-        elif call == "FILE_READ":
-            fd = self.reg[0]
-            i = self.reg[1]
-            num_bytes = self.reg[2]
-            buf = self.files[fd].read(num_bytes)
-            for byte in buf:
-                self.mem[i] = byte
-                i += 1
-            self.reg[rx] = len(buf) & self.DW_MASK 
-        elif call == "FILE_WRITE":
-            fd = self.reg[0]
-            i = self.reg[1]
-            num_bytes = self.reg[2]
-            buf = bytearray()
-            for offset in range(num_bytes):
-                buf.append(self.mem[i + offset])
-            self.files[fd].write(buf)
-            self.reg[rx] = num_bytes & self.DW_MASK
-        elif call == "FILE_CLOSE":
-            fd = self.reg[0]
-            try:
-                self.files[fd].close()
-                del self.files[fd]
+            # "0x" only counts as a prefix when a hex digit follows, "0xg" parses as 0
+            after = self.mem[i + 2 : i + 3].upper()
+            if radix in (0, 16) and self.mem[i : i + 2] in (b"0x", b"0X") and after and after in digits[:16]:
+                radix = 16
+                i += 2
+            elif radix == 0:
+                radix = 10
+            if not 2 <= radix <= 36:
+                raise ValueError(f"Invalid radix ({radix})")
+            valid = digits[:radix] + digits[10:radix].lower()
+            end = i
+            while end < self.MEM_SIZE and self.mem[end] in valid:
+                end += 1
+            if end == i:
+                self.reg[rx] = 0
+                self.reg[1] = 0
+                return
+            value = int(self.mem[i : end], radix) & self.DW_MASK
+            if negative:
+                value = -value & self.DW_MASK
+            self.reg[rx] = value
+            self.reg[1] = end - start
+        elif call == "ITOA":
+            addr = self.reg[0]
+            value = self.reg[1]
+            radix = self.reg[2] or 10
+            if not 2 <= radix <= 36:
+                raise ValueError(f"Invalid radix ({radix})")
+            out = bytearray()
+            while True:
+                value, digit = divmod(value, radix)
+                out.append(digits[digit])
+                if value == 0:
+                    break
+            out.reverse()
+            n = len(out)
+            self.memory.write(addr, out + b"\0")
+            if self.code_lo < addr + n + 1 and addr < self.code_hi:
+                self.invalidate(addr, n + 1)
+            self.reg[rx] = n
+
+    def SYS_MEM(self, rx, call):
+        dest = self.reg[0]
+        n = self.reg[2]
+        if dest + n > self.MEM_SIZE:
+            raise IndexError(f"{call} of {n} bytes at address ({dest}) exceeds memory size ({self.MEM_SIZE})")
+        if call == "MEMSET":
+            self.mem[dest : dest + n] = bytes((self.reg[1] & self.B_MASK,)) * n
+        else:
+            src = self.reg[1]
+            if src + n > self.MEM_SIZE:
+                raise IndexError(f"{call} of {n} bytes from address ({src}) exceeds memory size ({self.MEM_SIZE})")
+            if call == "MEMCPY":
+                self.memory.view[dest : dest + n] = self.memory.view[src : src + n]
+            else:
+                self.mem.move(dest, src, n) # memmove, safe for overlapping ranges
+        if n:
+            self.memory.mark(dest, n)
+            if self.code_lo < dest + n and dest < self.code_hi:
+                self.invalidate(dest, n)
+        self.reg[rx] = n
+
+    def SYS_STR(self, rx, call):
+        if call == "STRLEN":
+            addr = self.reg[0]
+            end = self.mem.find(b"\0", addr)
+            if end == -1:
+                raise IndexError(f"Unterminated string at address ({addr})")
+            self.reg[rx] = end - addr
+        elif call == "STRCMP":
+            a = self.read_str(self.reg[0])
+            b = self.read_str(self.reg[1])
+            if a == b:
                 self.reg[rx] = 0
-            except:
+            elif a > b:
                 self.reg[rx] = 1
+            else:
+                self.reg[rx] = self.DW_MASK
+        elif call == "STRCHR":
+            addr = self.reg[0]
+            byte = self.reg[1] & self.B_MASK
+            end = self.mem.find(b"\0", addr)
+            if end == -1:
+                raise IndexError(f"Unterminated string at address ({addr})")
+            found = self.mem.find(bytes((byte,)), addr, end + 1)
+            self.reg[rx] = found if found != -1 else self.DW_MASK
+        elif call == "STRCPY":
+            dest = self.reg[0]
+            s = self.read_str(self.reg[1])
+            n = len(s) + 1
+            self.memory.write(dest, s + b"\0")
+            if self.code_lo < dest + n and dest < self.code_hi:
+                self.invalidate(dest, n)
+            self.reg[rx] = len(s)
 
     def CALL(self, addr, opcode):
         if self.sp - 8 >= 0:
             self.sp -= 8
-            ret_addr = self.pc + opcode.length
-            self.mem[self.sp + 7] = ret_addr >> 56 & self.B_MASK
-            self.mem[self.sp + 6] = ret_addr >> 48 & self.B_MASK
-            self.mem[self.sp + 5] = ret_addr >> 40 & self.B_MASK
-            self.mem[self.sp + 4] = ret_addr >> 32 & self.B_MASK
-            self.mem[self.sp + 3] = ret_addr >> 24 & self.B_MASK
-            self.mem[self.sp + 2] = ret_addr >> 16 & self.B_MASK
-            self.mem[self.sp + 1] = ret_addr >> 8 & self.B_MASK
-            self.mem[self.sp]     = ret_addr & self.B_MASK
+            self.memory.write_dword(self.sp, self.pc + opcode.length)
+            if self.sp < self.code_hi:
+                self.invalidate(self.sp, 8)
             self.pc = addr
             self.print_debug_symbol(addr)
         else:
@@ -549,24 +634,10 @@ class ISA:
 
     def RET(self, opcode):
         if self.sp + 8 <= self.MEM_SIZE:
-            addr = (
-                self.mem[self.sp] |
-                self.mem[self.sp + 1] << 8 |
-                self.mem[self.sp + 2] << 16 |
-                self.mem[self.sp + 3] << 24 |
-                self.mem[self.sp + 4] << 32 |
-                self.mem[self.sp + 5] << 40 |
-                self.mem[self.sp + 6] << 48 |
-                self.mem[self.sp + 7] << 56
-            ) & self.DW_MASK
-            self.mem[self.sp + 7] = 0
-            self.mem[self.sp + 6] = 0
-            self.mem[self.sp + 5] = 0
-            self.mem[self.sp + 4] = 0
-            self.mem[self.sp + 3] = 0
-            self.mem[self.sp + 2] = 0
-            self.mem[self.sp + 1] = 0
-            self.mem[self.sp] = 0
+            addr = self.memory.read_dword(self.sp)
+            self.memory.write_dword(self.sp, 0)
+            if self.sp < self.code_hi:
+                self.invalidate(self.sp, 8)
             self.sp += 8
             self.pc = addr
         else:
@@ -574,6 +645,93 @@ class ISA:
 
     def HALT(self):
         self.running = False
+        self.halted = True
+        self.console.flush()
+
+    def read_str(self, addr):
+        # Bytes from addr up to the NUL terminator
+        end = self.mem.find(b"\0", addr)
+        if end == -1:
+            raise IndexError(f"Unterminated string at address ({addr})")
+        return self.mem[addr : end]
+
+    def skip(self):
+        pass
+
+    # Fused Instructions
+    # Each one runs a whole sequence found by fuse(), flags end up exactly as the unfused sequence leaves them
+    def LD_CMP_JZ(self, rn, val, rx, addr, next_pc):
+        # LD Rn, Val / CMP Rx, Rn / JZ Addr
+        self.fusion_counts["LD_CMP_JZ"] += 1
+        self.reg[rn] = val
+        a = self.reg[rx]
+        res = a - val
+        self.zsc_res = res
+        self.o_src = ("SUB", a, val, res)
+        self.pc = addr if res == 0 else next_pc
+
+    def LD_CMP_JNZ(self, rn, val, rx, addr, next_pc):
+        # LD Rn, Val / CMP Rx, Rn / JNZ Addr
+        self.fusion_counts["LD_CMP_JNZ"] += 1
+        self.reg[rn] = val
+        a = self.reg[rx]
+        res = a - val
+        self.zsc_res = res
+        self.o_src = ("SUB", a, val, res)
+        self.pc = addr if res != 0 else next_pc
+
+    def LD_CMP_JCC(self, rn, val, rx, jcc, addr, opcode, jcc_pc):
+        # LD Rn, Val / CMP Rx, Rn / any other Jcc
+        self.fusion_counts["LD_CMP_JCC"] += 1
+        self.reg[rn] = val
+        self.CMP(rx, rn)
+        self.pc = jcc_pc
+        jcc(addr, opcode)
+
+    def LD_CMP(self, rn, val, rx):
+        # LD Rn, Val / CMP Rx, Rn
+        self.fusion_counts["LD_CMP"] += 1
+        self.reg[rn] = val
+        self.CMP(rx, rn)
+
+    def CMP_JZ(self, rx, ry, addr, next_pc):
+        # CMP Rx, Ry / JZ Addr
+        self.fusion_counts["CMP_JZ"] += 1
+        a = self.reg[rx]
+        b = self.reg[ry]
+        res = a - b
+        self.zsc_res = res
+        self.o_src = ("SUB", a, b, res)
+        self.pc = addr if res == 0 else next_pc
+
+    def CMP_JNZ(self, rx, ry, addr, next_pc):
+        # CMP Rx, Ry / JNZ Addr
+        self.fusion_counts["CMP_JNZ"] += 1
+        a = self.reg[rx]
+        b = self.reg[ry]
+        res = a - b
+        self.zsc_res = res
+        self.o_src = ("SUB", a, b, res)
+        self.pc = addr if res != 0 else next_pc
+
+    def CMP_JCC(self, rx, ry, jcc, addr, opcode, jcc_pc):
+        # CMP Rx, Ry / any other Jcc
+        self.fusion_counts["CMP_JCC"] += 1
+        self.CMP(rx, ry)
+        self.pc = jcc_pc
+        jcc(addr, opcode)
+
+    def PUSH_N(self, regs):
+        # Run of PUSH Rx
+        self.fusion_counts["PUSH_N"] += 1
+        for rx in regs:
+            self.PUSH(rx)
+
+    def POP_N(self, regs):
+        # Run of POP Rx
+        self.fusion_counts["POP_N"] += 1
+        for rx in regs:
+            self.POP(rx)
 
     # Fetch-Decode-Execute Cycle
     def decode_rx_ry(self, cinstr):
@@ -617,58 +775,241 @@ class ISA:
         raise ValueError(f"Invalid register ({rx})")
 
     def decode_addr(self, cinstr):
-        addr = (
-            cinstr[1 + 7] << 56 |
-            cinstr[1 + 6] << 48 |
-            cinstr[1 + 5] << 40 |
-            cinstr[1 + 4] << 32 |
-            cinstr[1 + 3] << 24 |
-            cinstr[1 + 2] << 16 |
-            cinstr[1 + 1] << 8 |
-            cinstr[1]
-        ) & self.DW_MASK
+        addr = int.from_bytes(cinstr[1 : 9], "little")
         if (addr >= 0 and addr < self.MEM_SIZE):
             return addr
         raise ValueError(f"Invalid address ({addr})")
 
+    # Decoded Instruction Cache
+    def build_dispatch_table(self):
+        # 256-entry table indexed by the raw opcode byte, each slot a bound decoder(pc) -> (entry, end)
+        # where entry = (handler, args, next_pc) and next_pc is None for instructions that set the PC themselves
+        table = [self.decode_invalid] * 256
+        for opcode in Opcode:
+            match opcode:
+                case Opcode.NOP | Opcode.RET | Opcode.HALT:
+                    decoder = self.decode_no_operand
+                case Opcode.LH | Opcode.LW | Opcode.LD | Opcode.SH | Opcode.SW | Opcode.SD:
+                    decoder = self.decode_mem_operand
+                case Opcode.LB | Opcode.SB | Opcode.MOV | Opcode.ADD | Opcode.SUB | Opcode.MUL | Opcode.DIV | Opcode.AND | Opcode.OR | Opcode.XOR | Opcode.CMP:
+                    decoder = self.decode_rx_ry_operand
+                case Opcode.INC | Opcode.DEC | Opcode.NOT | Opcode.SHL | Opcode.SHR | Opcode.PUSH | Opcode.POP:
+                    decoder = self.decode_rx_operand
+                case Opcode.JMP | Opcode.JZ | Opcode.JNZ | Opcode.JC | Opcode.JNC | Opcode.JL | Opcode.JLE | Opcode.JG | Opcode.JGE | Opcode.CALL:
+                    decoder = self.decode_addr_operand
+                case Opcode.SYS:
+                    decoder = self.decode_port_operand
+            table[opcode.value] = partial(decoder, opcode)
+        return table
+
+    def decode(self, pc):
+        # Decodes the instruction at pc once and caches it
+        entry, end = self.dispatch[self.mem[pc]](pc)
+        if self.fusion:
+            entry, end = self.fuse(pc, entry, end)
+        self.icache[pc] = entry
+        if pc < self.code_lo:
+            self.code_lo = pc
+        if end > self.code_hi:
+            self.code_hi = end
+        if end - pc > self.icache_span:
+            self.icache_span = end - pc
+        return entry
+
+    def decode_unfused(self, pc):
+        # Like decode() without fusion, cached in ucache
+        entry, end = self.dispatch[self.mem[pc]](pc)
+        self.ucache[pc] = entry
+        if pc < self.code_lo:
+            self.code_lo = pc
+        if end > self.code_hi:
+            self.code_hi = end
+        return entry
+
+    def peek(self, pc):
+        # Decodes without caching, None if the bytes at pc are not a valid instruction
+        try:
+            return self.dispatch[self.mem[pc]](pc)
+        except (ValueError, IndexError):
+            return None
+
+    def fuse(self, pc, entry, end):
+        # Replaces the entry at pc with a superinstruction when it starts a known sequence
+        handler, args, next_pc = entry
+        name = handler.__name__
+        jccs = ("JZ", "JNZ", "JC", "JNC", "JL", "JLE", "JG", "JGE")
+
+        if name in ("LH", "LW", "LD") and args[2] == 1: # Immediate
+            rn, val, mode = args
+            second = self.peek(end)
+            if second is None or second[0][0].__name__ != "CMP" or second[0][1][1] != rn:
+                return entry, end
+            (cmp, (rx, ry), cmp_next), cmp_end = second
+            third = self.peek(cmp_end)
+            if third is not None and third[0][0].__name__ in jccs:
+                (jcc, (addr, opcode), _), jcc_end = third
+                if jcc.__name__ == "JZ":
+                    return (self.LD_CMP_JZ, (rn, val, rx, addr, jcc_end), None), jcc_end
+                if jcc.__name__ == "JNZ":
+                    return (self.LD_CMP_JNZ, (rn, val, rx, addr, jcc_end), None), jcc_end
+                return (self.LD_CMP_JCC, (rn, val, rx, jcc, addr, opcode, cmp_end), None), jcc_end
+            return (self.LD_CMP, (rn, val, rx), cmp_end), cmp_end
+
+        if name == "CMP":
+            rx, ry = args
+            second = self.peek(end)
+            if second is not None and second[0][0].__name__ in jccs:
+                (jcc, (addr, opcode), _), jcc_end = second
+                if jcc.__name__ == "JZ":
+                    return (self.CMP_JZ, (rx, ry, addr, jcc_end), None), jcc_end
+                if jcc.__name__ == "JNZ":
+                    return (self.CMP_JNZ, (rx, ry, addr, jcc_end), None), jcc_end
+                return (self.CMP_JCC, (rx, ry, jcc, addr, opcode, end), None), jcc_end
+            return entry, end
+
+        if name in ("PUSH", "POP"):
+            regs = [args[0]]
+            run_end = end
+            while True:
+                following = self.peek(run_end)
+                if following is None or following[0][0].__name__ != name:
+                    break
+                regs.append(following[0][1][0])
+                run_end = following[1]
+            if len(regs) > 1:
+                fused = self.PUSH_N if name == "PUSH" else self.POP_N
+                return (fused, (tuple(regs),), run_end), run_end
+            return entry, end
+
+        return entry, end
+
+    def decode_invalid(self, pc):
+        raise ValueError(f"Invalid opcode (0x{self.mem[pc]:02X}) at address ({pc})")
+
+    def decode_no_operand(self, opcode, pc):
+        end = pc + opcode.length
+        if opcode == Opcode.NOP:
+            return (self.NOP, (opcode,), None), end
+        if opcode == Opcode.RET:
+            return (self.RET, (opcode,), None), end
+        return (self.HALT, (), None), end
+
+    def decode_rx_ry_operand(self, opcode, pc):
+        end = pc + opcode.length
+        return (getattr(self, opcode.name), self.decode_rx_ry(self.mem[pc : end]), end), end
+
+    def decode_rx_operand(self, opcode, pc):
+        end = pc + opcode.length
+        return (getattr(self, opcode.name), (self.decode_rx(self.mem[pc : end]),), end), end
+
+    def decode_addr_operand(self, opcode, pc):
+        end = pc + opcode.length
+        addr = self.decode_addr(self.mem[pc : end])
+        if opcode == Opcode.JMP:
+            return (self.JMP, (addr,), None), end
+        return (getattr(self, opcode.name), (addr, opcode), None), end
+
+    def decode_port_operand(self, opcode, pc):
+        end = pc + opcode.length
+        rx, port = self.decode_rx_port(self.mem[pc : end])
+        if port in self.bus.ports:
+            handler, args = self.bus.ports[port]
+            return (handler, (rx,) + args, end), end
+        return (self.skip, (), end), end
+
+    def decode_mem_operand(self, opcode, pc):
+        # Variable length LH/LW/LD/SH/SW/SD, see the mode tables on the handlers
+        width = {Opcode.LH: 2, Opcode.SH: 2, Opcode.LW: 4, Opcode.SW: 4, Opcode.LD: 8, Opcode.SD: 8}[opcode]
+        mask = (1 << (width * 8)) - 1
+        handler = getattr(self, opcode.name)
+        is_load = opcode in (Opcode.LH, Opcode.LW, Opcode.LD)
+        cinstr = self.mem[pc : pc + self.MAX_INSTR_LENGTH]
+        mode = cinstr[1]
+        rx = cinstr[2]
+        if mode in (0x01, 0x03):
+            end = pc + opcode.length + width - 1
+            val = int.from_bytes(cinstr[3 : 3 + width], "little") & mask
+            if not (rx >= 0 and rx < self.MAX_REG):
+                raise ValueError(f"Invalid register ({rx})")
+            if mode == 0x01 and is_load:  # Immediate
+                return (handler, (rx, val, 1), end), end
+            if mode == 0x03:  # Absolute address
+                if val >= 0 and val < self.MEM_SIZE - 1:
+                    return (handler, (rx, val, 2), end), end
+                raise ValueError(f"Invalid register ({rx}) or address ({val})")
+            return (self.skip, (), end), end
+
+        end = pc + opcode.length
+        ry = cinstr[3]
+        if not (rx >= 0 and rx < self.MAX_REG and ry >= 0 and ry < self.MAX_REG):
+            raise ValueError(f"Invalid register ({rx}) or ({ry})")
+        if mode == 0x02 and is_load:  # Register-to-register
+            return (handler, (rx, ry, 0), end), end
+        if mode == 0x04:  # Indirect
+            return (handler, (rx, ry, 3), end), end
+        return (self.skip, (), end), end
+
+    def translate_block(self, pc):
+        block, end, count = self.jit.translate(pc)
+        self.blocks[pc] = (block, end, count)
+        if pc < self.code_lo:
+            self.code_lo = pc
+        if end > self.code_hi:
+            self.code_hi = end
+        return block
+
+    def invalidate(self, addr, length):
+        # Drops every cached instruction and translated block overlapping [addr, addr + length)
+        for pc in range(max(addr - self.icache_span + 1, 0), addr + length):
+            self.icache.pop(pc, None)
+            self.ucache.pop(pc, None)
+        for pc, (block, end, count) in list(self.blocks.items()):
+            if pc < addr + length and addr < end:
+                del self.blocks[pc]
+
+    def read_header(self, b):
+        # Returns (DATA_OFFSET, DATA_LENGTH, CODE_OFFSET, CODE_LENGTH, ENTRY_POINT) from the 64 byte header of an open binary
+        mgcn = b.read(len(self.MAGIC_NUM))
+        if tuple(mgcn) == self.MAGIC_NUM:   
+            bytearr = b.read(self.HEADER_LENGTH - len(self.MAGIC_NUM))
+
+            def read_dword(offset):
+                return (
+                    bytearr[offset + 0]
+                    | (bytearr[offset + 1] << 8)
+                    | (bytearr[offset + 2] << 16)
+                    | (bytearr[offset + 3] << 24)
+                    | (bytearr[offset + 4] << 32)
+                    | (bytearr[offset + 5] << 40)
+                    | (bytearr[offset + 6] << 48)
+                    | (bytearr[offset + 7] << 56)
+                ) & self.DW_MASK
+
+            DATA_OFFSET  = read_dword(0)
+            DATA_LENGTH  = read_dword(8)
+            CODE_OFFSET  = read_dword(16)
+            CODE_LENGTH  = read_dword(24)
+            ENTRY_POINT  = read_dword(32)
+            return DATA_OFFSET, DATA_LENGTH, CODE_OFFSET, CODE_LENGTH, ENTRY_POINT
+        else:
+            raise ValueError(
+                f"Magic number mismatch: file=({list(mgcn)}), expected={list(self.MAGIC_NUM)}"
+            )
+
     def load_bin_into_mem(self, input_fn):
         self.reset()
 
         with open(f"{input_fn}", "rb") as b:
-            mgcn = b.read(len(self.MAGIC_NUM))
-            if tuple(mgcn) == self.MAGIC_NUM:   
-                bytearr = b.read(self.HEADER_LENGTH - len(self.MAGIC_NUM))
-
-                def read_dword(offset):
-                    return (
-                        bytearr[offset + 0]
-                        | (bytearr[offset + 1] << 8)
-                        | (bytearr[offset + 2] << 16)
-                        | (bytearr[offset + 3] << 24)
-                        | (bytearr[offset + 4] << 32)
-                        | (bytearr[offset + 5] << 40)
-                        | (bytearr[offset + 6] << 48)
-                        | (bytearr[offset + 7] << 56)
-                    ) & self.DW_MASK
-
-                DATA_OFFSET  = read_dword(0)
-                DATA_LENGTH  = read_dword(8)
-                CODE_OFFSET  = read_dword(16)
-                CODE_LENGTH  = read_dword(24)
-                ENTRY_POINT  = read_dword(32)
-
-                TOTAL_LENGTH = DATA_LENGTH + CODE_LENGTH
-                if TOTAL_LENGTH <= self.MEM_SIZE:
-                    b.seek(DATA_OFFSET)
-                    self.mem[0:TOTAL_LENGTH] = b.read(TOTAL_LENGTH)
-                    self.pc = ENTRY_POINT - self.HEADER_LENGTH
-                else:
-                    raise OverflowError(
-                        f"Binary instructions exceed memory size: {TOTAL_LENGTH} bytes >= {self.MEM_SIZE} bytes"
-                    )
+            DATA_OFFSET, DATA_LENGTH, CODE_OFFSET, CODE_LENGTH, ENTRY_POINT = self.read_header(b)
+
+            TOTAL_LENGTH = DATA_LENGTH + CODE_LENGTH
+            if TOTAL_LENGTH <= self.MEM_SIZE:
+                b.seek(DATA_OFFSET)
+                self.memory.write(0, b.read(TOTAL_LENGTH))
+                self.pc = ENTRY_POINT - self.HEADER_LENGTH
             else:
-                raise ValueError(
-                    f"Magic number mismatch: file=({list(mgcn)}), expected={list(self.MAGIC_NUM)}"
+                raise OverflowError(
+                    f"Binary instructions exceed memory size: {TOTAL_LENGTH} bytes >= {self.MEM_SIZE} bytes"
                 )
     
     def load_argv_into_mem(self, argc, argv):
@@ -677,43 +1018,373 @@ class ISA:
             ptrs = []
             for arg in argv:
                 ptrs.append(self.HEAP_START + offset)
-                for j in range(len(arg)):
-                    self.mem[self.HEAP_START + offset] = ord(arg[j])
-                    offset += 1
-                self.mem[self.HEAP_START + offset] = 0
-                offset += 1
+                encoded = arg.encode() + b"\0"
+                self.memory.write(self.HEAP_START + offset, encoded)
+                offset += len(encoded)
+            self.heap.reset(self.HEAP_START + offset) # MALLOC hands out memory after the argv strings
             
             for ptr in reversed(ptrs):
                 self.sp -= 8
-                self.mem[self.sp + 7] = ptr >> 56 & self.B_MASK
-                self.mem[self.sp + 6] = ptr >> 48 & self.B_MASK
-                self.mem[self.sp + 5] = ptr >> 40 & self.B_MASK
-                self.mem[self.sp + 4] = ptr >> 32 & self.B_MASK
-                self.mem[self.sp + 3] = ptr >> 24 & self.B_MASK
-                self.mem[self.sp + 2] = ptr >> 16 & self.B_MASK
-                self.mem[self.sp + 1] = ptr >> 8 & self.B_MASK
-                self.mem[self.sp]     = ptr & self.B_MASK
+                self.memory.write_dword(self.sp, ptr)
 
             self.sp -= 8
-            self.mem[self.sp + 7] = argc >> 56 & self.B_MASK
-            self.mem[self.sp + 6] = argc >> 48 & self.B_MASK
-            self.mem[self.sp + 5] = argc >> 40 & self.B_MASK
-            self.mem[self.sp + 4] = argc >> 32 & self.B_MASK
-            self.mem[self.sp + 3] = argc >> 24 & self.B_MASK
-            self.mem[self.sp + 2] = argc >> 16 & self.B_MASK
-            self.mem[self.sp + 1] = argc >> 8 & self.B_MASK
-            self.mem[self.sp]     = argc & self.B_MASK
-
-    def run(self, input_fn, debug_mode=False, step_mode=False, argc=0, argv=None):
+            self.memory.write_dword(self.sp, argc & self.DW_MASK)
+
+    def run(self, input_fn, debug_mode=False, step_mode=False, argc=0, argv=None, engine="cache", max_instructions=None, max_seconds=None):
         self.load_bin_into_mem(input_fn)
         self.load_argv_into_mem(argc, argv)
         if step_mode:
             self.debugger = True
             self.load_debug_symbols(input_fn)
-        if debug_mode:
-            self.log(self)
+        elif engine in ("counted", "profile") and os.path.exists(f"{input_fn}.symbols"):
+            self.load_debug_symbols(input_fn)
+        if engine == "profile":
+            self.profile_fn = f"{input_fn}.folded"
 
-        self.running = True
+        if step_mode:
+            self.running = True
+            try:
+                self.execute_match(step_mode)
+            finally:
+                self.console.flush()
+            return RunResult(RunResult.HALTED if self.halted else RunResult.PREEMPTED, pc=self.pc)
+        elif debug_mode:
+            result = self.resume("trace")
+        else:
+            result = self.resume(engine, max_instructions, max_seconds)
+        # Without a budget a fault is raised as it always was, budgeted runs return it in the result like resume()
+        if result.status == RunResult.FAULTED and max_instructions is None and max_seconds is None:
+            raise result.error
+        return result
+
+    def execute_cached(self):
+        icache = self.icache
+        decode = self.decode
+        while (self.running):
+            entry = icache.get(self.pc)
+            if entry is None:
+                entry = decode(self.pc)
+            handler, args, next_pc = entry
+            handler(*args)
+            if next_pc is not None:
+                self.pc = next_pc
+
+    def execute_blocks(self):
+        blocks = self.blocks
+        reg = self.reg
+        mem = self.mem
+        while (self.running):
+            entry = blocks.get(self.pc)
+            if entry is None:
+                block = self.translate_block(self.pc)
+            else:
+                block = entry[0]
+            block(self, reg, mem)
+
+    def execute_blocks_budgeted(self, max_instructions, deadline):
+        # Block engine that checks the budgets before each block, a block only runs if all of it fits.
+        # The rest of the instruction budget is single-stepped, so a budget smaller than the next block still
+        # makes progress and the ISA stops in the middle of that block, where the next resume() picks up.
+        # Returns the budget that ran out or None, the instructions retired are left in self.retired
+        blocks = self.blocks
+        reg = self.reg
+        mem = self.mem
+        count = 0
+        check = self.TIME_CHECK_INTERVAL
+        try:
+            while (self.running):
+                entry = blocks.get(self.pc)
+                if entry is None:
+                    self.translate_block(self.pc)
+                    entry = blocks[self.pc]
+                block, end, n = entry
+                if count + n > max_instructions:
+                    while self.running and count < max_instructions:
+                        # Decoded without fusion and without caching, every entry is exactly one instruction
+                        (handler, args, next_pc), _ = self.dispatch[mem[self.pc]](self.pc)
+                        handler(*args)
+                        count += 1
+                        if next_pc is not None:
+                            self.pc = next_pc
+                    return "instructions" if self.running else None
+                check -= 1
+                if check == 0:
+                    check = self.TIME_CHECK_INTERVAL
+                    if time.monotonic() >= deadline:
+                        return "time"
+                try:
+                    block(self, reg, mem)
+                except Blocked:
+                    count += n - 1 # Everything up to the SYS ran
+                    raise
+                count += n
+            return None
+        finally:
+            self.retired = count
+
+    def execute_cached_budgeted(self, max_instructions, deadline):
+        # Cached engine on the unfused ucache so every entry is one instruction (icache keeps its fused
+        # entries for unbudgeted runs), the time budget is checked at control transfers (entries that set the PC themselves)
+        # Returns the budget that ran out or None, the instructions retired are left in self.retired
+        ucache = self.ucache
+        decode = self.decode_unfused
+        count = 0
+        check = self.TIME_CHECK_INTERVAL
+        try:
+            while (self.running):
+                if count >= max_instructions:
+                    return "instructions"
+                entry = ucache.get(self.pc)
+                if entry is None:
+                    entry = decode(self.pc)
+                handler, args, next_pc = entry
+                handler(*args)
+                count += 1
+                if next_pc is not None:
+                    self.pc = next_pc
+                else:
+                    check -= 1
+                    if check == 0:
+                        check = self.TIME_CHECK_INTERVAL
+                        if time.monotonic() >= deadline:
+                            return "time"
+            return None
+        finally:
+            self.retired = count
+
+    def execute_counted(self):
+        # Cached engine with fusion off plus execution counters, the other engines carry no instrumentation
+        # counters["opcodes"]: opcode name -> instructions retired
+        # counters["branches"]: Jcc address -> [taken, not taken]
+        # counters["calls"]: CALL target address -> calls
+        self.counters = {"opcodes": {}, "branches": {}, "calls": {}}
+        opcodes = self.counters["opcodes"]
+        branches = self.counters["branches"]
+        calls = self.counters["calls"]
+        names = [None] * 256
+        for opcode in Opcode:
+            names[opcode.value] = opcode.name
+        conditional = (Opcode.JZ, Opcode.JNZ, Opcode.JC, Opcode.JNC, Opcode.JL, Opcode.JLE, Opcode.JG, Opcode.JGE)
+        conditional = {opcode.name for opcode in conditional}
+
+        # Superinstructions would hide the opcodes they replace
+        fusion = self.fusion
+        self.fusion = False
+        self.icache.clear()
+        self.icache_span = self.MAX_INSTR_LENGTH
+
+        icache = self.icache
+        decode = self.decode
+        mem = self.mem
+        try:
+            while (self.running):
+                pc = self.pc
+                entry = icache.get(pc)
+                if entry is None:
+                    entry = decode(pc)
+                handler, args, next_pc = entry
+                name = names[mem[pc]]
+                opcodes[name] = opcodes.get(name, 0) + 1
+                handler(*args)
+                if next_pc is not None:
+                    self.pc = next_pc
+                elif name in conditional:
+                    counts = branches.get(pc)
+                    if counts is None:
+                        counts = branches[pc] = [0, 0]
+                    if self.pc == args[0] and self.pc != pc + args[1].length:
+                        counts[0] += 1
+                    else:
+                        counts[1] += 1
+                elif name == "CALL":
+                    calls[args[0]] = calls.get(args[0], 0) + 1
+        finally:
+            self.fusion = fusion
+            self.icache.clear() # Unfused entries, let the next engine decode its own
+            self.icache_span = self.MAX_INSTR_LENGTH
+        if not self.running:
+            self.report_counters()
+
+    def execute_profiled(self):
+        # Cached engine with fusion off that keeps a shadow call stack from CALL/RET
+        # and records the stack every profile_interval instructions.
+        # Sampling is a fixed instruction countdown, not a timer: samples weigh stacks by instructions retired,
+        # so time spent inside a SYS call (file or console I/O) counts as one instruction.
+        # The label the sampled PC is in becomes the leaf frame, code reached through JMP shows up under its own label.
+        self.profile = {}
+        samples = self.profile
+        interval = self.profile_interval
+        names = {}
+        leaves = {} # (folded path, PC) -> sample key
+        call = self.CALL.__func__
+        ret = self.RET.__func__
+        # Each stack entry is the folded path to that frame, so a sample is one dict update
+        stack = [self.symbolize(self.pc)]
+
+        fusion = self.fusion
+        self.fusion = False
+        self.icache.clear()
+        self.icache_span = self.MAX_INSTR_LENGTH
+
+        icache = self.icache
+        decode = self.decode
+        countdown = interval
+        try:
+            while (self.running):
+                entry = icache.get(self.pc)
+                if entry is None:
+                    entry = decode(self.pc)
+                handler, args, next_pc = entry
+                handler(*args)
+                if next_pc is not None:
+                    self.pc = next_pc
+                else:
+                    func = handler.__func__
+                    if func is call:
+                        if self.pc == args[0]:
+                            name = names.get(args[0])
+                            if name is None:
+                                name = names[args[0]] = self.symbolize(args[0])
+                            stack.append(f"{stack[-1]};{name}")
+                    elif func is ret and len(stack) > 1:
+                        stack.pop()
+                countdown -= 1
+                if countdown == 0:
+                    countdown = interval
+                    key = (stack[-1], self.pc)
+                    path = leaves.get(key)
+                    if path is None:
+                        label = self.symbolize(self.pc).split("+")[0]
+                        path = leaves[key] = stack[-1] if stack[-1].rsplit(";", 1)[-1] == label else f"{stack[-1]};{label}"
+                    samples[path] = samples.get(path, 0) + 1
+        finally:
+            self.fusion = fusion
+            self.icache.clear()
+            self.icache_span = self.MAX_INSTR_LENGTH
+        if not self.running and self.profile_fn is not None:
+            self.write_profile(self.profile_fn)
+
+    def write_profile(self, output_fn):
+        # One "frame;frame;frame samples" line per stack, the input format of flamegraph.pl, inferno and speedscope
+        with open(output_fn, "w") as f:
+            for path, count in sorted(self.profile.items()):
+                f.write(f"{path} {count}\n")
+        print(f"Profile: {sum(self.profile.values())} samples every {self.profile_interval} instructions written to {output_fn}", file=sys.stderr)
+
+    def execute_traced(self):
+        # Cached engine with fusion off that records pc, opcode, the registers written and the memory written
+        # by every instruction, see tracer.py for the record layout
+        tracer = Tracer(self.trace_fn)
+        names = [None] * 256
+        for opcode in Opcode:
+            names[opcode.value] = opcode.name
+        widths = {"SB": 1, "SH": 2, "SW": 4, "SD": 8, "PUSH": 8, "POP": 8, "CALL": 8, "RET": 8}
+
+        fusion = self.fusion
+        self.fusion = False
+        self.icache.clear()
+        self.icache_span = self.MAX_INSTR_LENGTH
+
+        icache = self.icache
+        decode = self.decode
+        reg = self.reg
+        mem = self.mem
+        skip = self.skip
+        record = tracer.record
+        try:
+            while (self.running):
+                pc = self.pc
+                entry = icache.get(pc)
+                if entry is None:
+                    entry = decode(pc)
+                handler, args, next_pc = entry
+                opcode = mem[pc]
+                name = names[opcode]
+
+                # Where this instruction stores, worked out before it moves sp or changes the address register
+                addr = None
+                if name in widths and handler != skip: # Stores with an unsupported mode decode to a no-op
+                    if name == "SB":
+                        addr = reg[args[1]]
+                    elif name in ("PUSH", "CALL"):
+                        addr = self.sp - 8
+                    elif name in ("POP", "RET"):
+                        addr = self.sp
+                    elif args[2] == 2:
+                        addr = args[1]
+                    elif args[2] == 3:
+                        addr = reg[args[1]]
+                before = reg[:]
+
+                handler(*args)
+                if next_pc is not None:
+                    self.pc = next_pc
+
+                changed = [i for i in range(self.MAX_REG) if before[i] != reg[i]] if before != reg else []
+                first = changed[0] if changed else Tracer.NO_REG
+                reg_val = reg[first] if changed else 0
+                if addr is not None and 0 <= addr <= self.MEM_SIZE - widths[name]:
+                    width = widths[name]
+                    record(pc, opcode, first, reg_val, addr, int.from_bytes(mem[addr : addr + width], "little"), width)
+                else:
+                    record(pc, opcode, first, reg_val)
+                for i in changed[1:]:
+                    record(pc, opcode, i, reg[i], flags=Tracer.CONTINUED)
+        finally:
+            tracer.close()
+            self.fusion = fusion
+            self.icache.clear()
+            self.icache_span = self.MAX_INSTR_LENGTH
+
+    def report_counters(self, file=None):
+        if file is None:
+            file = sys.stderr # Looked up per call, so a redirected sys.stderr (e.g. by test.py) receives it
+        counters = self.counters
+        total = sum(counters["opcodes"].values())
+        print(f"Instructions retired: {total}", file=file)
+        for name, count in sorted(counters["opcodes"].items(), key=lambda item: -item[1]):
+            print(f"  {name:<8} {count:>12} {count / total:7.2%}", file=file)
+        print("Conditional branches (taken / not taken):", file=file)
+        for pc, (taken, not_taken) in sorted(counters["branches"].items()):
+            print(f"  {self.symbolize(pc):<32} {taken:>12} {not_taken:>12}", file=file)
+        print("Calls:", file=file)
+        for addr, count in sorted(counters["calls"].items(), key=lambda item: -item[1]):
+            print(f"  {self.symbolize(addr):<32} {count:>12}", file=file)
+
+    def symbolize(self, addr):
+        # Nearest symbol at or before addr from the .symbols file, "label+0x10"
+        best = None
+        for sym_addr, name in self.debug_symbols.items():
+            if sym_addr <= addr and (best is None or sym_addr > best[0]):
+                best = (sym_addr, name)
+        if best is None:
+            return f"0x{addr:06X}"
+        if best[0] == addr:
+            return best[1]
+        return f"{best[1]}+0x{addr - best[0]:X}"
+
+    def execute_until(self, stop):
+        # Runs the cached engine until the PC lands on an address in stop, used by recompiled programs (see recompiler.py)
+        icache = self.icache
+        decode = self.decode
+        while (self.running and self.pc not in stop):
+            entry = icache.get(self.pc)
+            if entry is None:
+                entry = decode(self.pc)
+            handler, args, next_pc = entry
+            handler(*args)
+            if next_pc is not None:
+                self.pc = next_pc
+
+    def execute_table(self):
+        dispatch = self.dispatch
+        while (self.running):
+            (handler, args, next_pc), end = dispatch[self.mem[self.pc]](self.pc)
+            handler(*args)
+            if next_pc is not None:
+                self.pc = next_pc
+
+    def execute_match(self, step_mode=False):
         while (self.running):
             opcode = Opcode(self.mem[self.pc])
 
@@ -725,15 +1396,13 @@ class ISA:
                 end += 3
             elif opcode in (Opcode.LD, Opcode.SD) and self.mem[self.pc + 1] in (0x01, 0x03):
                 end += 7
-            cinstr = self.mem[self.pc : end]
+            cinstr = bytearray(self.mem[self.pc : end])
 
             if step_mode:
                 print(opcode)
                 for b in cinstr:
                     print(f"{b:02X}", end=' ')
                 print()
-            if debug_mode:
-                self.log(opcode)    
 
             match opcode:
                 case Opcode.NOP:
@@ -1022,7 +1691,7 @@ class ISA:
                     self.pc += opcode.length
                 case Opcode.SYS:
                     rx, port = self.decode_rx_port(cinstr)
-                    if (port in self.ports):
+                    if (port in self.bus.ports):
                         self.SYS(rx, port)
                     self.pc += opcode.length
                 case Opcode.CALL:
@@ -1035,8 +1704,6 @@ class ISA:
 
             if step_mode:
                 self.step()
-            if debug_mode:
-                self.log(self)
 
     # Helper methods
     def __str__(self):
@@ -1063,18 +1730,136 @@ class ISA:
 
     def reset(self):
         self.reg = [0] * self.MAX_REG # 32 registers, 64 bits per register
-        self.mem = bytearray(self.MEM_SIZE) # 4 MB memory
+        self.memory.reset() # Zeroes only the pages the last run wrote
         self.pc = 0
         self.sp = self.STACK_END
         self.flags = 0b00000000 
-        self.files = {}
-        self.next_fd = 3
-    
-    def log(self, string):
-        with open('debug_log.txt', 'a') as f:
-            f.write(str(string) + '\n')
+        self.bus.reset()
+        self.heap.reset(self.HEAP_START)
+        self.icache.clear()
+        self.ucache.clear()
+        self.icache_span = self.MAX_INSTR_LENGTH
+        self.fusion_counts = {name: 0 for name in self.FUSED}
+        self.blocks.clear()
+        self.code_lo = self.MEM_SIZE
+        self.code_hi = 0
+        self.halted = False
+        self.preempted = False
+
+    # Snapshots
+    # Memory pages are immutable bytes shared between snapshots (see memory.py), so taking one after
+    # load_bin_into_mem + load_argv_into_mem and restoring or forking it per input is cheap.
+    # fork() maps the snapshot's pages copy-on-write: children share every page they have not written.
+    # Devices snapshot their own state, e.g. open files are reopened at their position (see files.py).
+    def snapshot(self):
+        return {
+            "reg": list(self.reg),
+            "pc": self.pc,
+            "sp": self.sp,
+            "flags": (self.flag_bits, self.zsc_res, self.o_src),
+            "devices": self.bus.snapshot(),
+            "heap": self.heap.snapshot(),
+            "pages": self.memory.snapshot()
+        }
+
+    def restore(self, snapshot):
+        self.reg[:] = snapshot["reg"]
+        self.pc = snapshot["pc"]
+        self.sp = snapshot["sp"]
+        self.flag_bits, self.zsc_res, self.o_src = snapshot["flags"]
+        self.bus.restore(snapshot["devices"])
+        self.heap.restore(snapshot["heap"])
+        page = Memory.PAGE_SIZE
+        for n in self.memory.restore(snapshot["pages"]):
+            # Decoded instructions and blocks survive unless their bytes were rewritten
+            if self.code_lo < (n + 1) * page and n * page < self.code_hi:
+                self.invalidate(n * page, page)
+        self.running = False
+        self.halted = False
+
+    def fork(self, snapshot=None):
+        # New ISA in the state of snapshot (default: this ISA now), runs independently of this one
+        # The child's memory is a private (copy-on-write) mapping: of an Image of the snapshot, written once per
+        # snapshot and shared by all its children, or of the same file when this ISA's Memory is file-backed.
+        # The child's own snapshots are relative to that mapping, like those of any file-backed Memory.
+        # It keeps the fusion setting, the console streams and every port rebound with rebind_port.
+        # Devices added with attach() are not carried over.
+        if snapshot is None:
+            snapshot = self.snapshot()
+        if self.memory.fd is None:
+            image = snapshot.get("image")
+            if image is None:
+                image = snapshot["image"] = Image(self.MEM_SIZE, snapshot["pages"])
+            child = ISA(Memory(self.MEM_SIZE, image.fd))
+            state = dict(snapshot, pages={}) # The mapping already holds every page
+        else:
+            child = ISA(self.memory.clone())
+            state = snapshot
+        child.fusion = self.fusion
+        child.console.stdin = self.console.stdin
+        child.console.stdout = self.console.stdout
+        child.console.line_threshold = self.console.line_threshold
+        for port, (handler, args) in self.bus.rebound.items():
+            child.bus.rebind_port(port, handler, *args)
+        child.restore(state)
+        return child
+
+    def resume(self, engine="cache", max_instructions=None, max_seconds=None):
+        # Runs from the current state, e.g. after restore() or fork(), and returns a RunResult (see result.py)
+        # With max_instructions and/or max_seconds the engine stops between two instructions once either runs out
+        # (the block engine single-steps what is left of an instruction budget that the next block does not fit in),
+        # the ISA stays as it was at that point and the next resume() picks up from there.
+        # Faults are returned in the result instead of raised, so is a port handler raising Blocked.
+        if engine not in self.engines:
+            raise ValueError(f"Unknown engine ({engine}), expected one of {list(self.engines)}")
+        budgeted = max_instructions is not None or max_seconds is not None
+        if budgeted and engine not in self.budgeted_engines:
+            raise ValueError(f"Engine ({engine}) does not support budgets, expected one of {list(self.budgeted_engines)}")
+        self.running = True
+        self.halted = False
+        self.preempted = False
+        self.retired = None
+        budget = None
+        blocked = None
+        error = None
+        start = time.monotonic()
+        try:
+            if budgeted:
+                if max_instructions is None:
+                    max_instructions = float("inf")
+                deadline = start + max_seconds if max_seconds is not None else float("inf")
+                budget = self.budgeted_engines[engine](max_instructions, deadline)
+            else:
+                self.engines[engine]()
+        except Blocked as e:
+            blocked = e
+        except Exception as e:
+            error = e
+        finally:
+            self.running = False
+            self.console.flush() # Output produced before a fault still reaches stdout
+        elapsed = time.monotonic() - start
+
+        if error is not None:
+            status = RunResult.FAULTED
+        elif blocked is not None:
+            status = RunResult.BLOCKED
+            error = blocked
+        elif self.halted:
+            status = RunResult.HALTED
+        elif budget is not None:
+            status = RunResult.EXHAUSTED
+        else:
+            status = RunResult.PREEMPTED
+        return RunResult(status, self.retired, elapsed, self.pc, budget, error)
+
+    def preempt(self):
+        # Stops a running engine at its next instruction or block boundary, safe to call from another thread
+        self.preempted = True
+        self.running = False
 
     def step(self):
+        self.console.flush()
         print(self)
         if self.is_step or self.is_breakpoint:
             self.cmd = input('~ % ').strip()
@@ -1099,12 +1884,12 @@ class ISA:
                     self.is_breakpoint = True
 
 if __name__ == '__main__':
-    RUNNER_DEBUG_MODE = False
+    RUNNER_DEBUG_MODE = False # Records every instruction to debug_trace.bin, ./tracer.py debug_trace.bin prints it
     RUNNER_STEP_MODE = False
-
-    if RUNNER_DEBUG_MODE:
-        with open('debug_log.txt', 'w') as f:
-            f.write("")
+    RUNNER_ENGINE = "cache" # "match", "table", "cache", "block", "counted" or "profile"
+    RUNNER_FUSION_STATS = False # Prints how often each superinstruction ran (cache engine) to stderr
+    RUNNER_MAX_INSTRUCTIONS = None # Stops the program after this many instructions ("cache" and "block" engines)
+    RUNNER_MAX_SECONDS = None # Stops the program after this many seconds ("cache" and "block" engines)
 
     if (len(sys.argv) > 1):
         input_fn = sys.argv[1]
@@ -1112,7 +1897,14 @@ if __name__ == '__main__':
         if (len(sys.argv) > 2):
             argv = sys.argv[2:]
             argc = len(argv)
-            isa.run(input_fn, RUNNER_DEBUG_MODE, RUNNER_STEP_MODE, argc, argv)
+            result = isa.run(input_fn, RUNNER_DEBUG_MODE, RUNNER_STEP_MODE, argc, argv, RUNNER_ENGINE, RUNNER_MAX_INSTRUCTIONS, RUNNER_MAX_SECONDS)
         else:
-            isa.run(input_fn, RUNNER_DEBUG_MODE, RUNNER_STEP_MODE)
-        isa.log(isa)
+            result = isa.run(input_fn, RUNNER_DEBUG_MODE, RUNNER_STEP_MODE, engine=RUNNER_ENGINE, max_instructions=RUNNER_MAX_INSTRUCTIONS, max_seconds=RUNNER_MAX_SECONDS)
+        if RUNNER_FUSION_STATS:
+            for name, count in isa.fusion_counts.items():
+                print(f"{name:<12} {count}", file=sys.stderr)
+        if result.error is not None:
+            raise result.error
+        if result.status != RunResult.HALTED:
+            print(result, file=sys.stderr)
+            sys.exit(2)
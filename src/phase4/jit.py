@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+
+# Basic-block translator for the phase4 ISA
+# A block runs from an entry PC up to and including the next JMP/Jcc/CALL/RET/HALT/SYS.
+# Each block is turned into Python source that keeps registers, sp and the lazy flag sources in locals,
+# compiled once with compile() and cached by entry PC in ISA.blocks.
+
+import struct
+from opcodes import Opcode
+from memory import Memory
+
+class JIT:
+    MAX_BLOCK_INSTRS = 64
+
+    TERMINATORS = ("JMP", "JZ", "JNZ", "JC", "JNC", "JL", "JLE", "JG", "JGE", "CALL", "RET", "HALT", "SYS")
+    ZSC_OPS     = ("LB", "INC", "DEC", "ADD", "SUB", "MUL", "DIV", "AND", "OR", "XOR", "NOT", "CMP", "SHL", "SHR")
+    O_OPS       = ("INC", "DEC", "ADD", "SUB", "CMP")
+    WIDTHS      = {"LH": 2, "LW": 4, "LD": 8, "SH": 2, "SW": 4, "SD": 8}
+    BINARY_OPS  = {"MUL": "*", "AND": "&", "OR": "|", "XOR": "^"}
+    SYS_OPCODE  = Opcode.SYS.value
+
+    # Helpers referenced by generated blocks, also emitted at the top of recompiled modules
+    PRELUDE = (
+        "unpack_h = struct.Struct('<H').unpack_from\n"
+        "unpack_w = struct.Struct('<I').unpack_from\n"
+        "unpack_d = struct.Struct('<Q').unpack_from\n"
+        "pack_h = struct.Struct('<H').pack_into\n"
+        "pack_w = struct.Struct('<I').pack_into\n"
+        "pack_d = struct.Struct('<Q').pack_into\n"
+        "ZERO_DWORD = bytes(8)\n"
+    )
+
+    def __init__(self, isa):
+        self.isa = isa
+        self.namespace = {"struct": struct}
+        exec(self.PRELUDE, self.namespace)
+
+    def scan(self, pc):
+        # Decodes instructions from pc until a terminator, returns [(pc, name, args, next_pc)] and the block end
+        isa = self.isa
+        instrs = []
+        end = pc
+        while len(instrs) < self.MAX_BLOCK_INSTRS:
+            try:
+                (handler, args, next_pc), end_of_instr = isa.dispatch[isa.mem[end]](end)
+            except ValueError:
+                # Leave the bad instruction to the next dispatch so it faults when it is actually reached
+                if not instrs:
+                    raise
+                break
+            name = handler.__name__
+            if isa.mem[end] == self.SYS_OPCODE and name != "skip":
+                # Decode bound the device's handler, blocks call back through isa.SYS with the port
+                args = isa.decode_rx_port(isa.mem[end : end_of_instr])
+                name = "SYS"
+            instrs.append((end, name, args, end_of_instr))
+            end = end_of_instr
+            if name in self.TERMINATORS:
+                break
+        return instrs, end
+
+    def translate(self, pc):
+        instrs, end = self.scan(pc)
+        source = self.generate(pc, instrs)
+        code = compile(source, f"<block 0x{pc:06X}>", "exec")
+        namespace = dict(self.namespace)
+        exec(code, namespace)
+        return namespace["block"], end, len(instrs)
+
+    def push_lines(self, value):
+        # Guest PUSH of value, for use under an "if sp - 8 >= 0:" guard
+        return [
+            "sp -= 8",
+            f"pack_d(mem, sp, {value})",
+            *self.dirty_lines("sp", 8),
+            "if sp < isa.code_hi: isa.invalidate(sp, 8)",
+        ]
+
+    def pop_lines(self, target):
+        # Guest POP into target, for use under an "if sp + 8 <= MEM_SIZE:" guard
+        return [
+            f"{target} = unpack_d(mem, sp)[0]",
+            "mem[sp : sp + 8] = ZERO_DWORD",
+            *self.dirty_lines("sp", 8),
+            "if sp < isa.code_hi: isa.invalidate(sp, 8)",
+            "sp += 8",
+        ]
+
+    def dirty_lines(self, addr, length):
+        lines = [f"dirty.add({addr} >> {Memory.PAGE_SHIFT})"]
+        if length > 1:
+            lines.append(f"dirty.add(({addr} + {length - 1}) >> {Memory.PAGE_SHIFT})")
+        return lines
+
+    def lower(self, instrs):
+        # Translates a block up to its terminator into lines over the locals r<n>, sp, dirty and mmio_lo/mmio_hi
+        # Returns a dict: body, flags (lines storing the lazy flag sources), conditions (Jcc -> Python expression),
+        # terminator ((pc, name, args, next_pc) or None), fallthrough, used/written (register numbers)
+        # and sp/dirty/mmio (locals the lines need)
+        isa = self.isa
+        DW = isa.DW_MASK
+        SIGN = isa.SIGN_BIT
+
+        # Only the last writer of Z/S/C and of O inside a block is observable (flags are only read by the terminator or later blocks)
+        last_zsc = max((i for i, ins in enumerate(instrs) if ins[1] in self.ZSC_OPS), default=-1)
+        last_o = max((i for i, ins in enumerate(instrs) if ins[1] in self.O_OPS), default=-1)
+
+        body = []
+        used_regs = set()
+        written_regs = set()
+        uses_sp = False
+        uses_dirty = False
+        uses_mmio = False
+
+        def r(n):
+            used_regs.add(n)
+            return f"r{n}"
+
+        def w(n):
+            used_regs.add(n)
+            written_regs.add(n)
+            return f"r{n}"
+
+        def mark_dirty(addr, length):
+            nonlocal uses_dirty
+            uses_dirty = True
+            body.extend(self.dirty_lines(addr, length))
+
+        def invalidate_check(addr, length):
+            body.append(f"if isa.code_lo < {addr} + {length} and {addr} < isa.code_hi: isa.invalidate({addr}, {length})")
+
+        def mmio_check(addr, value, length):
+            # Stores into a device window are passed on to the bus after they reach memory, see bus.py
+            nonlocal uses_mmio
+            uses_mmio = True
+            body.append(f"if mmio_lo < {addr} + {length} and {addr} < mmio_hi: isa.bus.store({addr}, {value}, {length})")
+
+        terminator = None
+        for i, (pc, name, args, next_pc) in enumerate(instrs):
+            if name in self.TERMINATORS:
+                terminator = (pc, name, args, next_pc)
+                break
+
+            if name in ("skip", "NOP"):
+                continue
+            elif name == "LB":
+                rx, ry = args
+                body.append(f"{w(rx)} = mem[{r(ry)}]")
+                res = r(rx)
+            elif name == "SB":
+                rx, ry = args
+                body.append(f"a = {r(ry)}")
+                body.append(f"mem[a] = {r(rx)} & 0xFF")
+                mark_dirty("a", 1)
+                invalidate_check("a", 1)
+                mmio_check("a", f"{r(rx)} & 0xFF", 1)
+            elif name in ("LH", "LW", "LD"):
+                rx, operand, mode = args
+                width = self.WIDTHS[name]
+                mask = (1 << (width * 8)) - 1
+                suffix = name[1].lower()
+                if mode == 0:
+                    body.append(f"{w(rx)} = {r(operand)} & {mask}")
+                elif mode == 1:
+                    body.append(f"{w(rx)} = {operand & mask}")
+                elif mode == 2:
+                    body.append(f"{w(rx)} = unpack_{suffix}(mem, {operand})[0]")
+                elif mode == 3:
+                    body.append(f"{w(rx)} = unpack_{suffix}(mem, {r(operand)})[0]")
+            elif name in ("SH", "SW", "SD"):
+                rx, operand, mode = args
+                width = self.WIDTHS[name]
+                mask = (1 << (width * 8)) - 1
+                suffix = name[1].lower()
+                addr = str(operand) if mode == 2 else r(operand)
+                body.append(f"a = {addr}")
+                body.append(f"pack_{suffix}(mem, a, {r(rx)} & {mask})")
+                mark_dirty("a", width)
+                invalidate_check("a", width)
+                mmio_check("a", f"{r(rx)} & {mask}", width)
+            elif name == "MOV":
+                rx, ry = args
+                body.append(f"{w(rx)} = {r(ry)}")
+            elif name in ("INC", "DEC"):
+                (rx,) = args
+                op = "+" if name == "INC" else "-"
+                body.append(f"t = {r(rx)} {op} 1")
+                if i == last_o:
+                    body.append(f"osrc = ('{name}', {r(rx)}, 1, t)")
+                body.append(f"{w(rx)} = t & {DW}")
+                res = "t"
+            elif name in ("ADD", "SUB", "CMP"):
+                rx, ry = args
+                op = "+" if name == "ADD" else "-"
+                body.append(f"t = {r(rx)} {op} {r(ry)}")
+                if i == last_o:
+                    kind = "ADD" if name == "ADD" else "SUB"
+                    body.append(f"osrc = ('{kind}', {r(rx)}, {r(ry)}, t)")
+                if name != "CMP":
+                    body.append(f"{w(rx)} = t & {DW}")
+                res = "t"
+            elif name in self.BINARY_OPS:
+                rx, ry = args
+                body.append(f"{w(rx)} = ({r(rx)} {self.BINARY_OPS[name]} {r(ry)}) & {DW}")
+                res = r(rx)
+            elif name == "DIV":
+                rx, ry = args
+                body.append(f"if {r(ry)} == 0: raise ZeroDivisionError('Division by zero error: R{ry} = 0')")
+                body.append(f"{w(rx)} = {r(rx)} // {r(ry)}")
+                res = r(rx)
+            elif name == "NOT":
+                (rx,) = args
+                body.append(f"{w(rx)} = ~{r(rx)} & {DW}")
+                res = r(rx)
+            elif name == "SHL":
+                (rx,) = args
+                body.append(f"{w(rx)} = ({r(rx)} << 1) & {DW}")
+                res = r(rx)
+            elif name == "SHR":
+                (rx,) = args
+                body.append(f"{w(rx)} = {r(rx)} >> 1")
+                res = r(rx)
+            elif name == "PUSH":
+                (rx,) = args
+                uses_sp = uses_dirty = True
+                body.append("if sp - 8 >= 0:")
+                body.extend(f"    {line}" for line in self.push_lines(r(rx)))
+            elif name == "POP":
+                (rx,) = args
+                uses_sp = uses_dirty = True
+                body.append(f"if sp + 8 <= {isa.MEM_SIZE}:")
+                body.extend(f"    {line}" for line in self.pop_lines(w(rx)))
+            else:
+                raise ValueError(f"Cannot translate {name} at address ({pc})")
+
+            if i == last_zsc:
+                body.append(f"zsc = {res}")
+
+        # Z/S/C come straight from the block's own result when it has one, otherwise from the ISA
+        if last_zsc >= 0:
+            Z, S, C = "(zsc == 0)", f"(zsc & {SIGN} != 0)", f"(zsc > {DW})"
+        else:
+            Z, S, C = "isa.flag_z()", "isa.flag_s()", "isa.flag_c()"
+        O = "isa.flag_o()"
+        conditions = {
+            "JZ":  f"{Z}",
+            "JNZ": f"not {Z}",
+            "JC":  f"{C}",
+            "JNC": f"not {C}",
+            "JL":  f"{S} != {O}",
+            "JLE": f"{Z} or {S} != {O}",
+            "JG":  f"not {Z} and {S} == {O}",
+            "JGE": f"{S} == {O}",
+        }
+
+        # Flags, stored lazily before the terminator so its flag_o() reads see this block's result
+        flags = []
+        if last_zsc >= 0:
+            flags.append("isa.zsc_res = zsc")
+        if last_o >= 0:
+            flags.append("isa.o_src = osrc")
+
+        return {
+            "body": body,
+            "flags": flags,
+            "conditions": conditions,
+            "terminator": terminator,
+            "fallthrough": instrs[-1][3],
+            "used": used_regs,
+            "written": written_regs,
+            "sp": uses_sp,
+            "dirty": uses_dirty,
+            "mmio": uses_mmio,
+        }
+
+    def generate(self, entry_pc, instrs, fn_name="block"):
+        isa = self.isa
+        block = self.lower(instrs)
+        uses_sp = block["sp"]
+        uses_dirty = block["dirty"]
+
+        # Terminator
+        tail = []
+        if block["terminator"] is None:
+            tail.append(f"isa.pc = {block['fallthrough']}")
+        else:
+            pc, name, args, next_pc = block["terminator"]
+            if name == "JMP":
+                tail.append(f"isa.pc = {args[0]}")
+            elif name in block["conditions"]:
+                tail.append(f"isa.pc = {args[0]} if {block['conditions'][name]} else {next_pc}")
+            elif name == "CALL":
+                uses_sp = uses_dirty = True
+                tail.append("if sp - 8 >= 0:")
+                tail += [f"    {line}" for line in self.push_lines(next_pc)]
+                tail.append(f"    isa.pc = {args[0]}")
+                tail.append("else:")
+                tail.append(f"    isa.pc = {next_pc}")
+            elif name == "RET":
+                uses_sp = uses_dirty = True
+                tail.append(f"if sp + 8 <= {isa.MEM_SIZE}:")
+                tail += [f"    {line}" for line in self.pop_lines("isa.pc")]
+                tail.append("else:")
+                tail.append(f"    isa.pc = {next_pc}")
+            elif name == "HALT":
+                tail.append(f"isa.pc = {pc}")
+                tail.append("isa.running = False")
+                tail.append("isa.halted = True")
+                tail.append("isa.console.flush()")
+            elif name == "SYS":
+                # Registers and sp are written back before the call, SYS reads and writes isa.reg directly
+                # and a handler that raises Blocked leaves the ISA exactly at the SYS
+                tail.append(f"isa.pc = {pc}")
+                if uses_sp:
+                    tail.append("isa.sp = sp")
+                tail.append(f"isa.SYS(*{args!r})")
+                tail.append(f"isa.pc = {next_pc}")
+
+        lines = [f"def {fn_name}(isa, reg, mem):"]
+        lines += [f"    r{n} = reg[{n}]" for n in sorted(block["used"])]
+        if uses_sp:
+            lines.append("    sp = isa.sp")
+        if uses_dirty:
+            lines.append("    dirty = isa.memory.dirty")
+        if block["mmio"]:
+            lines.append("    mmio_lo = isa.bus.mmio_lo")
+            lines.append("    mmio_hi = isa.bus.mmio_hi")
+        lines += [f"    {line}" for line in block["body"]]
+        lines += [f"    reg[{n}] = r{n}" for n in sorted(block["written"])]
+        lines += [f"    {line}" for line in block["flags"]]
+        lines += [f"    {line}" for line in tail]
+        if uses_sp:
+            lines.append("    isa.sp = sp")
+        return "\n".join(lines) + "\n"
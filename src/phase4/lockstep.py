@@ -0,0 +1,562 @@
+#!/usr/bin/env python3
+
+# ./lockstep.py prog.bin < jobs.txt
+# jobs.txt has one job per line: the program's arguments, separated by spaces
+
+# Lockstep executor: runs one binary for many jobs at once, SIMD style, on NumPy arrays (pip install numpy)
+# Every job is a lane. The lanes' registers are one (lanes, 32) uint64 array and each instruction is decoded once
+# and executed for all the lanes at its address with a few array operations.
+# Memory is paged like memory.py: the first time any lane touches a 4 KB page it gets a frame, a column of
+# PAGE_SIZE bytes per lane in one (lanes, frames * PAGE_SIZE) uint8 array, so a program that uses a few pages
+# costs a few pages per lane and a load or store is one gather or scatter across the lanes.
+#
+# Lanes diverge at conditional branches, RET and faults. Each step runs the lowest PC any lane is at, for just
+# the lanes at that PC: lanes that took the shorter path wait at the join point until the others catch up,
+# then run together again.
+#
+# Flags are kept per lane as four bool arrays, computed eagerly with the same semantics as the lazy Z/S/C/O of isa.py.
+# SYS calls to the console's register-only ports (STDIN_INT/CHAR, STDOUT_INT/CHAR and their _NR forms) run per lane
+# against the lane's own stdin/stdout. Anything else a lane cannot do in lockstep (other ports, stores into decoded
+# code or MMIO windows, out of range accesses, division by zero, stack over/underflow) peels that lane off:
+# its state is copied into a scalar ISA that runs it to the end with the given engine.
+#
+# run(jobs) takes (argv, stdin bytes) pairs and returns one dict per job, in order, like batch.py:
+# stdout (bytes), reg (final registers), instructions (retired), status (see result.py), error (str or None), elapsed,
+# peeled (True if the lane finished on a scalar ISA)
+
+import io
+import sys
+import time
+from isa import ISA
+from console import Console
+from memory import Memory
+from opcodes import Opcode
+from result import RunResult
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class Lockstep:
+    DONE = (1 << 63) - 1 # PC of lanes that stopped, never the lowest PC
+    SIGN_BIT = 1 << 63
+
+    # Console ports that only read or write Rx, run per lane without leaving lockstep
+    LANE_PORTS = ("STDIN_INT", "STDIN_CHAR", "STDOUT_INT", "STDOUT_CHAR", "STDOUT_INT_NR", "STDOUT_CHAR_NR")
+    CONTROL = ("JMP", "JZ", "JNZ", "JC", "JNC", "JL", "JLE", "JG", "JGE", "CALL", "RET", "HALT")
+
+    def __init__(self, input_fn, engine="block", max_instructions=None):
+        if np is None:
+            raise ImportError("Lockstep needs NumPy (pip install numpy)")
+        if engine not in ("cache", "block"):
+            raise ValueError(f"Engine ({engine}) does not count instructions, expected one of ['cache', 'block']")
+        self.engine = engine
+        self.max_instructions = max_instructions
+        self.isa = ISA() # Holds the loaded image, instructions are decoded from it
+        self.isa.load_bin_into_mem(input_fn)
+        self.base = self.isa.snapshot()
+        self.scalar = None # ISA peeled lanes finish on, created on first use
+        self.dtypes = {1: np.dtype("u1"), 2: np.dtype("<u2"), 4: np.dtype("<u4"), 8: np.dtype("<u8")}
+        self.offsets = {w: np.arange(w, dtype=np.int64) for w in self.dtypes}
+        self.shift = np.uint64(63) # Sign bit, uint64 shift counts keep NumPy 1.x from promoting to float
+        self.stats = {"steps": 0, "lane_steps": 0, "peeled": 0}
+
+    def run(self, jobs):
+        start = time.perf_counter()
+        self.load(jobs)
+        code = self.code
+        pc = self.pc
+        count = self.count
+        max_instructions = self.max_instructions
+        while True:
+            p = int(pc.min())
+            if p == self.DONE:
+                break
+            lanes = np.flatnonzero(pc == p)
+            if max_instructions is not None:
+                over = count[lanes] >= max_instructions
+                if over.any():
+                    for lane in lanes[over]:
+                        self.stop(lane, RunResult.EXHAUSTED, budget="instructions")
+                    lanes = lanes[~over]
+                    if not lanes.size:
+                        continue
+            entry = code.get(p)
+            if entry is None:
+                try:
+                    entry = self.decode(p)
+                except (ValueError, IndexError) as e:
+                    for lane in lanes:
+                        self.stop(lane, RunResult.FAULTED, error=e)
+                    continue
+                lanes = lanes[pc[lanes] == p] # Lanes whose code differs from the image peeled off
+            handler, args, next_pc = entry
+            lanes = handler(lanes, *args)
+            if lanes.size:
+                if next_pc is not None:
+                    pc[lanes] = next_pc
+                count[lanes] += 1
+                self.stats["steps"] += 1
+                self.stats["lane_steps"] += lanes.size
+        elapsed = time.perf_counter() - start
+
+        results = []
+        for lane, console in enumerate(self.consoles):
+            console.flush()
+            result = self.results[lane]
+            results.append({
+                "stdout": console.stdout.getvalue(),
+                "reg": self.reg[lane].tolist(),
+                "instructions": int(count[lane]),
+                "status": result.status,
+                "error": repr(result.error) if result.error is not None else None,
+                "elapsed": elapsed,
+                "peeled": self.peeled[lane]
+            })
+        return results
+
+    def load(self, jobs):
+        # One lane per job, each starts from the loaded image with its own argv on the stack
+        n = len(jobs)
+        isa = self.isa
+        self.reg = np.zeros((n, ISA.MAX_REG), dtype=np.uint64)
+        self.frame_of = np.full(ISA.MEM_SIZE >> Memory.PAGE_SHIFT, -1, dtype=np.int64) # Page number -> frame, -1 if untouched
+        self.frames = np.zeros((n, 8 * Memory.PAGE_SIZE), dtype=np.uint8)
+        self.used = 0 # Frames handed out
+        self.pc = np.full(n, self.DONE, dtype=np.int64)
+        self.sp = np.zeros(n, dtype=np.int64)
+        self.count = np.zeros(n, dtype=np.int64)
+        self.z = np.zeros(n, dtype=bool)
+        self.s = np.zeros(n, dtype=bool)
+        self.c = np.zeros(n, dtype=bool)
+        self.o = np.zeros(n, dtype=bool)
+        self.snapshots = [] # Lane state after loading, peeled lanes start their scalar ISA from it
+        self.consoles = []
+        self.results = [None] * n
+        self.peeled = [False] * n
+        page = Memory.PAGE_SIZE
+        for lane, (argv, stdin) in enumerate(jobs):
+            isa.restore(self.base)
+            isa.load_argv_into_mem(len(argv) if argv else 0, argv)
+            snapshot = isa.snapshot()
+            for number, data in snapshot["pages"].items():
+                start = self.frame(number) * page
+                self.frames[lane, start : start + len(data)] = np.frombuffer(data, dtype=np.uint8)
+            self.reg[lane] = isa.reg
+            self.pc[lane] = isa.pc
+            self.sp[lane] = isa.sp
+            self.snapshots.append(snapshot)
+            console = Console()
+            console.isa = isa
+            console.stdin = io.BytesIO(stdin or b"")
+            console.stdout = io.BytesIO()
+            self.consoles.append(console)
+        isa.restore(self.base)
+        self.code = {} # PC -> (handler, args, next PC or None if the handler sets PC)
+        self.code_lo = ISA.MEM_SIZE
+        self.code_hi = 0
+
+    def decode(self, pc):
+        # Decodes through the ISA's dispatch table (without fusion), lanes whose bytes at pc differ from the image peel off
+        isa = self.isa
+        (handler, args, _), end = isa.dispatch[isa.mem[pc]](pc)
+        live = np.flatnonzero(self.pc != self.DONE)
+        columns = self.translate(np.arange(pc, end, dtype=np.int64))
+        code = self.frames[live[:, None], columns]
+        changed = (code != np.frombuffer(isa.mem[pc : end], dtype=np.uint8)).any(axis=1)
+        self.peel(live, changed)
+
+        name = handler.__name__
+        if isa.mem[pc] == Opcode.SYS.value and name != "skip":
+            entry = (self.SYS, isa.decode_rx_port(isa.mem[pc : end]), end)
+        elif name in ("NOP", "skip"):
+            entry = (self.NOP, (), end)
+        elif name in ("JMP", "RET", "HALT"):
+            entry = (getattr(self, name), args[:1] if name == "JMP" else (), None)
+        elif name in self.CONTROL:
+            entry = (getattr(self, name), (args[0], end), None) # Jcc and CALL, end is the fall through/return address
+        else:
+            entry = (getattr(self, name), args, end)
+        self.code[pc] = entry
+        self.code_lo = min(self.code_lo, pc)
+        self.code_hi = max(self.code_hi, end)
+        return entry
+
+    def stop(self, lane, status, error=None, budget=None):
+        self.results[lane] = RunResult(status, int(self.count[lane]), pc=int(self.pc[lane]), budget=budget, error=error)
+        self.pc[lane] = self.DONE
+
+    def peel(self, lanes, mask):
+        # Runs the lanes selected by mask to the end on a scalar ISA, returns the others
+        if not mask.any():
+            return lanes
+        for lane in lanes[mask]:
+            self.run_scalar(int(lane))
+        return lanes[~mask]
+
+    def run_scalar(self, lane):
+        isa = self.scalar
+        if isa is None:
+            isa = self.scalar = ISA()
+        snapshot = self.snapshots[lane]
+        isa.restore(snapshot)
+        page = Memory.PAGE_SIZE
+        row = self.frames[lane]
+        for number in np.flatnonzero(self.frame_of >= 0).tolist():
+            start = self.frame_of[number] * page
+            data = row[start : start + page].tobytes()
+            if data != snapshot["pages"].get(number, bytes(page)):
+                isa.memory.write(number * page, data)
+                if isa.code_lo < (number + 1) * page and number * page < isa.code_hi:
+                    isa.invalidate(number * page, page) # Decoded by an earlier peeled lane
+        isa.reg[:] = self.reg[lane].tolist()
+        isa.pc = int(self.pc[lane])
+        isa.sp = int(self.sp[lane])
+        isa.flags = int((isa.Z * self.z[lane]) | (isa.S * self.s[lane]) | (isa.C * self.c[lane]) | (isa.O * self.o[lane]))
+        console = self.consoles[lane]
+        console.flush()
+        isa.console.stdin = console.stdin
+        isa.console.stdout = console.stdout
+
+        budget = float("inf")
+        if self.max_instructions is not None:
+            budget = self.max_instructions - int(self.count[lane])
+        result = isa.resume(self.engine, budget)
+        self.count[lane] += result.instructions or 0
+        result.instructions = int(self.count[lane])
+        self.reg[lane] = isa.reg
+        self.results[lane] = result
+        self.peeled[lane] = True
+        self.stats["peeled"] += 1
+        self.pc[lane] = self.DONE
+
+    # Memory
+    def frame(self, number):
+        # Frame of page number, handed out (zeroed for every lane) on first touch
+        frame = self.frame_of[number]
+        if frame < 0:
+            frame = self.frame_of[number] = self.used
+            self.used += 1
+            if self.used * Memory.PAGE_SIZE > self.frames.shape[1]:
+                grown = np.zeros((self.frames.shape[0], 2 * self.frames.shape[1]), dtype=np.uint8)
+                grown[:, : self.frames.shape[1]] = self.frames
+                self.frames = grown
+        return frame
+
+    def translate(self, addr):
+        # Addresses (any shape) -> columns of frames, a multi-byte access is translated byte by byte
+        # since adjacent pages need not have adjacent frames
+        frame = self.frame_of[addr >> Memory.PAGE_SHIFT]
+        if (frame < 0).any():
+            for number in np.unique(addr[frame < 0] >> Memory.PAGE_SHIFT).tolist():
+                self.frame(number)
+            frame = self.frame_of[addr >> Memory.PAGE_SHIFT]
+        return frame * Memory.PAGE_SIZE + (addr & (Memory.PAGE_SIZE - 1))
+
+    def load_mem(self, lanes, addr, width):
+        # Translated first, a new frame can replace self.frames
+        if width == 1:
+            columns = self.translate(addr)
+            return self.frames[lanes, columns].astype(np.uint64)
+        columns = self.translate(addr[:, None] + self.offsets[width])
+        data = self.frames[lanes[:, None], columns]
+        return data.view(self.dtypes[width]).reshape(-1).astype(np.uint64)
+
+    def store_mem(self, lanes, addr, width, val):
+        if width == 1:
+            columns = self.translate(addr)
+            self.frames[lanes, columns] = val.astype(np.uint8)
+        else:
+            columns = self.translate(addr[:, None] + self.offsets[width])
+            self.frames[lanes[:, None], columns] = val.astype(self.dtypes[width]).view(np.uint8).reshape(-1, width)
+
+    def address(self, lanes, operand, mode, width, store):
+        # Lanes that can access [addr, addr + width) in lockstep and their addresses, the rest peel off
+        if mode == 2:
+            addr = np.full(lanes.size, operand, dtype=np.uint64)
+        else:
+            addr = self.reg[lanes, operand]
+        bad = addr > ISA.MEM_SIZE - width
+        if store:
+            bus = self.isa.bus
+            end = addr + np.uint64(width)
+            bad |= (addr < self.code_hi) & (end > self.code_lo)
+            bad |= (addr < bus.mmio_hi) & (end > bus.mmio_lo)
+        if bad.any():
+            keep = ~bad
+            self.peel(lanes, bad)
+            lanes = lanes[keep]
+            addr = addr[keep]
+        return lanes, addr.astype(np.int64)
+
+    def set_zs(self, lanes, res):
+        # Z/S of a masked result, C cleared and O left alone (MUL, DIV, logic, shifts, LB)
+        self.z[lanes] = res == 0
+        self.s[lanes] = (res >> self.shift) != 0
+        self.c[lanes] = False
+
+    # Opcode Functions
+    # Each one runs an instruction for lanes (indices into the lane arrays) and returns the lanes it ran for
+    def NOP(self, lanes):
+        return lanes
+
+    def LB(self, lanes, rx, ry):
+        lanes, addr = self.address(lanes, ry, 3, 1, False)
+        res = self.load_mem(lanes, addr, 1)
+        self.reg[lanes, rx] = res
+        self.set_zs(lanes, res)
+        return lanes
+
+    def load_op(self, lanes, rx, operand, mode, width):
+        mask = np.uint64((1 << (width * 8)) - 1)
+        if mode == 0:
+            self.reg[lanes, rx] = self.reg[lanes, operand] & mask
+        elif mode == 1:
+            self.reg[lanes, rx] = operand
+        else:
+            lanes, addr = self.address(lanes, operand, mode, width, False)
+            self.reg[lanes, rx] = self.load_mem(lanes, addr, width)
+        return lanes
+
+    def LH(self, lanes, rx, operand, mode):
+        return self.load_op(lanes, rx, operand, mode, 2)
+
+    def LW(self, lanes, rx, operand, mode):
+        return self.load_op(lanes, rx, operand, mode, 4)
+
+    def LD(self, lanes, rx, operand, mode):
+        return self.load_op(lanes, rx, operand, mode, 8)
+
+    def SB(self, lanes, rx, ry):
+        lanes, addr = self.address(lanes, ry, 3, 1, True)
+        self.store_mem(lanes, addr, 1, self.reg[lanes, rx] & np.uint64(0xFF))
+        return lanes
+
+    def store_op(self, lanes, rx, operand, mode, width):
+        lanes, addr = self.address(lanes, operand, mode, width, True)
+        self.store_mem(lanes, addr, width, self.reg[lanes, rx])
+        return lanes
+
+    def SH(self, lanes, rx, operand, mode):
+        return self.store_op(lanes, rx, operand, mode, 2)
+
+    def SW(self, lanes, rx, operand, mode):
+        return self.store_op(lanes, rx, operand, mode, 4)
+
+    def SD(self, lanes, rx, operand, mode):
+        return self.store_op(lanes, rx, operand, mode, 8)
+
+    def MOV(self, lanes, rx, ry):
+        self.reg[lanes, rx] = self.reg[lanes, ry]
+        return lanes
+
+    def INC(self, lanes, rx):
+        a = self.reg[lanes, rx]
+        res = a + np.uint64(1)
+        self.reg[lanes, rx] = res
+        self.z[lanes] = False # The unmasked result of an INC is never 0
+        self.s[lanes] = (res >> self.shift) != 0
+        self.c[lanes] = res == 0
+        self.o[lanes] = a == np.uint64(self.SIGN_BIT - 1)
+        return lanes
+
+    def DEC(self, lanes, rx):
+        a = self.reg[lanes, rx]
+        res = a - np.uint64(1)
+        self.reg[lanes, rx] = res
+        self.z[lanes] = a == 1
+        self.s[lanes] = (res >> self.shift) != 0
+        self.c[lanes] = False # A borrow leaves a negative unmasked result, C is only set above 64 bits
+        self.o[lanes] = a == np.uint64(self.SIGN_BIT)
+        return lanes
+
+    def ADD(self, lanes, rx, ry):
+        a = self.reg[lanes, rx]
+        b = self.reg[lanes, ry]
+        res = a + b
+        self.reg[lanes, rx] = res
+        carry = res < a
+        self.z[lanes] = (res == 0) & ~carry
+        self.s[lanes] = (res >> self.shift) != 0
+        self.c[lanes] = carry
+        self.o[lanes] = (((a ^ res) & (b ^ res)) >> self.shift) != 0
+        return lanes
+
+    def sub_flags(self, lanes, a, b, res):
+        self.z[lanes] = a == b
+        self.s[lanes] = (res >> self.shift) != 0
+        self.c[lanes] = False
+        self.o[lanes] = (((a ^ b) & (a ^ res)) >> self.shift) != 0
+
+    def SUB(self, lanes, rx, ry):
+        a = self.reg[lanes, rx]
+        b = self.reg[lanes, ry]
+        res = a - b
+        self.reg[lanes, rx] = res
+        self.sub_flags(lanes, a, b, res)
+        return lanes
+
+    def CMP(self, lanes, rx, ry):
+        a = self.reg[lanes, rx]
+        b = self.reg[lanes, ry]
+        self.sub_flags(lanes, a, b, a - b)
+        return lanes
+
+    def MUL(self, lanes, rx, ry):
+        res = self.reg[lanes, rx] * self.reg[lanes, ry]
+        self.reg[lanes, rx] = res
+        self.set_zs(lanes, res)
+        return lanes
+
+    def DIV(self, lanes, rx, ry):
+        lanes = self.peel(lanes, self.reg[lanes, ry] == 0) # Faults on the scalar ISA
+        res = self.reg[lanes, rx] // self.reg[lanes, ry]
+        self.reg[lanes, rx] = res
+        self.set_zs(lanes, res)
+        return lanes
+
+    def AND(self, lanes, rx, ry):
+        res = self.reg[lanes, rx] & self.reg[lanes, ry]
+        self.reg[lanes, rx] = res
+        self.set_zs(lanes, res)
+        return lanes
+
+    def OR(self, lanes, rx, ry):
+        res = self.reg[lanes, rx] | self.reg[lanes, ry]
+        self.reg[lanes, rx] = res
+        self.set_zs(lanes, res)
+        return lanes
+
+    def XOR(self, lanes, rx, ry):
+        res = self.reg[lanes, rx] ^ self.reg[lanes, ry]
+        self.reg[lanes, rx] = res
+        self.set_zs(lanes, res)
+        return lanes
+
+    def NOT(self, lanes, rx):
+        res = ~self.reg[lanes, rx]
+        self.reg[lanes, rx] = res
+        self.set_zs(lanes, res)
+        return lanes
+
+    def SHL(self, lanes, rx):
+        res = self.reg[lanes, rx] << np.uint64(1)
+        self.reg[lanes, rx] = res
+        self.set_zs(lanes, res)
+        return lanes
+
+    def SHR(self, lanes, rx):
+        res = self.reg[lanes, rx] >> np.uint64(1)
+        self.reg[lanes, rx] = res
+        self.set_zs(lanes, res)
+        return lanes
+
+    # Branches, lanes split on the condition and rejoin at the lowest PC later
+    def branch(self, lanes, taken, addr, end):
+        self.pc[lanes] = np.where(taken, addr, end)
+        return lanes
+
+    def JMP(self, lanes, addr):
+        self.pc[lanes] = addr
+        return lanes
+
+    def JZ(self, lanes, addr, end):
+        return self.branch(lanes, self.z[lanes], addr, end)
+
+    def JNZ(self, lanes, addr, end):
+        return self.branch(lanes, ~self.z[lanes], addr, end)
+
+    def JC(self, lanes, addr, end):
+        return self.branch(lanes, self.c[lanes], addr, end)
+
+    def JNC(self, lanes, addr, end):
+        return self.branch(lanes, ~self.c[lanes], addr, end)
+
+    def JL(self, lanes, addr, end):
+        return self.branch(lanes, self.s[lanes] != self.o[lanes], addr, end)
+
+    def JLE(self, lanes, addr, end):
+        return self.branch(lanes, self.z[lanes] | (self.s[lanes] != self.o[lanes]), addr, end)
+
+    def JG(self, lanes, addr, end):
+        return self.branch(lanes, ~self.z[lanes] & (self.s[lanes] == self.o[lanes]), addr, end)
+
+    def JGE(self, lanes, addr, end):
+        return self.branch(lanes, self.s[lanes] == self.o[lanes], addr, end)
+
+    # Stack, lanes that would overflow it or write below the end of the decoded code peel off
+    def push(self, lanes, val):
+        sp = self.sp[lanes] - 8
+        bad = (sp < 0) | (sp < self.code_hi)
+        if bad.any():
+            keep = ~bad
+            self.peel(lanes, bad)
+            lanes, sp, val = lanes[keep], sp[keep], val[keep]
+        self.sp[lanes] = sp
+        self.store_mem(lanes, sp, 8, val)
+        return lanes
+
+    def pop(self, lanes):
+        sp = self.sp[lanes]
+        lanes = self.peel(lanes, (sp + 8 > ISA.MEM_SIZE) | (sp < self.code_hi))
+        sp = self.sp[lanes]
+        val = self.load_mem(lanes, sp, 8)
+        self.store_mem(lanes, sp, 8, np.zeros(lanes.size, dtype=np.uint64))
+        self.sp[lanes] = sp + 8
+        return lanes, val
+
+    def PUSH(self, lanes, rx):
+        return self.push(lanes, self.reg[lanes, rx])
+
+    def POP(self, lanes, rx):
+        lanes, val = self.pop(lanes)
+        self.reg[lanes, rx] = val
+        return lanes
+
+    def CALL(self, lanes, addr, end):
+        lanes = self.push(lanes, np.full(lanes.size, end, dtype=np.uint64))
+        self.pc[lanes] = addr
+        return lanes
+
+    def RET(self, lanes):
+        lanes, addr = self.pop(lanes)
+        self.pc[lanes] = np.minimum(addr, np.uint64(ISA.MEM_SIZE)).astype(np.int64) # Past the end faults at decode
+        return lanes
+
+    def HALT(self, lanes):
+        for lane in lanes:
+            self.results[lane] = RunResult(RunResult.HALTED, pc=int(self.pc[lane]))
+        self.pc[lanes] = self.DONE
+        return lanes
+
+    def SYS(self, lanes, rx, port):
+        name = self.isa.bus.names[port]
+        if name not in self.LANE_PORTS:
+            return self.peel(lanes, np.ones(lanes.size, dtype=bool))
+        reg = self.isa.reg
+        ran = []
+        for lane in lanes:
+            console = self.consoles[lane]
+            reg[rx] = int(self.reg[lane, rx])
+            try:
+                getattr(console, name)(rx)
+            except Exception as e:
+                self.stop(lane, RunResult.FAULTED, error=e)
+                continue
+            self.reg[lane, rx] = reg[rx]
+            ran.append(lane)
+        return np.array(ran, dtype=np.int64)
+
+if __name__ == '__main__':
+    if (len(sys.argv) > 1):
+        jobs = [(line.split(), b"") for line in sys.stdin.read().splitlines()]
+        start = time.perf_counter()
+        lockstep = Lockstep(sys.argv[1])
+        results = lockstep.run(jobs)
+        for job, result in zip(jobs, results):
+            print(f"== {' '.join(job[0])}: {result['status']}, {result['instructions']} instructions")
+            sys.stdout.write(result["stdout"].decode("latin-1"))
+        stats = lockstep.stats
+        print(f"{len(jobs)} lanes in {time.perf_counter() - start:.3f}s, {stats['steps']} steps, "
+              f"{stats['lane_steps'] / max(stats['steps'], 1):.1f} lanes per step, {stats['peeled']} peeled", file=sys.stderr)
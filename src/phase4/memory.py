@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+# Guest memory for the phase4 ISA
+# Owns the byte array and exposes little-endian typed accessors, each one a single struct call
+# instead of a chain of byte indexing and shifts.
+#
+# The array is a private anonymous mmap: the OS only materializes a 4 KB page when it is first touched,
+# so a program that uses a few KB of its 4 MB address space only costs a few KB.
+# Every write marks its pages in dirty, reset() zeroes just those pages (dropping them back to the OS
+# where madvise is available) instead of allocating and zero-filling a fresh 4 MB buffer.
+#
+# Memory can also be a private (copy-on-write) mapping of a file holding a loaded image, e.g. a shared memory
+# segment many processes map (see batch.py). Untouched pages are then shared with the file and read back as the image,
+# reset() drops a process's private copies so its pages go back to the image instead of to zero,
+# and snapshots are relative to that image.
+#
+# snapshot() returns {page number: bytes} for every non-zero page. Page contents are immutable and shared:
+# a later snapshot only copies the pages dirtied since the previous snapshot/restore and reuses the rest,
+# and restore() only rewrites the pages that differ between the current state and the snapshot.
+#
+# Image writes a snapshot's pages into an unlinked file once, ISA.fork() maps it privately for every child
+# so untouched pages stay shared between the children and only the pages a child writes get copied.
+
+import os
+import mmap
+import struct
+import tempfile
+
+class Memory:
+    HWORD = struct.Struct("<H")
+    WORD  = struct.Struct("<I")
+    DWORD = struct.Struct("<Q")
+
+    PAGE_SHIFT = 12
+    PAGE_SIZE  = 1 << PAGE_SHIFT # 4 KB
+
+    def __init__(self, size, fd=None):
+        self.size = size
+        self.pages = (size + self.PAGE_SIZE - 1) >> self.PAGE_SHIFT
+        self.image = None # Read-only view of the backing file, used by reset() where pages cannot be dropped
+        self.fd = None    # Own descriptor of the backing file, clone() maps it again
+        if fd is not None:
+            self.fd = os.dup(fd)
+            self.data = mmap.mmap(fd, size, flags=mmap.MAP_PRIVATE, prot=mmap.PROT_READ | mmap.PROT_WRITE) # Copy-on-write
+            self.can_drop = hasattr(mmap, "MADV_DONTNEED") # Dropped private file pages read back from the file
+            if not self.can_drop:
+                self.image = mmap.mmap(fd, size, flags=mmap.MAP_SHARED, prot=mmap.PROT_READ)
+        elif hasattr(mmap, "MAP_PRIVATE") and hasattr(mmap, "MAP_ANONYMOUS"):
+            self.data = mmap.mmap(-1, size, flags=mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS) # 8 bits per address
+            self.can_drop = hasattr(mmap, "MADV_DONTNEED") # Dropped private anonymous pages read back as zero
+        else:
+            self.data = mmap.mmap(-1, size)
+            self.can_drop = False
+        self.view = memoryview(self.data) # Zero-copy slices for bulk file I/O
+        self.dirty = set() # Page numbers written since the last reset(), snapshot() or restore()
+        self.base = {}     # Pages of the last snapshot taken or restored, the state dirty is relative to
+
+    def __del__(self):
+        if self.fd is not None:
+            os.close(self.fd)
+
+    def clone(self):
+        # Empty Memory of the same kind, a private mapping of the same file if this one has one
+        return Memory(self.size, self.fd)
+
+    def mark(self, addr, length):
+        # Records the pages covered by a write that went straight to data
+        first = addr >> self.PAGE_SHIFT
+        last = (addr + length - 1) >> self.PAGE_SHIFT
+        if first == last:
+            self.dirty.add(first)
+        else:
+            self.dirty.update(range(first, last + 1))
+
+    def dirty_pages(self):
+        return sorted(self.dirty)
+
+    def page(self, n):
+        return bytes(self.data[n << self.PAGE_SHIFT : (n + 1) << self.PAGE_SHIFT])
+
+    def snapshot(self):
+        pages = dict(self.base)
+        for n in self.dirty:
+            pages[n] = self.page(n)
+        self.base = pages
+        self.dirty.clear()
+        return pages
+
+    def restore(self, pages):
+        # Returns the page numbers that were rewritten so callers can drop anything cached from them
+        base = self.base
+        changed = set(self.dirty)
+        changed.update(n for n in base if pages.get(n) is not base[n])
+        changed.update(n for n in pages if n not in base)
+        self.dirty.clear()
+        self.dirty.update(n for n in changed if n not in pages)
+        self.base = {}
+        self.reset() # Zeroes (or reverts to the image) the pages the snapshot does not have
+        for n in changed:
+            if n in pages:
+                self.data[n << self.PAGE_SHIFT : (n << self.PAGE_SHIFT) + len(pages[n])] = pages[n]
+        self.base = pages
+        return changed
+
+    def reset(self):
+        # Zeroes (or reverts to the image) every dirty or snapshotted page, runs of adjacent pages are dropped or cleared with one call
+        page = self.PAGE_SIZE
+        for first, last in self.runs(sorted(self.dirty.union(self.base))):
+            start = first * page
+            if start >= self.size:
+                break
+            end = min((last + 1) * page, self.size)
+            if self.can_drop:
+                self.data.madvise(mmap.MADV_DONTNEED, start, end - start)
+            elif self.image is not None:
+                self.data[start:end] = self.image[start:end]
+            else:
+                self.data[start:end] = bytes(end - start)
+        self.dirty.clear()
+        self.base = {}
+
+    def runs(self, pages):
+        # [1, 2, 3, 7] -> [(1, 3), (7, 7)]
+        runs = []
+        for n in pages:
+            if runs and runs[-1][1] == n - 1:
+                runs[-1] = (runs[-1][0], n)
+            else:
+                runs.append((n, n))
+        return runs
+
+    def read_byte(self, addr):
+        return self.data[addr]
+
+    def read_hword(self, addr):
+        return self.HWORD.unpack_from(self.data, addr)[0]
+
+    def read_word(self, addr):
+        return self.WORD.unpack_from(self.data, addr)[0]
+
+    def read_dword(self, addr):
+        return self.DWORD.unpack_from(self.data, addr)[0]
+
+    def write_byte(self, addr, val):
+        self.data[addr] = val
+        self.dirty.add(addr >> self.PAGE_SHIFT)
+
+    def write_hword(self, addr, val):
+        self.HWORD.pack_into(self.data, addr, val)
+        self.dirty.add(addr >> self.PAGE_SHIFT)
+        self.dirty.add((addr + 1) >> self.PAGE_SHIFT)
+
+    def write_word(self, addr, val):
+        self.WORD.pack_into(self.data, addr, val)
+        self.dirty.add(addr >> self.PAGE_SHIFT)
+        self.dirty.add((addr + 3) >> self.PAGE_SHIFT)
+
+    def write_dword(self, addr, val):
+        self.DWORD.pack_into(self.data, addr, val)
+        self.dirty.add(addr >> self.PAGE_SHIFT)
+        self.dirty.add((addr + 7) >> self.PAGE_SHIFT)
+
+    def read(self, addr, length):
+        return bytes(self.data[addr : addr + length])
+
+    def write(self, addr, buf):
+        if addr + len(buf) > self.size:
+            raise IndexError(f"Write of {len(buf)} bytes at address ({addr}) exceeds memory size ({self.size})")
+        self.data[addr : addr + len(buf)] = buf
+        if buf:
+            self.mark(addr, len(buf))
+
+class Image:
+    # Memory contents in an unlinked file (a memfd where available) for Memory(size, image.fd) to map
+    def __init__(self, size, pages):
+        if hasattr(os, "memfd_create"):
+            self.fd = os.memfd_create("phase4-image")
+        else:
+            self.file = tempfile.TemporaryFile()
+            self.fd = os.dup(self.file.fileno())
+        os.ftruncate(self.fd, size)
+        for n, page in pages.items():
+            os.pwrite(self.fd, page, n << Memory.PAGE_SHIFT)
+
+    def __del__(self):
+        os.close(self.fd) # Mappings made from it keep their own descriptor
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+# ./recompiler.py asm_compiler.bin asm_compiler_rc.py
+# ./asm_compiler_rc.py [argv]
+
+# Ahead-of-time recompiler from a phase4 binary to a standalone Python module
+# Code reachable from the entry point is split into basic blocks (see jit.py) and grouped into one Python
+# function per CALL target (named after its label in the .symbols file when there is one). Inside a function
+# registers and sp live in locals, branches are Python ifs, jumps back to a loop head continue the function's
+# while loop and CALLs become direct Python calls, so control only goes back through the FUNCTIONS dict
+# when it leaves a function some other way than its RET.
+# PCs the recompiler could not resolve statically (computed jump targets, code reached only through
+# self-modification) are run by the interpreter until control lands on a recompiled block again.
+#
+# Recompiled code is the program as it was in the binary: a store into the code section still invalidates
+# the interpreter's caches but not the recompiled functions, which keep running the original instructions.
+# Self-modifying programs have to run on the ISA's own engines.
+
+import os
+import sys
+from isa import ISA
+
+class Recompiler:
+    MAX_CALL_DEPTH = 200 # Deeper guest calls go back through execute() instead of the Python stack
+    GROUP_SIZE = 8       # Blocks or groups per level of a function's "if pc" tree
+
+    def __init__(self, input_fn):
+        self.input_fn = input_fn
+        self.isa = ISA()
+        self.isa.load_bin_into_mem(input_fn)
+        with open(f"{input_fn}", "rb") as b:
+            DATA_OFFSET, DATA_LENGTH, CODE_OFFSET, CODE_LENGTH, ENTRY_POINT = self.isa.read_header(b)
+        self.code_start = CODE_OFFSET - self.isa.HEADER_LENGTH
+        self.image = bytes(self.isa.mem[0 : DATA_LENGTH + CODE_LENGTH])
+        self.entry_point = self.isa.pc
+        self.labels = self.load_labels()
+        self.blocks = {} # Entry PC -> [(pc, name, args, next_pc)]
+        self.entries = {self.entry_point} # Function entries, the entry point and every CALL target
+
+    def load_labels(self):
+        # Code labels only, data symbols live below the code section
+        labels = {}
+        if os.path.exists(f"{self.input_fn}.symbols"):
+            with open(f"{self.input_fn}.symbols", "r") as f:
+                for line in f.readlines():
+                    line_list = line.split()
+                    addr = int(line_list[2])
+                    if addr >= self.code_start and addr not in labels:
+                        labels[addr] = line_list[0]
+        if self.entry_point not in labels:
+            labels[self.entry_point] = "_start"
+        return labels
+
+    def discover(self):
+        # Follows every statically known successor from the entry point and the code labels
+        worklist = [self.entry_point] + sorted(self.labels)
+        while worklist:
+            pc = worklist.pop()
+            if pc in self.blocks:
+                continue
+            try:
+                instrs, end = self.isa.jit.scan(pc)
+            except ValueError:
+                continue # Not code, the interpreter raises if it is ever reached
+            self.blocks[pc] = instrs
+            last_pc, name, args, next_pc = instrs[-1]
+            if name.startswith("J") or name == "CALL":
+                worklist.append(args[0])
+            if name == "CALL":
+                self.entries.add(args[0])
+            if name not in ("JMP", "RET", "HALT"):
+                worklist.append(next_pc)
+
+    def owner(self, pc):
+        # Function a block belongs to, the closest entry at or before it (jump labels stay inside their function)
+        entry_pcs = [addr for addr in self.entries if addr <= pc]
+        if entry_pcs:
+            return max(entry_pcs)
+        return self.entry_point
+
+    def function_name(self, entry_pc):
+        name = "".join(c if c.isalnum() else "_" for c in self.labels.get(entry_pc, "sub"))
+        return f"fn_{name}_{entry_pc:06X}"
+
+    def emit_function(self, entry_pc, pcs):
+        # One Python function per entry: registers and sp stay in locals for the whole function, the blocks
+        # follow each other in address order, each under an "if pc == ...:" so falling through or jumping
+        # forward runs straight into the next block and jumping back restarts the loop
+        jit = self.isa.jit
+        fn = self.function_name(entry_pc)
+        own = set(pcs)
+        lowered = {pc: jit.lower(self.blocks[pc]) for pc in pcs}
+        used = set().union(*(block["used"] for block in lowered.values()))
+        written = set().union(*(block["written"] for block in lowered.values()))
+        terminators = {block["terminator"][1] for block in lowered.values() if block["terminator"] is not None}
+        uses_sp = any(block["sp"] for block in lowered.values()) or bool(terminators & {"CALL", "RET"})
+        uses_dirty = any(block["dirty"] for block in lowered.values()) or bool(terminators & {"CALL", "RET"})
+        uses_mmio = any(block["mmio"] for block in lowered.values())
+
+        def load():
+            lines = [f"r{n} = reg[{n}]" for n in sorted(used)]
+            if uses_sp:
+                lines.append("sp = isa.sp")
+            if uses_mmio:
+                lines.append("mmio_lo = isa.bus.mmio_lo")
+                lines.append("mmio_hi = isa.bus.mmio_hi")
+            return lines
+
+        def store():
+            lines = [f"reg[{n}] = r{n}" for n in sorted(written)]
+            if uses_sp:
+                lines.append("isa.sp = sp")
+            return lines
+
+        def leave(target):
+            # Back to the caller (or execute()) with the ISA state written back
+            return store() + [f"isa.pc = {target}", "return"]
+
+        def goto(target, pc):
+            if target not in own:
+                return leave(target)
+            if target > pc:
+                return [f"pc = {target}"] # Falls through to the block's "if" further down
+            return [f"pc = {target}", "continue"]
+
+        def indent(lines, depth=1):
+            return [f"{'    ' * depth}{line}" for line in lines]
+
+        out = [f"# {self.labels.get(entry_pc, f'sub_{entry_pc:06X}')}"]
+        out.append(f"def {fn}(isa, reg, mem, depth=0):")
+        out += indent(load())
+        if uses_dirty:
+            out.append("    dirty = isa.memory.dirty")
+        out.append("    pc = isa.pc")
+        out.append("    while True:")
+        code = {}
+        for pc in pcs:
+            block = lowered[pc]
+            lines = block["body"] + block["flags"]
+            if block["terminator"] is None:
+                lines += goto(block["fallthrough"], pc)
+            else:
+                term_pc, name, args, next_pc = block["terminator"]
+                if name == "JMP":
+                    lines += goto(args[0], pc)
+                elif name in block["conditions"]:
+                    lines.append(f"if {block['conditions'][name]}:")
+                    lines += indent(goto(args[0], pc))
+                    lines.append("else:")
+                    lines += indent(goto(next_pc, pc))
+                elif name == "CALL":
+                    lines.append("if sp - 8 >= 0:")
+                    lines += indent(jit.push_lines(next_pc))
+                    if args[0] in self.blocks:
+                        # Direct call, the callee returns once control leaves it (normally through its RET)
+                        lines.append("    if depth < MAX_CALL_DEPTH:")
+                        lines += indent(store(), 2)
+                        lines.append(f"        isa.pc = {args[0]}")
+                        lines.append(f"        {self.function_name(args[0])}(isa, reg, mem, depth + 1)")
+                        lines.append(f"        if not isa.running or isa.pc != {next_pc}:")
+                        lines.append("            return")
+                        lines += indent(load(), 2)
+                        lines.append("    else:")
+                        lines += indent(leave(args[0]), 2)
+                    else:
+                        lines += indent(leave(args[0]))
+                    lines += goto(next_pc, pc) # Returned here, or the push overflowed and CALL fell through
+                elif name == "RET":
+                    lines.append(f"if sp + 8 <= {self.isa.MEM_SIZE}:")
+                    lines += indent(jit.pop_lines("pc"))
+                    lines.append("else:")
+                    lines.append(f"    pc = {next_pc}")
+                    lines += leave("pc")
+                elif name == "HALT":
+                    lines += ["isa.running = False", "isa.halted = True", "isa.console.flush()"]
+                    lines += leave(term_pc)
+                elif name == "SYS":
+                    # SYS reads and writes isa.reg directly
+                    lines += store()
+                    lines.append(f"isa.pc = {term_pc}")
+                    lines.append(f"isa.SYS(*{args!r})")
+                    lines.append(f"isa.pc = {next_pc}")
+                    lines.append("if not isa.running:")
+                    lines.append("    return")
+                    lines += load()
+                    lines += goto(next_pc, pc)
+            code[pc] = lines
+
+        def chain(pcs):
+            # Blocks in address order, groups of them nested under "if pc < <next group>:" so a jump
+            # back to a loop head tests a handful of PCs rather than every block before it
+            if len(pcs) <= self.GROUP_SIZE:
+                lines = []
+                for pc in pcs:
+                    lines.append(f"if pc == {pc}:")
+                    lines += indent(code[pc])
+                return lines
+            size = -(-len(pcs) // self.GROUP_SIZE)
+            groups = [pcs[i : i + size] for i in range(0, len(pcs), size)]
+            lines = []
+            for group, following in zip(groups, groups[1:]):
+                lines.append(f"if pc < {following[0]}:")
+                lines += indent(chain(group))
+            return lines + chain(groups[-1])
+
+        out += indent(chain(pcs), 2)
+        out += indent(leave("pc"), 2) # Entered at a PC that is not one of its blocks
+        out.append("")
+        return out
+
+    def emit(self, output_fn):
+        self.discover()
+
+        functions = {}
+        for pc in sorted(self.blocks):
+            functions.setdefault(self.owner(pc), []).append(pc)
+
+        out = []
+        out.append("#!/usr/bin/env python3")
+        out.append("")
+        out.append(f"# Recompiled from {os.path.basename(self.input_fn)} by recompiler.py, do not edit")
+        out.append(f"# ./{os.path.basename(output_fn)} [argv]")
+        out.append("")
+        out.append("import sys")
+        out.append("import struct")
+        out.append("from isa import ISA")
+        out.append("")
+        out.append(self.isa.jit.PRELUDE)
+        out.append(f"MAX_CALL_DEPTH = {self.MAX_CALL_DEPTH}")
+        out.append(f"ENTRY_POINT = {self.entry_point}")
+        out.append(f"IMAGE = bytes.fromhex(\"{self.image.hex()}\")")
+        out.append("")
+
+        for entry_pc in sorted(functions):
+            out += self.emit_function(entry_pc, functions[entry_pc])
+
+        # Fallback dispatch, used to enter the program and whenever control leaves a function other than through its RET
+        out.append("FUNCTIONS = {")
+        for entry_pc in sorted(functions):
+            for pc in functions[entry_pc]:
+                out.append(f"    {pc}: {self.function_name(entry_pc)},")
+        out.append("}")
+        out.append("")
+        out.append("def execute(isa):")
+        out.append("    reg = isa.reg")
+        out.append("    mem = isa.mem")
+        out.append("    while isa.running:")
+        out.append("        fn = FUNCTIONS.get(isa.pc)")
+        out.append("        if fn is None:")
+        out.append("            isa.execute_until(FUNCTIONS) # Not resolved statically, interpret until a recompiled block")
+        out.append("        else:")
+        out.append("            fn(isa, reg, mem)")
+        out.append("")
+        out.append("def run(argc=0, argv=None):")
+        out.append("    isa = ISA()")
+        out.append("    isa.reset()")
+        out.append("    isa.memory.write(0, IMAGE)")
+        out.append("    isa.pc = ENTRY_POINT")
+        out.append("    isa.load_argv_into_mem(argc, argv)")
+        out.append("    isa.running = True")
+        out.append("    try:")
+        out.append("        execute(isa)")
+        out.append("    finally:")
+        out.append("        isa.console.flush()")
+        out.append("    return isa")
+        out.append("")
+        out.append("if __name__ == '__main__':")
+        out.append("    argv = sys.argv[1:]")
+        out.append("    run(len(argv), argv if argv else None)")
+
+        with open(f"{output_fn}", "w") as f:
+            f.write("\n".join(out) + "\n")
+
+if __name__ == '__main__':
+    if (len(sys.argv) > 2):
+        input_fn = sys.argv[1]
+        output_fn = sys.argv[2]
+        recompiler = Recompiler(input_fn)
+        recompiler.emit(output_fn)
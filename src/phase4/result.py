@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+# Outcome of ISA.run() / ISA.resume()
+# run() without a budget raises a fault instead of returning FAULTED, resume() and budgeted runs always return.
+# status is one of:
+# HALTED    - the program ran HALT
+# EXHAUSTED - an instruction or time budget ran out (budget says which), the ISA stops between two instructions
+#             and resume() continues where it left off
+# PREEMPTED - ISA.preempt() was called (e.g. from another thread or a signal handler), resumable like EXHAUSTED
+# BLOCKED   - a SYS port handler raised Blocked (see blocked.py), error holds it and pc is the SYS
+# FAULTED   - an instruction raised, error holds the exception and pc the address it was raised at
+#             (the entry of the block with the block engine)
+# instructions is the number of instructions retired, None for engines that do not count them.
+
+class RunResult:
+    HALTED    = "halted"
+    EXHAUSTED = "exhausted"
+    PREEMPTED = "preempted"
+    BLOCKED   = "blocked"
+    FAULTED   = "faulted"
+
+    def __init__(self, status, instructions=None, elapsed=0.0, pc=0, budget=None, error=None):
+        self.status = status
+        self.instructions = instructions
+        self.elapsed = elapsed # Seconds
+        self.pc = pc
+        self.budget = budget   # "instructions" or "time" when EXHAUSTED
+        self.error = error
+
+    @property
+    def resumable(self):
+        return self.status in (self.EXHAUSTED, self.PREEMPTED)
+
+    def __repr__(self):
+        fields = [self.status, f"instructions={self.instructions}", f"elapsed={self.elapsed:.3f}s", f"pc={self.pc}"]
+        if self.budget is not None:
+            fields.append(f"budget={self.budget}")
+        if self.error is not None:
+            fields.append(f"error={self.error!r}")
+        return f"RunResult({', '.join(fields)})"
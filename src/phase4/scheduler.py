@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+# ./scheduler.py prog1.bin [prog2.bin ...]
+
+# Runs many phase4 programs in one process
+# Every program gets its own ISA (memory pages are only allocated when touched, see memory.py) and the scheduler
+# round-robins them in quanta of `quantum` instructions through resume() budgets.
+#
+# SYS ports that can wait (STDIN_*, FILE_*, SLEEP) are rebound on each ISA to park(), which raises Blocked
+# before the call runs. The ISA stops at the SYS, the scheduler runs the device's real handler on asyncio's
+# thread pool (SLEEP becomes an asyncio.sleep) while the other programs keep running, then moves the parked
+# ISA past the SYS and puts it back at the end of the run queue.
+#
+# Each program's STDOUT goes to its own buffer, stdin is the bytes (or binary file) given to spawn().
+
+import io
+import sys
+import asyncio
+from collections import deque
+from isa import ISA
+from opcodes import Opcode
+from result import RunResult
+from blocked import Blocked
+
+class Scheduler:
+    QUANTUM = 10000 # Instructions per slice
+
+    def __init__(self, quantum=QUANTUM, engine="block"):
+        self.quantum = quantum
+        self.engine = engine
+        self.guests = [] # One dict per program, see spawn()
+        self.ready = deque()
+        self.parked = 0
+        self.wakeup = None
+        self.stats = {"slices": 0, "parks": 0}
+
+    def spawn(self, input_fn, argv=None, stdin=b"", name=None):
+        # Loads a program and queues it, returns its guest record:
+        # name, isa, output (bytes written to STDOUT), result (RunResult once it halted or faulted),
+        # instructions retired and the blocking ports rebound to park()
+        isa = ISA()
+        isa.load_bin_into_mem(input_fn)
+        isa.load_argv_into_mem(len(argv) if argv else 0, argv)
+        guest = {
+            "name": name or input_fn,
+            "isa": isa,
+            "output": io.BytesIO(),
+            "result": None,
+            "instructions": 0,
+            "ports": {}
+        }
+        isa.console.stdin = io.BytesIO(stdin) if isinstance(stdin, (bytes, bytearray)) else stdin
+        isa.console.stdout = guest["output"]
+        for port, call in isa.bus.names.items():
+            if call.startswith(("STDIN_", "FILE_")) or call == "SLEEP":
+                guest["ports"][port] = isa.bus.ports[port]
+                isa.bus.rebind_port(port, self.park, port)
+        self.guests.append(guest)
+        self.ready.append(guest)
+        return guest
+
+    def park(self, rx, port):
+        raise Blocked(port, rx)
+
+    async def run(self):
+        # Runs every spawned program to HALT or a fault, returns the guest records
+        self.wakeup = asyncio.Event()
+        while self.ready or self.parked:
+            if not self.ready:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            guest = self.ready.popleft()
+            result = guest["isa"].resume(self.engine, max_instructions=self.quantum)
+            self.stats["slices"] += 1
+            if result.instructions:
+                guest["instructions"] += result.instructions
+            if result.status == RunResult.EXHAUSTED:
+                self.ready.append(guest)
+            elif result.status == RunResult.BLOCKED:
+                self.stats["parks"] += 1
+                self.parked += 1
+                asyncio.create_task(self.complete(guest, result.error))
+            else:
+                self.finish(guest, result)
+            await asyncio.sleep(0) # Lets finished I/O hand its programs back
+        return self.guests
+
+    async def complete(self, guest, blocked):
+        # Runs the parked SYS off the event loop, then continues the program after it
+        isa = guest["isa"]
+        handler, args = guest["ports"][blocked.port]
+        try:
+            if isa.bus.names[blocked.port] == "SLEEP":
+                isa.console.flush()
+                await asyncio.sleep(isa.reg[0] / 1000)
+            else:
+                await asyncio.get_running_loop().run_in_executor(None, handler, blocked.rx, *args)
+            isa.pc += Opcode.SYS.length
+            guest["instructions"] += 1
+            self.ready.append(guest)
+        except Exception as e:
+            self.finish(guest, RunResult(RunResult.FAULTED, guest["instructions"], pc=isa.pc, error=e))
+        finally:
+            self.parked -= 1
+            self.wakeup.set()
+
+    def finish(self, guest, result):
+        guest["isa"].console.flush()
+        result.instructions = guest["instructions"]
+        guest["result"] = result
+
+if __name__ == '__main__':
+    if (len(sys.argv) > 1):
+        scheduler = Scheduler()
+        for input_fn in sys.argv[1:]:
+            scheduler.spawn(input_fn)
+        for guest in asyncio.run(scheduler.run()):
+            print(f"== {guest['name']}: {guest['result']}")
+            sys.stdout.write(guest["output"].getvalue().decode("latin-1"))
+        print(f"{scheduler.stats['slices']} slices, {scheduler.stats['parks']} parked SYS calls", file=sys.stderr)
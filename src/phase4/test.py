@@ -6,24 +6,42 @@ Script to automatically run and grade test suite
 import sys
 import os
 import io
+import time
+import asyncio
+import tempfile
+import importlib.util
 from isa import ISA
+from memory import Memory
+from blocked import Blocked
+from tracer import Tracer
+from scheduler import Scheduler
+from batch import Batch
+from lockstep import Lockstep, np
+from daemon import Daemon
+from client import Client
+from result import RunResult
 from assembler import Assembler
+from recompiler import Recompiler
 
 class TestRunner:
-    def __init__(self):
+    def __init__(self, engine="cache"):
+        self.engine = engine
         self.tests_passed = 0
         self.tests_failed = 0
         self.test_results = []
+        self.captured_stderr = ""
 
     def capture_output(self, test_func):
-        """Capture stdout from test execution"""
-        old_stdout = sys.stdout
+        """Capture stdout from test execution, stderr (e.g. the HEAP_STATS report) is kept in self.captured_stderr"""
+        old_stdout, old_stderr = sys.stdout, sys.stderr
         sys.stdout = captured_output = io.StringIO()
+        sys.stderr = captured_stderr = io.StringIO()
         try:
             test_func()
             output = captured_output.getvalue()
         finally:
-            sys.stdout = old_stdout
+            sys.stdout, sys.stderr = old_stdout, old_stderr
+            self.captured_stderr = captured_stderr.getvalue()
         return output.strip()
 
     def run_isa_test(self, test_name):
@@ -36,7 +54,7 @@ class TestRunner:
                 
                 # Then run the .bin file
                 isa = ISA()
-                isa.run(f"tests/{test_name}.bin", False)
+                isa.run(f"tests/{test_name}.bin", False, engine=self.engine)
             except Exception as e:
                 print(f"Error: {e}")
         
@@ -53,12 +71,32 @@ class TestRunner:
                 # Then run the .bin file with arguments
                 isa = ISA()
                 argc = len(args)
-                isa.run(f"tests/{test_name}.bin", debug_mode=False, step_mode=False, argc=argc, argv=args)
+                isa.run(f"tests/{test_name}.bin", debug_mode=False, step_mode=False, argc=argc, argv=args, engine=self.engine)
             except Exception as e:
                 print(f"Error: {e}")
         
         return self.capture_output(test_execution)
 
+    def run_isa_test_with_stdin(self, test_name, stdin):
+        """Run a single ISA test reading stdin from the given bytes and return output"""
+        def test_execution():
+            old_stdin = sys.stdin
+            sys.stdin = io.TextIOWrapper(io.BytesIO(stdin))
+            try:
+                # First assemble the .asm file to .bin
+                assembler = Assembler(f"tests/{test_name}.asm")
+                assembler.assemble(f"tests/{test_name}.bin")
+                
+                # Then run the .bin file
+                isa = ISA()
+                isa.run(f"tests/{test_name}.bin", False, engine=self.engine)
+            except Exception as e:
+                print(f"Error: {e}")
+            finally:
+                sys.stdin = old_stdin
+        
+        return self.capture_output(test_execution)
+
     def verify_register_state(self, test_name, expected_reg_values):
         """Verify final register state for tests that don't produce output"""
         try:
@@ -66,9 +104,9 @@ class TestRunner:
             assembler = Assembler(f"tests/{test_name}.asm")
             assembler.assemble(f"tests/{test_name}.bin")
             
-            # Then run the .bin file
+            # Then run the .bin file, engines that report on stderr (counted, profile) are captured too
             isa = ISA()
-            isa.run(f"tests/{test_name}.bin", False)
+            self.capture_output(lambda: isa.run(f"tests/{test_name}.bin", False, engine=self.engine))
             
             for reg, expected_val in expected_reg_values.items():
                 actual_val = isa.reg[reg]
@@ -123,6 +161,656 @@ class TestRunner:
                 self.tests_failed += 1
                 self.test_results.append((test_name, "ERROR", str(e)))
 
+    def run_isa_test_forked(self, test_name, args, runs):
+        """Load a test once, then run it from a snapshot several times through fork() and restore()"""
+        assembler = Assembler(f"tests/{test_name}.asm")
+        assembler.assemble(f"tests/{test_name}.bin")
+        
+        isa = ISA()
+        isa.load_bin_into_mem(f"tests/{test_name}.bin")
+        isa.load_argv_into_mem(len(args), args)
+        snapshot = isa.snapshot()
+        
+        outputs = []
+        for i in range(runs):
+            child = isa.fork(snapshot)
+            if child.memory.fd is None or snapshot.get("image") is None:
+                raise AssertionError("Child memory is not a private mapping of the snapshot's image")
+            outputs.append(self.capture_output(lambda: child.resume(self.engine)))
+            isa.restore(snapshot)
+            outputs.append(self.capture_output(lambda: isa.resume(self.engine)))
+        return outputs
+
+    def run_counted_test(self, test_name, stdin, expected_output, expected_instructions, expected_calls):
+        """Run a test on the counted engine and verify its counters and the report it prints"""
+        print(f"Running {test_name} counted...", end=" ")
+        
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                # Debug mode writes the .symbols file the report names call targets with
+                assembler = Assembler(f"tests/{test_name}.asm")
+                assembler.assemble(os.path.join(tmp, f"{test_name}.bin"), debug_mode=True)
+                isa = ISA()
+                isa.console.stdin = io.BytesIO(stdin)
+                output = self.capture_output(lambda: isa.run(os.path.join(tmp, f"{test_name}.bin"), engine="counted"))
+                report = self.captured_stderr
+            
+            instructions = sum(isa.counters["opcodes"].values())
+            calls = {isa.symbolize(addr): count for addr, count in isa.counters["calls"].items()}
+            if output != expected_output:
+                message = f"Expected '{expected_output}', got '{output}'"
+            elif instructions != expected_instructions:
+                message = f"Expected {expected_instructions} instructions, got {instructions}"
+            elif calls != expected_calls:
+                message = f"Expected calls {expected_calls}, got {calls}"
+            elif f"Instructions retired: {expected_instructions}" not in report or "Calls:" not in report:
+                message = f"Report missing from stderr: '{report}'"
+            else:
+                message = None
+            if message is None:
+                print("PASS")
+                self.tests_passed += 1
+                self.test_results.append((test_name, "PASS", ""))
+            else:
+                print("FAIL")
+                self.tests_failed += 1
+                self.test_results.append((test_name, "FAIL", message))
+        except Exception as e:
+            print("ERROR")
+            self.tests_failed += 1
+            self.test_results.append((test_name, "ERROR", str(e)))
+
+    def run_profile_test(self, test_name, stdin, expected_output, interval, expected_stacks):
+        """Run a test on the profile engine and verify the folded stacks it writes next to the binary"""
+        print(f"Running {test_name} profiled...", end=" ")
+
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                # Debug mode writes the .symbols file the stacks are named from
+                assembler = Assembler(f"tests/{test_name}.asm")
+                assembler.assemble(os.path.join(tmp, f"{test_name}.bin"), debug_mode=True)
+                isa = ISA()
+                isa.console.stdin = io.BytesIO(stdin)
+                isa.profile_interval = interval
+                output = self.capture_output(lambda: isa.run(os.path.join(tmp, f"{test_name}.bin"), engine="profile"))
+                with open(os.path.join(tmp, f"{test_name}.bin.folded"), "r") as f:
+                    stacks = dict(line.rsplit(" ", 1) for line in f.read().splitlines())
+
+            stacks = {path: int(count) for path, count in stacks.items()}
+            if output != expected_output:
+                message = f"Expected '{expected_output}', got '{output}'"
+            elif stacks != expected_stacks:
+                message = f"Expected stacks {expected_stacks}, got {stacks}"
+            else:
+                message = None
+            if message is None:
+                print("PASS")
+                self.tests_passed += 1
+                self.test_results.append((test_name, "PASS", ""))
+            else:
+                print("FAIL")
+                self.tests_failed += 1
+                self.test_results.append((test_name, "FAIL", message))
+        except Exception as e:
+            print("ERROR")
+            self.tests_failed += 1
+            self.test_results.append((test_name, "ERROR", str(e)))
+
+    def run_trace_test(self, test_name, expected_output, expected_lines):
+        """Run a test on the trace engine, its first instruction patched to a no-op store mode, and verify the decoded trace"""
+        print(f"Running {test_name} traced...", end=" ")
+        
+        try:
+            assembler = Assembler(f"tests/{test_name}.asm")
+            assembler.assemble(f"tests/{test_name}.bin")
+            with tempfile.TemporaryDirectory() as tmp:
+                isa = ISA()
+                isa.trace_fn = os.path.join(tmp, "trace.bin")
+                isa.load_bin_into_mem(f"tests/{test_name}.bin")
+                isa.memory.write(isa.pc + 1, bytes((0x02,))) # SW Rx, [Ry] -> register-to-register mode
+                results = []
+                output = self.capture_output(lambda: results.append(isa.resume("trace")))
+                lines = [" ".join(line.split()) for line in Tracer.decode(isa.trace_fn)]
+            
+            if results[0].status != RunResult.HALTED:
+                message = f"Expected the trace run to halt, got {results[0]}"
+            elif output != expected_output:
+                message = f"Expected '{expected_output}', got '{output}'"
+            elif lines != expected_lines:
+                message = f"Expected trace {expected_lines}, got {lines}"
+            else:
+                message = None
+            if message is None:
+                print("PASS")
+                self.tests_passed += 1
+                self.test_results.append((test_name, "PASS", ""))
+            else:
+                print("FAIL")
+                self.tests_failed += 1
+                self.test_results.append((test_name, "FAIL", message))
+        except Exception as e:
+            print("ERROR")
+            self.tests_failed += 1
+            self.test_results.append((test_name, "ERROR", str(e)))
+
+    def run_tracer_error_test(self):
+        """Make every trace write fail and verify the writer raises the error instead of blocking on a full ring"""
+        print("Running tracer write failure...", end=" ")
+        
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                tracer = Tracer(os.path.join(tmp, "trace.bin"))
+                tracer.file.close() # Writes raise ValueError
+                error = None
+                try:
+                    for _ in range(Tracer.CHUNK_RECORDS * (Tracer.CHUNKS + 1)):
+                        tracer.record(0, 0)
+                except ValueError as e:
+                    error = e
+            if error is not None:
+                print("PASS")
+                self.tests_passed += 1
+                self.test_results.append(("tracer", "PASS", ""))
+            else:
+                print("FAIL")
+                self.tests_failed += 1
+                self.test_results.append(("tracer", "FAIL", "Expected record() to raise the flusher's write error"))
+        except Exception as e:
+            print("ERROR")
+            self.tests_failed += 1
+            self.test_results.append(("tracer", "ERROR", str(e)))
+
+    def run_fork_config_test(self, test_name, args, port):
+        """Fork a file-backed ISA with a rebound port and verify the child maps the same file and blocks on the port"""
+        print(f"Running {test_name} forked from a file-backed ISA with port 0x{port:04X} rebound...", end=" ")
+        
+        def park(rx):
+            raise Blocked(port, rx)
+        
+        try:
+            assembler = Assembler(f"tests/{test_name}.asm")
+            assembler.assemble(f"tests/{test_name}.bin")
+            loader = ISA()
+            loader.load_bin_into_mem(f"tests/{test_name}.bin")
+            with tempfile.TemporaryFile() as image:
+                image.write(loader.mem)
+                image.flush()
+                isa = ISA(Memory(ISA.MEM_SIZE, image.fileno()))
+            isa.pc = loader.pc
+            isa.load_argv_into_mem(len(args), args)
+            isa.bus.rebind_port(port, park)
+            
+            child = isa.fork()
+            result = child.resume(self.engine)
+            if child.memory.fd is None:
+                message = "Child memory is not mapped from the parent's file"
+            elif result.status != RunResult.BLOCKED or result.error.port != port:
+                message = f"Expected the child to block on port 0x{port:04X}, got {result}"
+            else:
+                message = None
+            if message is None:
+                print("PASS")
+                self.tests_passed += 1
+                self.test_results.append((test_name, "PASS", ""))
+            else:
+                print("FAIL")
+                self.tests_failed += 1
+                self.test_results.append((test_name, "FAIL", message))
+        except Exception as e:
+            print("ERROR")
+            self.tests_failed += 1
+            self.test_results.append((test_name, "ERROR", str(e)))
+
+    def run_fork_test(self, test_name, args, expected_output, runs=3):
+        """Run a forked test and verify every run printed the same output"""
+        print(f"Running {test_name} forked {runs} times with args {args}...", end=" ")
+        
+        try:
+            outputs = self.run_isa_test_forked(test_name, args, runs)
+            if all(output == expected_output for output in outputs):
+                print("PASS")
+                self.tests_passed += 1
+                self.test_results.append((test_name, "PASS", ""))
+            else:
+                print("FAIL")
+                self.tests_failed += 1
+                self.test_results.append((test_name, "FAIL", f"Expected '{expected_output}' every run, got {outputs}"))
+        except Exception as e:
+            print("ERROR")
+            self.tests_failed += 1
+            self.test_results.append((test_name, "ERROR", str(e)))
+
+    def run_fault_test(self, test_name, error_type):
+        """Verify run() raises a fault without a budget and returns it as FAULTED with one"""
+        print(f"Running {test_name} faulting with and without a budget...", end=" ")
+        
+        engine = self.engine if self.engine in ISA().budgeted_engines else "cache"
+        try:
+            assembler = Assembler(f"tests/{test_name}.asm")
+            assembler.assemble(f"tests/{test_name}.bin")
+            raised = None
+            try:
+                ISA().run(f"tests/{test_name}.bin", False, engine=self.engine)
+            except Exception as e:
+                raised = e
+            result = ISA().run(f"tests/{test_name}.bin", False, engine=engine, max_instructions=1000)
+            
+            if not isinstance(raised, error_type):
+                message = f"Expected run() to raise {error_type.__name__}, got {raised!r}"
+            elif result.status != RunResult.FAULTED or not isinstance(result.error, error_type):
+                message = f"Expected a budgeted run to return FAULTED with {error_type.__name__}, got {result}"
+            else:
+                message = None
+            if message is None:
+                print("PASS")
+                self.tests_passed += 1
+                self.test_results.append((test_name, "PASS", ""))
+            else:
+                print("FAIL")
+                self.tests_failed += 1
+                self.test_results.append((test_name, "FAIL", message))
+        except Exception as e:
+            print("ERROR")
+            self.tests_failed += 1
+            self.test_results.append((test_name, "ERROR", str(e)))
+
+    def run_console_test(self, test_name, runs):
+        """Run a test mixing console input and output and verify where the buffered output is written out
+        runs is a list of (stdin, line_threshold, expected writes, expected writes before the first read, error type)"""
+        print(f"Running {test_name} buffering...", end=" ")
+
+        class Output:
+            # Binary stdout keeping each write separately, a write is one flush of the console buffer
+            def __init__(self):
+                self.writes = []
+            def write(self, data):
+                self.writes.append(bytes(data).decode())
+            def flush(self):
+                pass
+
+        class Input(io.BytesIO):
+            # Binary stdin noting how many writes reached stdout before each read
+            def __init__(self, data, output):
+                super().__init__(data)
+                self.output = output
+                self.reads = []
+            def readline(self, *args):
+                self.reads.append(len(self.output.writes))
+                return super().readline(*args)
+
+        try:
+            assembler = Assembler(f"tests/{test_name}.asm")
+            assembler.assemble(f"tests/{test_name}.bin")
+            message = None
+            for stdin, line_threshold, expected_writes, expected_reads, error_type in runs:
+                isa = ISA()
+                isa.console.line_threshold = line_threshold
+                isa.console.stdout = Output()
+                isa.console.stdin = Input(stdin, isa.console.stdout)
+                raised = []
+                def run():
+                    try:
+                        isa.run(f"tests/{test_name}.bin", False, engine=self.engine)
+                    except Exception as e:
+                        raised.append(e)
+                self.capture_output(run) # Engines that report on stderr (counted, profile)
+                raised = raised[0] if raised else None
+
+                writes = isa.console.stdout.writes
+                if error_type is None and raised is not None or error_type is not None and not isinstance(raised, error_type):
+                    message = f"Expected {error_type.__name__ if error_type else 'no error'} with stdin {stdin!r}, got {raised!r}"
+                elif writes != expected_writes:
+                    message = f"Expected writes {expected_writes} with stdin {stdin!r} and line_threshold {line_threshold}, got {writes}"
+                elif isa.console.stdin.reads[:1] != [expected_reads]:
+                    message = f"Expected {expected_reads} writes before the first read, got {isa.console.stdin.reads[:1]}"
+                if message is not None:
+                    break
+            if message is None:
+                print("PASS")
+                self.tests_passed += 1
+                self.test_results.append((test_name, "PASS", ""))
+            else:
+                print("FAIL")
+                self.tests_failed += 1
+                self.test_results.append((test_name, "FAIL", message))
+        except Exception as e:
+            print("ERROR")
+            self.tests_failed += 1
+            self.test_results.append((test_name, "ERROR", str(e)))
+
+    def run_fusion_test(self, test_name, expected_output, expected_fused):
+        """Run a test on the cache engine with and without fusion, verify the superinstructions run and that both agree"""
+        print(f"Running {test_name} fused...", end=" ")
+
+        try:
+            assembler = Assembler(f"tests/{test_name}.asm")
+            assembler.assemble(f"tests/{test_name}.bin")
+            fused, unfused = ISA(), ISA()
+            unfused.fusion = False
+            output = self.capture_output(lambda: fused.run(f"tests/{test_name}.bin", False, engine="cache"))
+            unfused_output = self.capture_output(lambda: unfused.run(f"tests/{test_name}.bin", False, engine="cache"))
+
+            counts = {name: count for name, count in fused.fusion_counts.items() if count}
+            if output != expected_output:
+                message = f"Expected '{expected_output}', got '{output}'"
+            elif counts != expected_fused:
+                message = f"Expected superinstructions {expected_fused}, got {counts}"
+            elif unfused_output != output or unfused.reg != fused.reg or (unfused.sp, unfused.flags) != (fused.sp, fused.flags):
+                message = f"Fused and unfused runs differ: '{output}' / '{unfused_output}'"
+            else:
+                message = None
+            if message is None:
+                print("PASS")
+                self.tests_passed += 1
+                self.test_results.append((test_name, "PASS", ""))
+            else:
+                print("FAIL")
+                self.tests_failed += 1
+                self.test_results.append((test_name, "FAIL", message))
+        except Exception as e:
+            print("ERROR")
+            self.tests_failed += 1
+            self.test_results.append((test_name, "ERROR", str(e)))
+
+    def run_recompiled_test(self, test_name, args, stdin, expected_output):
+        """Recompile a test to a Python module, import it and verify its output and registers against the cache engine"""
+        print(f"Running {test_name} recompiled...", end=" ")
+
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                # Debug mode writes the .symbols file functions are named from, rc_ keeps the module from shadowing a repo module
+                bin_fn = os.path.join(tmp, f"{test_name}.bin")
+                module_fn = os.path.join(tmp, f"rc_{test_name}.py")
+                Assembler(f"tests/{test_name}.asm").assemble(bin_fn, debug_mode=True)
+                Recompiler(bin_fn).emit(module_fn)
+                spec = importlib.util.spec_from_file_location(f"rc_{test_name}", module_fn)
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+
+                results = {}
+                def recompiled():
+                    results["recompiled"] = module.run(len(args), args if args else None)
+                def cached():
+                    isa = ISA()
+                    isa.console.stdin = io.BytesIO(stdin)
+                    isa.run(bin_fn, False, argc=len(args), argv=args if args else None, engine="cache")
+                    results["cache"] = isa
+
+                old_stdin = sys.stdin
+                sys.stdin = io.TextIOWrapper(io.BytesIO(stdin))
+                try:
+                    output = self.capture_output(recompiled)
+                finally:
+                    sys.stdin = old_stdin
+                expected_isa = results["cache"] if self.capture_output(cached) == output else None
+
+            isa = results["recompiled"]
+            if output != expected_output:
+                message = f"Expected '{expected_output}', got '{output}'"
+            elif expected_isa is None:
+                message = "Output differs from the cache engine"
+            elif isa.reg != expected_isa.reg:
+                diff = [f"R{i}: expected {b}, got {a}" for i, (a, b) in enumerate(zip(isa.reg, expected_isa.reg)) if a != b]
+                message = f"Registers differ from the cache engine: {', '.join(diff)}"
+            elif (isa.sp, isa.flags) != (expected_isa.sp, expected_isa.flags):
+                message = f"Expected sp/flags {(expected_isa.sp, expected_isa.flags)}, got {(isa.sp, isa.flags)}"
+            else:
+                message = None
+            if message is None:
+                print("PASS")
+                self.tests_passed += 1
+                self.test_results.append((test_name, "PASS", ""))
+            else:
+                print("FAIL")
+                self.tests_failed += 1
+                self.test_results.append((test_name, "FAIL", message))
+        except Exception as e:
+            print("ERROR")
+            self.tests_failed += 1
+            self.test_results.append((test_name, "ERROR", str(e)))
+
+    def run_budget_test(self, test_name, expected_output, expected_instructions, max_instructions):
+        """Run a test in slices of max_instructions, resuming until it halts, and verify output and instruction count"""
+        print(f"Running {test_name} in slices of {max_instructions} instructions...", end=" ")
+        
+        # Budgets need an engine that counts instructions
+        engine = self.engine if self.engine in ISA().budgeted_engines else "cache"
+        try:
+            assembler = Assembler(f"tests/{test_name}.asm")
+            assembler.assemble(f"tests/{test_name}.bin")
+            
+            isa = ISA()
+            results = []
+            def test_execution():
+                result = isa.run(f"tests/{test_name}.bin", False, engine=engine, max_instructions=max_instructions)
+                results.append(result)
+                while result.status == RunResult.EXHAUSTED and len(results) < 10000:
+                    result = isa.resume(engine, max_instructions=max_instructions)
+                    results.append(result)
+            output = self.capture_output(test_execution)
+            
+            statuses = [result.status for result in results]
+            instructions = sum(result.instructions for result in results)
+            if output != expected_output:
+                message = f"Expected '{expected_output}', got '{output}'"
+            elif statuses[-1] != RunResult.HALTED or RunResult.HALTED in statuses[:-1] or len(results) < 2:
+                message = f"Expected slices ending in a halt, got {results}"
+            elif instructions != expected_instructions:
+                message = f"Expected {expected_instructions} instructions, got {instructions}"
+            elif any(result.instructions > max_instructions for result in results):
+                message = f"A slice went over its budget: {results}"
+            else:
+                message = None
+            
+            # A program that never halts stops at the budgets and keeps its state between slices
+            assembler = Assembler("tests/spin.asm")
+            assembler.assemble("tests/spin.bin")
+            spin = ISA()
+            first = spin.run("tests/spin.bin", False, engine=engine, max_instructions=1000)
+            counter = spin.reg[0]
+            second = spin.resume(engine, max_instructions=1000)
+            timed = spin.resume(engine, max_seconds=0.05)
+            if message is None and (first.status, first.budget, second.budget, timed.budget) != (RunResult.EXHAUSTED, "instructions", "instructions", "time"):
+                message = f"Expected spin to exhaust its budgets, got {first}, {second}, {timed}"
+            elif message is None and not 0 < counter < spin.reg[0]:
+                message = f"Expected spin to keep counting across slices, got R0 = {counter} then {spin.reg[0]}"
+            
+            if message is None:
+                print("PASS")
+                self.tests_passed += 1
+                self.test_results.append((test_name, "PASS", ""))
+            else:
+                print("FAIL")
+                self.tests_failed += 1
+                self.test_results.append((test_name, "FAIL", message))
+        except Exception as e:
+            print("ERROR")
+            self.tests_failed += 1
+            self.test_results.append((test_name, "ERROR", str(e)))
+
+    def run_scheduler_test(self, programs, quantum=20):
+        """Run several tests at once in one Scheduler and verify each one's output"""
+        names = [test_name for test_name, args, stdin, expected_output in programs]
+        print(f"Running {', '.join(names)} in one scheduler...", end=" ")
+        
+        # Budgets need an engine that counts instructions
+        engine = self.engine if self.engine in ISA().budgeted_engines else "cache"
+        try:
+            scheduler = Scheduler(quantum, engine)
+            for test_name, args, stdin, expected_output in programs:
+                assembler = Assembler(f"tests/{test_name}.asm")
+                assembler.assemble(f"tests/{test_name}.bin")
+                scheduler.spawn(f"tests/{test_name}.bin", args, stdin, test_name)
+            guests = asyncio.run(scheduler.run())
+            
+            message = None
+            for guest, (test_name, args, stdin, expected_output) in zip(guests, programs):
+                output = guest["output"].getvalue().decode("latin-1").strip()
+                if guest["result"].status != RunResult.HALTED:
+                    message = f"{test_name}: expected a halt, got {guest['result']}"
+                elif output != expected_output:
+                    message = f"{test_name}: expected '{expected_output}', got '{output}'"
+            if message is None and scheduler.stats["parks"] == 0:
+                message = "Expected STDIN/FILE calls to park"
+            
+            if message is None:
+                print("PASS")
+                self.tests_passed += 1
+                self.test_results.append(("scheduler", "PASS", ""))
+            else:
+                print("FAIL")
+                self.tests_failed += 1
+                self.test_results.append(("scheduler", "FAIL", message))
+        except Exception as e:
+            print("ERROR")
+            self.tests_failed += 1
+            self.test_results.append(("scheduler", "ERROR", str(e)))
+
+    def run_batch_test(self, test_name, jobs, processes=2):
+        """Run a test once per (args, stdin, expected output) job across worker processes and verify every run"""
+        print(f"Running {test_name} as a batch of {len(jobs)} jobs...", end=" ")
+        
+        # Budgets need an engine that counts instructions
+        engine = self.engine if self.engine in ISA().budgeted_engines else "cache"
+        try:
+            assembler = Assembler(f"tests/{test_name}.asm")
+            assembler.assemble(f"tests/{test_name}.bin")
+            
+            with Batch(f"tests/{test_name}.bin", processes, engine) as batch:
+                results = batch.run([(args, stdin) for args, stdin, expected_output in jobs] * 2)
+            
+            message = None
+            for result, (args, stdin, expected_output) in zip(results, jobs * 2):
+                output = result["stdout"].decode("latin-1").strip()
+                if result["status"] != RunResult.HALTED:
+                    message = f"{args}: expected a halt, got {result['status']} ({result['error']})"
+                elif output != expected_output:
+                    message = f"{args}: expected '{expected_output}', got '{output}'"
+            # The same job run twice retires the same instructions, whichever worker and state it ran after
+            counts = [result["instructions"] for result in results]
+            if message is None and counts[:len(jobs)] != counts[len(jobs):]:
+                message = f"Expected repeated jobs to match, got instruction counts {counts}"
+            
+            if message is None:
+                print("PASS")
+                self.tests_passed += 1
+                self.test_results.append((test_name, "PASS", ""))
+            else:
+                print("FAIL")
+                self.tests_failed += 1
+                self.test_results.append((test_name, "FAIL", message))
+        except Exception as e:
+            print("ERROR")
+            self.tests_failed += 1
+            self.test_results.append((test_name, "ERROR", str(e)))
+
+    def run_lockstep_test(self, test_name, jobs):
+        """Run a test once per (stdin, expected output) job as lanes of one Lockstep and verify every lane against a scalar run"""
+        print(f"Running {test_name} as {len(jobs)} lockstep lanes...", end=" ")
+        
+        if np is None:
+            print("SKIP (needs NumPy)")
+            return
+        # Lanes that peel off finish on an engine that counts instructions
+        engine = self.engine if self.engine in ISA().budgeted_engines else "cache"
+        try:
+            assembler = Assembler(f"tests/{test_name}.asm")
+            assembler.assemble(f"tests/{test_name}.bin")
+            
+            lockstep = Lockstep(f"tests/{test_name}.bin", engine)
+            results = lockstep.run([(None, stdin) for stdin, expected_output in jobs])
+            
+            message = None
+            for result, (stdin, expected_output) in zip(results, jobs):
+                output = result["stdout"].decode("latin-1").strip()
+                isa = ISA()
+                isa.console.stdin = io.BytesIO(stdin)
+                isa.console.stdout = io.BytesIO()
+                scalar = isa.run(f"tests/{test_name}.bin", False, engine=engine, max_instructions=float("inf"))
+                if result["status"] != RunResult.HALTED:
+                    message = f"{stdin!r}: expected a halt, got {result['status']} ({result['error']})"
+                elif output != expected_output:
+                    message = f"{stdin!r}: expected '{expected_output}', got '{output}'"
+                elif (result["reg"], result["instructions"]) != (isa.reg, scalar.instructions):
+                    message = f"{stdin!r}: expected registers {isa.reg} after {scalar.instructions} instructions, got {result['reg']} after {result['instructions']}"
+            # Diverged lanes run together again once they reach the same PC
+            stats = lockstep.stats
+            if message is None and (stats["peeled"] or stats["lane_steps"] < 2 * stats["steps"]):
+                message = f"Expected the lanes to share steps without peeling off, got {stats}"
+            
+            if message is None:
+                print("PASS")
+                self.tests_passed += 1
+                self.test_results.append((test_name, "PASS", ""))
+            else:
+                print("FAIL")
+                self.tests_failed += 1
+                self.test_results.append((test_name, "FAIL", message))
+        except Exception as e:
+            print("ERROR")
+            self.tests_failed += 1
+            self.test_results.append((test_name, "ERROR", str(e)))
+
+    def run_daemon_test(self, jobs):
+        """Run (test name, args, stdin, expected output) jobs twice through a Daemon on a temporary socket and verify every response"""
+        print(f"Running {len(jobs)} jobs twice through the daemon...", end=" ")
+        
+        # The daemon counts instructions, so it needs an engine that does
+        engine = self.engine if self.engine in ISA().budgeted_engines else "cache"
+        try:
+            for test_name, args, stdin, expected_output in jobs:
+                assembler = Assembler(f"tests/{test_name}.asm")
+                assembler.assemble(f"tests/{test_name}.bin")
+            
+            async def serve_and_run(path):
+                daemon = Daemon(path, len(jobs), engine)
+                server = await daemon.start()
+                async with server:
+                    client = Client(path)
+                    def run(test_name, args, stdin):
+                        stdout = io.BytesIO()
+                        response = client.run(f"tests/{test_name}.bin", args, stdin, stdout)
+                        return response, stdout.getvalue().decode("latin-1").strip()
+                    # Clients block, they run on threads while the daemon serves them on this loop
+                    first = await asyncio.gather(*(asyncio.to_thread(run, *job[:3]) for job in jobs))
+                    second = [await asyncio.to_thread(run, *job[:3]) for job in jobs]
+                    # Requests that are valid JSON but not an object are rejected like malformed JSON
+                    rejected = [await asyncio.to_thread(client.request, request) for request in ([], 1)]
+                    stats = await asyncio.to_thread(client.stats)
+                daemon.close()
+                return first + second, rejected, stats
+            
+            with tempfile.TemporaryDirectory() as directory:
+                runs, rejected, stats = asyncio.run(serve_and_run(os.path.join(directory, "phase4.sock")))
+            
+            message = None
+            for (response, output), (test_name, args, stdin, expected_output) in zip(runs, jobs * 2):
+                if response["status"] != RunResult.HALTED:
+                    message = f"{test_name}: expected a halt, got {response['status']} ({response['error']})"
+                elif output != expected_output:
+                    message = f"{test_name}: expected '{expected_output}', got '{output}'"
+            # A binary run again goes back to an ISA that still holds it and retires the same instructions
+            counts = [response["instructions"] for response, output in runs]
+            if message is None and counts[:len(jobs)] != counts[len(jobs):]:
+                message = f"Expected repeated jobs to match, got instruction counts {counts}"
+            elif message is None and not stats["warm"]:
+                message = f"Expected repeated binaries to reuse their snapshot, got {stats}"
+            elif message is None and any(response["status"] != RunResult.FAULTED for response in rejected):
+                message = f"Expected non-object requests to fault, got {rejected}"
+            
+            if message is None:
+                print("PASS")
+                self.tests_passed += 1
+                self.test_results.append(("daemon", "PASS", ""))
+            else:
+                print("FAIL")
+                self.tests_failed += 1
+                self.test_results.append(("daemon", "FAIL", message))
+        except Exception as e:
+            print("ERROR")
+            self.tests_failed += 1
+            self.test_results.append(("daemon", "ERROR", str(e)))
+
     def run_test_with_args(self, test_name, args, expected_output):
         """Run a test with command line arguments and verify results"""
         print(f"Running {test_name} with args {args}...", end=" ")
@@ -142,10 +830,30 @@ class TestRunner:
             self.tests_failed += 1
             self.test_results.append((test_name, "ERROR", str(e)))
 
+    def run_test_with_stdin(self, test_name, stdin, expected_output):
+        """Run a test with stdin input and verify results"""
+        print(f"Running {test_name} with stdin {stdin!r}...", end=" ")
+        
+        try:
+            output = self.run_isa_test_with_stdin(test_name, stdin)
+            if output == expected_output:
+                print("PASS")
+                self.tests_passed += 1
+                self.test_results.append((test_name, "PASS", ""))
+            else:
+                print("FAIL")
+                self.tests_failed += 1
+                self.test_results.append((test_name, "FAIL", f"Expected '{expected_output}', got '{output}'"))
+        except Exception as e:
+            print("ERROR")
+            self.tests_failed += 1
+            self.test_results.append((test_name, "ERROR", str(e)))
+
     def run_all_tests(self):
         """Run all tests with their expected outcomes"""
-        print("Running ISA Tests...")
+        print(f"Running ISA Tests ({self.engine} engine)...")
         print("=" * 50)
+        start = time.perf_counter()
         
         # Tests that modify registers only
         register_tests = [
@@ -205,6 +913,13 @@ class TestRunner:
             ("data_byte", "A"),
             ("data_string", "Hello"),
             ("file", "HelloWorld!"),
+            ("file_mmap", "HelloWorld!"),
+            ("str", "5\n0\n1\n2\n5\nHello"),
+            ("mem", "AAA\nHello\nHHello\n5"),
+            ("num", "31\n4\n42\n3\nFF\n2\n1234\n4"),
+            ("heap", "1\nHello\n0"),
+            ("mmio", "Hi!\n1"),
+            ("mmio_below", "88\n1"), # Stores ending at MMIO_START stay plain memory stores
         ]
         
         # Tests that just need to run without error
@@ -231,11 +946,96 @@ class TestRunner:
         # Run tests with command line arguments
         self.run_test_with_args("concat", ["Hello", "World"], "HelloWorld")
         
+        # Run tests reading stdin
+        self.run_test_with_stdin("stdin", b"Hello\nWorld\n42\nabc", "Hello\n5\nWor\nld\n42\n3\na\n0")
+        self.run_test_with_stdin("factorial", b"5\n", "120")
+        self.run_test_with_stdin("fibonacci", b"10\n", "55")
+
+        # Console output written out at SLEEP, before the read, at HALT or the fault, and per line with line_threshold 1
+        self.run_console_test("console", [
+            (b"42\n", 64, ["1\n", "2\n3\n", "42\n2\n"], 2, None),
+            (b"0\n", 64, ["1\n", "2\n3\n", "0\n"], 2, ZeroDivisionError),
+            (b"42\n", 1, ["1\n", "2\n", "3\n", "42\n", "2\n"], 3, None),
+        ])
+
+        # Superinstructions fused by the cache engine, checked against the same run with fusion off
+        self.run_fusion_test("fuse_cmp", "3", {"CMP_JZ": 3, "CMP_JCC": 2, "CMP_JNZ": 1})
+        self.run_fusion_test("fuse_ld_cmp", "5", {"LD_CMP_JZ": 1, "LD_CMP_JNZ": 1, "LD_CMP_JCC": 1, "LD_CMP": 1})
+        self.run_fusion_test("fuse_push_pop", "4\n3\n2\n1", {"PUSH_N": 1, "POP_N": 1})
+        self.run_fusion_test("fuse_branch_mid", "3\n2\n1\n2\n1\n1", {"LD_CMP_JZ": 8, "CMP_JZ": 1, "PUSH_N": 2, "POP_N": 1})
+        self.run_fusion_test("fuse_store", "1", {"LD_CMP_JZ": 3})
+
+        # Run tests under instruction and time budgets
+        self.run_budget_test("budget", "100", 303, 10)
+        self.run_budget_test("budget", "100", 303, 2) # Smaller than the 3-instruction loop block
+        self.run_fault_test("fault", ZeroDivisionError)
+        
+        # Counted engine counters: main (5) + 4 recursive levels (6 each) + the base case (3) + 5 RETs
+        self.run_counted_test("factorial", b"5\n", "120", 37, {"factorial": 5})
+
+        # Profile engine samples, one every 5 of the same 37 instructions
+        self.run_profile_test("factorial", b"5\n", "120", 5, {
+            "main": 1,
+            "main;factorial": 1,
+            "main;factorial;factorial": 1,
+            "main;factorial;factorial;factorial": 2,
+            "main;factorial;factorial;factorial;factorial": 1,
+            "main;factorial;factorial;factorial;factorial;factorial;base": 1,
+        })
+        
+        # Trace engine records
+        self.run_trace_test("trace", "42\n2", [
+            "000003 SW",
+            "000007 LH",
+            "00000C LH R1=10",
+            "000011 SYS R1=2 R2=42",
+            "000015 SYS",
+            "000019 SYS",
+            "00001D HALT",
+        ])
+        self.run_tracer_error_test()
+        
+        # Recompiled modules against the cache engine
+        self.run_recompiled_test("factorial", [], b"5\n", "120")
+        self.run_recompiled_test("concat", ["Hello", "World"], b"", "HelloWorld")
+        self.run_recompiled_test("heap", [], b"", "1\nHello\n0")
+        
+        # Run tests side by side in one process
+        self.run_scheduler_test([
+            ("stdin", None, b"Hello\nWorld\n42\nabc", "Hello\n5\nWor\nld\n42\n3\na\n0"),
+            ("concat", ["Hello", "World"], b"", "HelloWorld"),
+            ("budget", None, b"", "100"),
+            ("str", None, b"", "5\n0\n1\n2\n5\nHello"),
+        ])
+        
+        # Run tests across worker processes sharing one loaded binary
+        self.run_batch_test("concat", [
+            (["Hello", "World"], b"", "HelloWorld"),
+            (["a", "b"], b"", "ab"),
+            (["phase", "4"], b"", "phase4"),
+        ])
+        
+        # Run tests as lanes of one vectorized machine, lanes given different inputs diverge and rejoin
+        self.run_lockstep_test("factorial", [(f"{n}\n".encode(), str(factorial)) for n, factorial in enumerate([1, 1, 2, 6, 24, 120, 720, 5040])])
+        self.run_lockstep_test("fibonacci", [(f"{n}\n".encode(), str(fibonacci)) for n, fibonacci in enumerate([0, 1, 1, 2, 3, 5, 8, 13, 21, 34])])
+        
+        # Run tests through a daemon keeping ISAs loaded between runs
+        self.run_daemon_test([
+            ("concat", ["Hello", "World"], b"", "HelloWorld"),
+            ("factorial", None, b"5\n", "120"),
+            ("stdin", None, b"Hello\nWorld\n42\nabc", "Hello\n5\nWor\nld\n42\n3\na\n0"),
+        ])
+        
+        # Run tests from a snapshot
+        self.run_fork_test("concat", ["Hello", "World"], "HelloWorld")
+        self.run_fork_config_test("concat", ["Hello", "World"], 0x0005) # STDOUT_CHAR_NR
+        
         # Print summary
         print("=" * 50)
         print(f"Tests passed: {self.tests_passed}")
         print(f"Tests failed: {self.tests_failed}")
         print(f"Total tests: {self.tests_passed + self.tests_failed}")
+        print(f"Elapsed: {time.perf_counter() - start:.3f}s")
         
         if self.tests_failed > 0:
             print("\nFailed tests:")
@@ -246,6 +1046,8 @@ class TestRunner:
         return self.tests_failed == 0
 
 if __name__ == "__main__":
-    runner = TestRunner()
+    # ./test.py [match|table|cache|block]
+    engine = sys.argv[1] if len(sys.argv) > 1 else "cache"
+    runner = TestRunner(engine)
     success = runner.run_all_tests()
     sys.exit(0 if success else 1)
\ No newline at end of file
@@ -0,0 +1,11 @@
+; Test instruction budgets: counts R0 up to 100 and prints it, 303 instructions in total
+; The test runner runs it in slices of a few instructions and resumes until it halts
+
+main:
+    LH R1, 100
+loop:
+    INC R0
+    CMP R0, R1
+    JNZ loop
+    SYS R0, 0x0002
+    HALT
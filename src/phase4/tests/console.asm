@@ -0,0 +1,18 @@
+; Test console output buffering around input, SLEEP, HALT and faults
+; Reads a number and divides 84 by it, 0 faults after its output was buffered
+; Expected output: 1 2 3, the number read, then 84 divided by it
+
+LH R1, 1
+SYS R1, 0x0002        ; Buffered
+LH R0, 0
+SYS R0, 0x0302        ; SLEEP 0 ms, flushes 1
+LH R1, 2
+SYS R1, 0x0002
+LH R1, 3
+SYS R1, 0x0002
+SYS R2, 0x0000        ; STDIN_INT, flushes 2 and 3 before reading
+SYS R2, 0x0002
+LH R3, 84
+DIV R3, R2            ; Faults on 0, the number read is flushed with the fault
+SYS R3, 0x0002
+HALT                  ; Flushes the number read and the quotient
@@ -0,0 +1,19 @@
+; Test recursion: reads n from stdin and prints n!
+; Lanes given different n return from different depths (see lockstep.py)
+
+main:
+    SYS R7, 0x0000        ; STDIN_INT n
+    LH R0, 1
+    CALL factorial
+    SYS R0, 0x0002
+    HALT
+
+factorial:                ; R0 *= R7 * (R7 - 1) * ... * 2
+    LH R1, 1
+    CMP R7, R1
+    JLE base
+    MUL R0, R7
+    DEC R7
+    CALL factorial
+base:
+    RET
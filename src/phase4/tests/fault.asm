@@ -0,0 +1,5 @@
+LH R0, 20
+LH R1, 0
+DIV R0, R1
+HALT
+; Expected: run() raises ZeroDivisionError, a budgeted run returns it as FAULTED
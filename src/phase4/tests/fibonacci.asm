@@ -0,0 +1,20 @@
+; Test a counted loop: reads n from stdin and prints the nth Fibonacci number
+; Lanes given different n leave the loop at different times (see lockstep.py)
+
+main:
+    SYS R7, 0x0000        ; STDIN_INT n
+    LH R0, 0
+    LH R1, 1
+    LH R3, 0
+loop:
+    CMP R7, R3
+    JZ done
+    MOV R2, R0
+    ADD R2, R1
+    MOV R0, R1
+    MOV R1, R2
+    DEC R7
+    JMP loop
+done:
+    SYS R0, 0x0002
+    HALT
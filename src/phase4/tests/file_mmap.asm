@@ -0,0 +1,16 @@
+; Test FILE_MMAP: maps test_file.txt (written by the file test) into a buffer and prints it
+
+.data
+filename = .asciiz 'test_file.txt'
+map_buffer = .byte 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0  ; 15 bytes for the file + NUL terminator
+
+.code
+main:
+    LH R0, filename       ; R0 = address of filename
+    LH R1, map_buffer     ; R1 = address to map at
+    LH R2, 15             ; R2 = at most 15 bytes
+    SYS R3, 0x0104        ; FILE_MMAP system call, R3 = bytes mapped
+    
+    LH R1, map_buffer
+    SYS R1, 0x0006        ; Print the mapped file
+    HALT
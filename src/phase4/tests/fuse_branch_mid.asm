@@ -0,0 +1,50 @@
+; Test branches into the middle of fused sequences
+; An LH+CMP+JZ is run from its start, then entered at its CMP and at its JZ, a PUSH run is entered at its second PUSH
+; Expected output: 3 (passes through the JZ), then 2 1 2 1 1 popped off the stack
+
+LH R0, 0
+LH R1, 1
+top:
+LH R2, 1              ; LD_CMP_JZ when entered at top
+mid:
+CMP R1, R2            ; CMP_JZ when entered at mid
+jcc:
+JZ taken              ; A plain JZ when entered at jcc
+HALT
+taken:
+INC R0
+LH R3, 1
+CMP R0, R3
+JZ again_mid          ; After the first pass
+LH R3, 2
+CMP R0, R3
+JZ again_jcc          ; After the second pass
+SYS R0, 0x0002        ; 3
+LH R4, 0
+push:
+PUSH R1               ; PUSH_N of 3 when entered at push
+push_mid:
+PUSH R2               ; PUSH_N of 2 when entered at push_mid
+PUSH R3
+INC R4
+LH R5, 1
+CMP R4, R5
+JZ again_push
+POP R6
+POP R7
+POP R8
+POP R9
+POP R10
+SYS R6, 0x0002
+SYS R7, 0x0002
+SYS R8, 0x0002
+SYS R9, 0x0002
+SYS R10, 0x0002
+HALT
+again_mid:
+JMP mid
+again_jcc:
+CMP R1, R1            ; Sets Z for the JZ at jcc
+JMP jcc
+again_push:
+JMP push_mid
@@ -0,0 +1,18 @@
+; Test CMP+Jcc superinstructions: CMP+JZ, CMP+JNZ and CMP+JL (any other condition), taken and not taken
+; Expected output: 3, with CMP_JZ run 3 times, CMP_JCC twice and CMP_JNZ once
+
+LH R0, 0
+LH R1, 3
+loop:
+INC R0
+CMP R0, R1            ; CMP_JZ, taken on the third pass
+JZ last
+CMP R0, R1            ; CMP_JCC, taken on the first two passes
+JL loop
+last:
+CMP R0, R1            ; CMP_JNZ, not taken
+JNZ fail
+SYS R0, 0x0002        ; 3
+HALT
+fail:
+HALT
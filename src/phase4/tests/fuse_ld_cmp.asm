@@ -0,0 +1,27 @@
+; Test LD+CMP(+Jcc) superinstructions: an immediate load into the register a CMP reads, with and without a jump after it
+; Expected output: 5, with LD_CMP_JZ, LD_CMP_JNZ, LD_CMP_JCC and LD_CMP run once each
+
+LH R1, 5
+LH R2, 5              ; LD_CMP_JZ, taken
+CMP R1, R2
+JZ a
+HALT
+a:
+LW R2, 7              ; LD_CMP_JNZ, taken
+CMP R1, R2
+JNZ b
+HALT
+b:
+LD R2, 3              ; LD_CMP_JCC, taken (5 > 3)
+CMP R1, R2
+JG c
+HALT
+c:
+LH R2, 9              ; LD_CMP, the flags are read two instructions later
+CMP R1, R2
+NOP
+JL d
+HALT
+d:
+SYS R1, 0x0002        ; 5
+HALT
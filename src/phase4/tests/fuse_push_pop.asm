@@ -0,0 +1,20 @@
+; Test PUSH/POP runs fused into PUSH_N and POP_N
+; Expected output: 4 3 2 1 on separate lines, the stack pointer back where it started
+
+LH R1, 1
+LH R2, 2
+LH R3, 3
+LH R4, 4
+PUSH R1               ; PUSH_N of 4 registers
+PUSH R2
+PUSH R3
+PUSH R4
+POP R5                ; POP_N of 4 registers, in reverse order
+POP R6
+POP R7
+POP R8
+SYS R5, 0x0002
+SYS R6, 0x0002
+SYS R7, 0x0002
+SYS R8, 0x0002
+HALT
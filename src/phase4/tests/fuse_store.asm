@@ -0,0 +1,25 @@
+; Test a store into a fused sequence: the immediate of an LH+CMP+JZ is patched after its first run
+; Expected output: 1, the second pass runs the patched immediate instead of the stale fused entry
+
+LH R0, 0
+LH R1, 5
+patch:
+LH R2, 7              ; LD_CMP_JZ, the immediate is patched to 5
+CMP R1, R2
+JZ done
+INC R0
+LH R6, 2
+CMP R0, R6
+JZ fail               ; The patch was not seen
+LH R3, patch
+LH R4, 3
+ADD R3, R4            ; Address of the LH immediate (opcode, mode and register come first)
+LH R5, 5
+SB R5, [R3]
+JMP patch
+done:
+SYS R0, 0x0002        ; 1
+HALT
+fail:
+SYS R0, 0x0002
+HALT
@@ -0,0 +1,43 @@
+; Test the heap ports: MALLOC, FREE, REALLOC
+; Allocates, frees and reuses blocks, grows a string with REALLOC and prints it
+
+.data
+hello = .asciiz 'Hello'
+
+.code
+main:
+    LH R0, 32
+    SYS R5, 0x0230        ; R5 = MALLOC 32
+    LH R0, 32
+    SYS R6, 0x0230        ; R6 = MALLOC 32, right after R5
+
+    MOV R0, R5
+    SYS R1, 0x0231        ; FREE R5
+    LH R0, 16
+    SYS R7, 0x0230        ; R7 = MALLOC 16, reuses the freed block
+    CMP R7, R5
+    JNZ fail
+    LH R1, 1
+    SYS R1, 0x0002        ; 1
+
+    ; Copy 'Hello' into R7 and grow it past R6
+    MOV R0, R7
+    LH R1, hello
+    SYS R2, 0x0203        ; STRCPY
+    MOV R0, R7
+    LH R1, 200
+    SYS R7, 0x0232        ; R7 = REALLOC R7, 200 (moves)
+    MOV R0, R7
+    SYS R0, 0x0006        ; Hello
+
+    MOV R0, R6
+    SYS R1, 0x0231        ; FREE R6
+    MOV R0, R7
+    SYS R1, 0x0231        ; FREE R7
+    SYS R1, 0x0233        ; HEAP_STATS, R1 = bytes in use
+    SYS R1, 0x0002        ; 0
+    HALT
+fail:
+    LH R1, 0
+    SYS R1, 0x0002
+    HALT
@@ -0,0 +1,30 @@
+; Test the memory ports: MEMSET, MEMCPY, MEMMOVE
+; Builds strings in a buffer and prints them
+
+.data
+hello = .asciiz 'Hello'
+buffer = .byte 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0
+
+.code
+main:
+    LH R0, buffer
+    LH R1, 65             ; 'A'
+    LH R2, 3
+    SYS R3, 0x0212        ; MEMSET buffer, 'A', 3 -> AAA
+    SYS R0, 0x0006
+
+    LH R0, buffer
+    LH R1, hello
+    LH R2, 5
+    SYS R3, 0x0210        ; MEMCPY buffer, hello, 5 -> Hello
+    SYS R0, 0x0006
+
+    LH R0, buffer
+    INC R0
+    LH R1, buffer
+    LH R2, 5
+    SYS R3, 0x0211        ; MEMMOVE buffer + 1, buffer, 5 -> HHello (overlapping)
+    LH R0, buffer
+    SYS R0, 0x0006
+    SYS R3, 0x0002        ; 5
+    HALT
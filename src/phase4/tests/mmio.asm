@@ -0,0 +1,35 @@
+; Test the memory-mapped device windows
+; Writes 'Hi!' through the console OUT register with SB and SD, then latches the timer and reads it back
+
+.data
+text = .asciiz 'Hi!'
+
+.code
+main:
+    LW R1, 3141632        ; Console OUT (0x2FF000)
+    LH R2, text
+loop:
+    LB R3, [R2]
+    LH R4, 0
+    CMP R3, R4
+    JZ done
+    SB R3, [R1]           ; One store per character, no SYS
+    INC R2
+    JMP loop
+done:
+    LH R3, 10
+    SD R3, [R1]           ; Any store width works, the low byte is written
+    
+    LW R5, 3141648        ; Timer LATCH (0x2FF010)
+    LW R6, 3141656        ; Timer NOW (0x2FF018)
+    SB R4, [R5]
+    LD R7, [R6]
+    LH R8, 0
+    CMP R7, R8
+    JZ fail
+    LH R0, 1
+    SYS R0, 0x0002        ; 1, the latch stored a time
+    HALT
+fail:
+    SYS R8, 0x0002
+    HALT
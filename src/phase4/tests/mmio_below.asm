@@ -0,0 +1,21 @@
+; Test that stores just below the device windows are plain memory stores
+; The last bytes before MMIO_START (0x2FF000) used to be heap and must not reach the console
+
+LW R1, 3141631        ; MMIO_START - 1 (0x2FEFFF)
+LW R2, 3141624        ; MMIO_START - 8 (0x2FEFF8), an SD here ends right at the window
+LH R3, 88             ; 'X', would be printed by a store to the console OUT register
+SB R3, [R1]
+LB R4, [R1]
+SYS R4, 0x0002        ; 88
+LD R5, 6365935209750747224 ; 0x5858585858585858, eight X characters
+SD R5, [R2]
+LD R6, [R2]
+CMP R5, R6
+JNZ fail
+LH R0, 1
+SYS R0, 0x0002        ; 1, the doubleword was stored and read back
+HALT
+fail:
+LH R0, 0
+SYS R0, 0x0002
+HALT
@@ -0,0 +1,37 @@
+; Test the number ports: ATOI and ITOA
+; Prints each parsed value followed by how many bytes were consumed, then formatted numbers
+
+.data
+hex_literal = .asciiz '0x1F,'
+dec_literal = .asciiz '-42abc'
+buffer = .byte 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0
+
+.code
+main:
+    LH R0, hex_literal
+    LH R1, 0
+    SYS R2, 0x0220        ; ATOI '0x1F,' detected as hex -> 31, 4 bytes
+    SYS R2, 0x0002
+    SYS R1, 0x0002
+
+    LH R0, dec_literal
+    LH R1, 10
+    SYS R2, 0x0220        ; ATOI '-42abc' base 10 -> -42, 3 bytes
+    NOT R2
+    INC R2
+    SYS R2, 0x0002        ; 42
+    SYS R1, 0x0002
+
+    LH R0, buffer
+    LH R1, 255
+    LH R2, 16
+    SYS R3, 0x0221        ; ITOA 255 base 16 -> FF, 2 digits
+    SYS R0, 0x0006
+    SYS R3, 0x0002
+
+    LH R1, 1234
+    LH R2, 0
+    SYS R3, 0x0221        ; ITOA 1234 base 10 -> 1234, 4 digits
+    SYS R0, 0x0006
+    SYS R3, 0x0002
+    HALT
@@ -0,0 +1,5 @@
+; Test budgets on a program that never halts
+
+main:
+    INC R0
+    JMP main
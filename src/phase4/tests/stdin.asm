@@ -0,0 +1,33 @@
+; Test the bulk stdin ports: STDIN_LINE and STDIN_READ, mixed with STDIN_INT
+; stdin: "Hello\nWorld\n42\nabc"
+
+.data
+buffer = .byte 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0
+
+.code
+main:
+    LH R0, buffer
+    LH R1, 23
+    SYS R2, 0x0008        ; STDIN_LINE 'Hello', 5 bytes
+    SYS R0, 0x0006
+    SYS R2, 0x0002
+
+    LH R1, 3
+    SYS R2, 0x0008        ; STDIN_LINE of at most 3 bytes 'Wor'
+    SYS R0, 0x0006
+    LH R1, 23
+    SYS R2, 0x0008        ; The rest of the line 'ld'
+    SYS R0, 0x0006
+
+    SYS R3, 0x0000        ; STDIN_INT 42
+    SYS R3, 0x0002
+
+    SYS R2, 0x0009        ; STDIN_READ everything left 'abc', 3 bytes
+    SYS R2, 0x0002
+    LB R4, buffer
+    SYS R4, 0x0003        ; a
+
+    SYS R2, 0x0008        ; STDIN_LINE at EOF -> -1
+    INC R2
+    SYS R2, 0x0002        ; 0
+    HALT
@@ -0,0 +1,43 @@
+; Test the string ports: STRLEN, STRCMP, STRCHR, STRCPY
+; Prints each result on its own line
+
+.data
+hello = .asciiz 'Hello'
+help = .asciiz 'Help'
+copy_buffer = .byte 0 0 0 0 0 0 0 0
+
+.code
+main:
+    LH R0, hello
+    SYS R2, 0x0200        ; STRLEN 'Hello' -> 5
+    SYS R2, 0x0002
+
+    LH R0, hello
+    LH R1, hello
+    SYS R2, 0x0201        ; STRCMP 'Hello', 'Hello' -> 0
+    SYS R2, 0x0002
+
+    LH R1, help
+    SYS R2, 0x0201        ; STRCMP 'Hello', 'Help' -> -1, 'l' < 'p'
+    LH R3, 0
+    CMP R2, R3
+    JL first_smaller
+    SYS R3, 0x0002        ; Not reached
+first_smaller:
+    LH R3, 1
+    SYS R3, 0x0002        ; 1
+
+    LH R0, hello
+    LH R1, 108            ; 'l'
+    SYS R2, 0x0202        ; STRCHR 'Hello', 'l' -> hello + 2
+    LH R3, hello
+    SUB R2, R3
+    SYS R2, 0x0002        ; 2
+
+    LH R0, copy_buffer
+    LH R1, hello
+    SYS R2, 0x0203        ; STRCPY copy_buffer, 'Hello' -> 5
+    SYS R2, 0x0002
+    LH R0, copy_buffer
+    SYS R0, 0x0006        ; Hello
+    HALT
@@ -0,0 +1,13 @@
+; Test the trace engine: a store in an unsupported mode (a no-op on every engine) and SYS ATOI, which writes two registers
+.data
+digits = .asciiz '42'
+
+.code
+main:
+    SW R1, [R2]           ; test.py patches the mode to 0x02 (register-to-register), stores decode that to a no-op
+    LH R0, digits
+    LH R1, 10
+    SYS R2, 0x0220        ; ATOI '42' -> R2 = 42, R1 = 2 bytes
+    SYS R2, 0x0002        ; 42
+    SYS R1, 0x0002        ; 2
+    HALT
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+# Timer device for the phase4 ISA
+# Time is counted from the last reset() (i.e. from the start of the run) on the host's monotonic clock.
+#
+# MMIO window at MMIO_START + WINDOW (see bus.py):
+# +0 LATCH - any store copies the current time into NOW
+# +8 NOW   - nanoseconds at the last latch, read with LD
+
+import time
+
+class Timer:
+    WINDOW = 0x10
+    WINDOW_LENGTH = 16
+
+    def __init__(self):
+        self.reset()
+
+    def attach(self, isa):
+        self.isa = isa
+        bus = isa.bus
+        bus.claim_port(0x0300, "TIME_NS", self.TIME_NS) # OUTPUT - Rx: NANOSECONDS SINCE THE START OF THE RUN
+        bus.claim_port(0x0301, "TIME_MS", self.TIME_MS) # OUTPUT - Rx: MILLISECONDS SINCE THE START OF THE RUN
+        bus.claim_port(0x0302, "SLEEP", self.SLEEP)     # INPUT - R0: MILLISECONDS TO SLEEP
+        bus.claim_window(isa.MMIO_START + self.WINDOW, self.WINDOW_LENGTH, self)
+
+    def now(self):
+        return time.monotonic_ns() - self.start
+
+    def TIME_NS(self, rx):
+        self.isa.reg[rx] = self.now()
+
+    def TIME_MS(self, rx):
+        self.isa.reg[rx] = self.now() // 1_000_000
+
+    def SLEEP(self, rx):
+        self.isa.console.flush()
+        time.sleep(self.isa.reg[0] / 1000)
+
+    def store(self, offset, value, width):
+        if offset == 0:
+            self.isa.memory.write_dword(self.isa.MMIO_START + self.WINDOW + 8, self.now())
+
+    def reset(self):
+        self.start = time.monotonic_ns()
+
+    def snapshot(self):
+        return None
+
+    def restore(self, state):
+        pass
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+# ./tracer.py debug_trace.bin
+
+# Binary execution trace for the phase4 ISA
+# Every retired instruction becomes one fixed-size record in a preallocated ring of chunks, an instruction that
+# changes more than one register (e.g. SYS ATOI writes Rx and R1) is followed by one CONTINUED record per extra register.
+# When the writer fills a chunk it is handed to a background thread that writes it to disk,
+# the writer only blocks if it laps the flusher and the next chunk has not been written yet.
+# A failed write stops the flusher, the error is raised from the next record() that needs a chunk or from close().
+# decode() turns a trace file back into text.
+
+import sys
+import queue
+import struct
+import threading
+from opcodes import Opcode
+
+class Tracer:
+    # pc, opcode, changed register, its new value, memory address, value written, bytes written, flags
+    RECORD = struct.Struct("<IBBQIQBB4x") # 32 bytes
+    NO_REG = 0xFF
+    NO_ADDR = 0xFFFFFFFF
+    CONTINUED = 1 # Flag: another register changed by the instruction of the previous record
+
+    CHUNK_RECORDS = 32768 # 1 MB per chunk
+    CHUNKS = 4
+
+    def __init__(self, output_fn):
+        self.output_fn = output_fn
+        self.chunk_size = self.CHUNK_RECORDS * self.RECORD.size
+        self.buf = bytearray(self.chunk_size * self.CHUNKS)
+        self.view = memoryview(self.buf)
+        self.offset = 0
+        self.chunk_end = self.chunk_size
+        self.records = 0
+        self.free = [threading.Event() for _ in range(self.CHUNKS)] # Set while a chunk may be overwritten
+        for event in self.free:
+            event.set()
+        self.free[0].clear()
+        self.pending = queue.Queue()
+        self.error = None # Exception raised by a write in the flusher thread
+        self.file = open(output_fn, "wb")
+        self.flusher = threading.Thread(target=self.flush_loop, daemon=True)
+        self.flusher.start()
+
+    def record(self, pc, opcode, reg=NO_REG, reg_val=0, addr=NO_ADDR, mem_val=0, width=0, flags=0):
+        self.RECORD.pack_into(self.buf, self.offset, pc, opcode, reg, reg_val, addr, mem_val, width, flags)
+        self.offset += self.RECORD.size
+        self.records += 1
+        if self.offset == self.chunk_end:
+            self.next_chunk()
+
+    def next_chunk(self):
+        chunk = self.offset // self.chunk_size - 1
+        self.pending.put((chunk, self.chunk_size))
+        chunk = (chunk + 1) % self.CHUNKS
+        self.free[chunk].wait()
+        if self.error is not None:
+            raise self.error
+        self.free[chunk].clear()
+        self.offset = chunk * self.chunk_size
+        self.chunk_end = self.offset + self.chunk_size
+
+    def flush_loop(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            chunk, length = item
+            start = chunk * self.chunk_size
+            try:
+                self.file.write(self.view[start : start + length])
+            except Exception as e:
+                # Wakes a writer waiting for a chunk so it raises instead of blocking forever
+                self.error = e
+                for event in self.free:
+                    event.set()
+                break
+            self.free[chunk].set()
+
+    def close(self):
+        chunk_start = self.chunk_end - self.chunk_size
+        if self.offset > chunk_start:
+            self.pending.put((chunk_start // self.chunk_size, self.offset - chunk_start))
+        self.pending.put(None)
+        self.flusher.join()
+        try:
+            self.file.close()
+        except Exception as e:
+            if self.error is None:
+                self.error = e
+        if self.error is not None:
+            raise self.error
+
+    @classmethod
+    def decode(cls, input_fn):
+        # Yields one line of text per instruction, CONTINUED records are appended to their instruction's line
+        names = {opcode.value: opcode.name for opcode in Opcode}
+        line = None
+        with open(input_fn, "rb") as f:
+            while True:
+                chunk = f.read(cls.RECORD.size * cls.CHUNK_RECORDS)
+                if not chunk:
+                    break
+                for pc, opcode, reg, reg_val, addr, mem_val, width, flags in cls.RECORD.iter_unpack(chunk):
+                    if flags & cls.CONTINUED and line is not None:
+                        line += f"  R{reg}={reg_val}"
+                        continue
+                    if line is not None:
+                        yield line
+                    line = f"{pc:06X}  {names.get(opcode, f'0x{opcode:02X}'):<5}"
+                    if reg != cls.NO_REG:
+                        line += f"  R{reg}={reg_val}"
+                    if addr != cls.NO_ADDR:
+                        line += f"  [{addr}]={mem_val:0{width * 2}X}"
+        if line is not None:
+            yield line
+
+if __name__ == '__main__':
+    if (len(sys.argv) > 1):
+        for line in Tracer.decode(sys.argv[1]):
+            print(line)